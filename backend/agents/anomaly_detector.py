@@ -1,9 +1,11 @@
 import os
-import httpx
+import asyncio
 import logging
 import json
 from dotenv import load_dotenv
 
+from utils.http_client import dashscope_generate
+
 # 加载环境变量
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 PROJECT_ROOT = os.path.dirname(os.path.dirname(BASE_DIR))
@@ -46,37 +48,37 @@ async def detect_log_anomalies(log_text: str) -> str:
             mid = total_lines // 2
             windows.append((mid, lines[mid:mid+window_size]))
             
-    combined_report = []
-    
-    async with httpx.AsyncClient(timeout=30.0) as client:
-        for start_line, chunk_lines in windows:
-            chunk_text = "\n".join(chunk_lines)
-            prompt = f"""
+    async def analyze_window(start_line: int, chunk_lines: list):
+        chunk_text = "\n".join(chunk_lines)
+        prompt = f"""
 你是一名资深系统运维专家。请分析以下日志片段（行号 {start_line+1} - {start_line+len(chunk_lines)}），找出异常。
 【日志片段】
 {chunk_text}
 【输出要求】
 仅输出异常行的行号和简要原因。如果没有异常，回答“无”。
 """
-            try:
-                response = await client.post(
-                     "https://dashscope.aliyuncs.com/api/v1/services/aigc/text-generation/generation",
-                    headers={
-                        "Authorization": f"Bearer {DASHSCOPE_API_KEY}",
-                        "Content-Type": "application/json"
-                    },
-                    json={
-                        "model": "qwen-max",
-                        "input": {"messages": [{"role": "user", "content": prompt}]},
-                        "parameters": {"temperature": 0.1}
-                    }
-                )
-                if response.status_code == 200:
-                    res_content = response.json()["output"]["choices"][0]["message"]["content"]
-                    if "无" not in res_content and "未检测到" not in res_content:
-                        combined_report.append(f"--- Window (Lines {start_line+1}~) ---\n{res_content}")
-            except Exception as e:
-                logger.error(f"Window analysis failed: {e}")
+        try:
+            response = await dashscope_generate(
+                {
+                    "model": "qwen-max",
+                    "input": {"messages": [{"role": "user", "content": prompt}]},
+                    "parameters": {"temperature": 0.1}
+                },
+                route="anomaly",
+                api_key=DASHSCOPE_API_KEY,
+                timeout=30.0
+            )
+            if response.status_code == 200:
+                res_content = response.json()["output"]["choices"][0]["message"]["content"]
+                if "无" not in res_content and "未检测到" not in res_content:
+                    return f"--- Window (Lines {start_line+1}~) ---\n{res_content}"
+        except Exception as e:
+            logger.error(f"Window analysis failed: {e}")
+        return None
+
+    # 各窗口并发请求（共享连接池，并发数受 HTTP_ROUTE_CONCURRENCY 中 anomaly 的限制），报告按窗口顺序拼接
+    results = await asyncio.gather(*(analyze_window(start_line, chunk_lines) for start_line, chunk_lines in windows))
+    combined_report = [r for r in results if r]
 
     if not combined_report:
         return "未检测到明显异常 (Checked Head/Tail/Mid windows)."
@@ -1,9 +1,10 @@
 import os
 import logging
-import httpx
 import json
 from dotenv import load_dotenv
 
+from utils.http_client import dashscope_generate
+
 # 加载环境变量
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 PROJECT_ROOT = os.path.dirname(os.path.dirname(BASE_DIR))
@@ -35,20 +36,19 @@ async def classify_with_llm(text: str) -> list:
 请仅返回 JSON 数组格式，例如 ["log"] 或 ["academic", "book"]。
 """
     try:
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            response = await client.post(
-                "https://dashscope.aliyuncs.com/api/v1/services/aigc/text-generation/generation",
-                headers={
-                    "Authorization": f"Bearer {DASHSCOPE_API_KEY}",
-                    "Content-Type": "application/json"
-                },
-                json={
-                    "model": "qwen-max",
-                    "input": {"messages": [{"role": "user", "content": prompt}]},
-                    "parameters": {"result_format": "message"}
-                }
-            )
-        
+        # 分类失败时直接回退到 general，不重试
+        response = await dashscope_generate(
+            {
+                "model": "qwen-max",
+                "input": {"messages": [{"role": "user", "content": prompt}]},
+                "parameters": {"result_format": "message"}
+            },
+            route="classify",
+            api_key=DASHSCOPE_API_KEY,
+            timeout=10.0,
+            retries=0
+        )
+
         if response.status_code == 200:
             content = response.json()["output"]["choices"][0]["message"]["content"]
             # 简单的清洗
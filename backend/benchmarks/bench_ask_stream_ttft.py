@@ -0,0 +1,169 @@
+"""
+Benchmark: time-to-first-token of streamed answers vs. the blocking completion call.
+
+Starts a local fake DashScope server that "generates" --tokens tokens, one every --token-ms.
+Without the X-DashScope-SSE header it answers once with the full text (like the blocking call
+used by /ask); with it, it streams every token as an SSE event (like /ask/stream).
+
+By default the benchmark calls utils/http_client.py directly (dashscope_generate vs.
+dashscope_stream). With --backend it measures the real endpoints instead: start the backend
+with DASHSCOPE_BASE_URL pointing at the printed fake server URL, upload a document, then pass
+the backend URL and the file id.
+
+Usage:
+    python benchmarks/bench_ask_stream_ttft.py [--tokens 200] [--token-ms 20] [--runs 5]
+    python benchmarks/bench_ask_stream_ttft.py --serve-only --port 9100
+    python benchmarks/bench_ask_stream_ttft.py --backend http://127.0.0.1:8000 --file-id <id>
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+
+def chunk(data: bytes) -> bytes:
+    return b"%x\r\n%s\r\n" % (len(data), data)
+
+
+async def start_fake_llm(port: int, tokens: int, token_delay: float):
+    async def handle(reader, writer):
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                headers = {}
+                for line in head.split(b"\r\n")[1:]:
+                    name, _, value = line.partition(b":")
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get(b"content-length", 0))
+                if length:
+                    await reader.readexactly(length)
+                words = [f"词{i} " for i in range(tokens)]
+
+                if headers.get(b"x-dashscope-sse") == b"enable":
+                    writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\n"
+                                 b"Transfer-Encoding: chunked\r\n\r\n")
+                    for i, word in enumerate(words):
+                        await asyncio.sleep(token_delay)
+                        body = {"output": {"choices": [{"message": {"role": "assistant", "content": word},
+                                                        "finish_reason": "stop" if i == tokens - 1 else "null"}]}}
+                        event = f"id:{i + 1}\nevent:result\n:HTTP_STATUS/200\ndata:{json.dumps(body, ensure_ascii=False)}\n\n"
+                        writer.write(chunk(event.encode()))
+                        await writer.drain()
+                    writer.write(b"0\r\n\r\n")
+                else:
+                    await asyncio.sleep(token_delay * tokens)
+                    body = json.dumps({"output": {"choices": [{"message": {"role": "assistant",
+                                                                           "content": "".join(words)}}]}},
+                                      ensure_ascii=False).encode()
+                    writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                                 b"Content-Length: %d\r\n\r\n" % len(body) + body)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, "127.0.0.1", port)
+    return server, server.sockets[0].getsockname()[1]
+
+
+def payload():
+    return {"model": "qwen-max", "input": {"messages": [{"role": "user", "content": "问题"}]},
+            "parameters": {"result_format": "message"}}
+
+
+async def measure_client(runs: int):
+    from utils.http_client import dashscope_generate, dashscope_stream, close_http_clients
+
+    async def blocking():
+        t0 = time.perf_counter()
+        response = await dashscope_generate(payload(), route="bench", api_key="test", timeout=300)
+        response.raise_for_status()
+        total = time.perf_counter() - t0
+        return total, total
+
+    async def streaming():
+        t0 = time.perf_counter()
+        first = None
+        async for _ in dashscope_stream(payload(), route="bench", api_key="test", timeout=300):
+            if first is None:
+                first = time.perf_counter() - t0
+        return first, time.perf_counter() - t0
+
+    results = {"blocking (dashscope_generate)": [await blocking() for _ in range(runs)],
+               "streaming (dashscope_stream)": [await streaming() for _ in range(runs)]}
+    await close_http_clients()
+    return results
+
+
+async def measure_backend(base: str, file_id: str, runs: int):
+    import httpx
+
+    async with httpx.AsyncClient(base_url=base, timeout=300) as client:
+        async def blocking(i):
+            t0 = time.perf_counter()
+            response = await client.get("/ask", params={"file_id": file_id, "question": f"benchmark question {i}"})
+            response.raise_for_status()
+            total = time.perf_counter() - t0
+            return total, total
+
+        async def streaming(i):
+            t0 = time.perf_counter()
+            first = None
+            params = {"file_id": file_id, "question": f"benchmark stream question {i}"}
+            async with client.stream("GET", "/ask/stream", params=params) as response:
+                response.raise_for_status()
+                async for line in response.aiter_lines():
+                    if first is None and line == "event: token":
+                        first = time.perf_counter() - t0
+            return first, time.perf_counter() - t0
+
+        # Distinct questions so the 5-second duplicate guard does not short-circuit
+        return {"GET /ask": [await blocking(i) for i in range(runs)],
+                "GET /ask/stream": [await streaming(i) for i in range(runs)]}
+
+
+def report(results: dict):
+    for name, samples in results.items():
+        ttft = [s[0] for s in samples]
+        total = [s[1] for s in samples]
+        print(f"{name:32s} TTFT mean {1000 * statistics.mean(ttft):8.1f}ms  "
+              f"min {1000 * min(ttft):8.1f}ms   total mean {1000 * statistics.mean(total):8.1f}ms")
+
+
+async def main_async(args):
+    server, port = await start_fake_llm(args.port, args.tokens, args.token_ms / 1000)
+    print(f"fake DashScope: http://127.0.0.1:{port}  ({args.tokens} tokens x {args.token_ms}ms)")
+    async with server:
+        if args.serve_only:
+            await server.serve_forever()
+        elif args.backend:
+            report(await measure_backend(args.backend, args.file_id, args.runs))
+        else:
+            os.environ["DASHSCOPE_BASE_URL"] = f"http://127.0.0.1:{port}"
+            report(await measure_client(args.runs))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tokens", type=int, default=200)
+    parser.add_argument("--token-ms", type=float, default=20)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--port", type=int, default=0)
+    parser.add_argument("--serve-only", action="store_true", help="only run the fake DashScope server")
+    parser.add_argument("--backend", help="measure /ask and /ask/stream on a running backend")
+    parser.add_argument("--file-id", help="uploaded file id used with --backend")
+    args = parser.parse_args()
+    if args.backend and not args.file_id:
+        parser.error("--backend requires --file-id")
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
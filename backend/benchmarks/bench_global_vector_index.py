@@ -0,0 +1,89 @@
+"""
+Benchmark: per-file retrieval loop vs. the corpus-wide HNSW index used by /api/graph/qa.
+
+The old route re-encoded the question and brute-force scanned one IndexFlat per file;
+the new one embeds once and searches a single GlobalVectorIndex. Vectors are random,
+so only latency is meaningful here, not recall.
+
+Usage:
+    python benchmarks/bench_global_vector_index.py [--chunks-per-file 40] [--encode-ms 8]
+
+--encode-ms simulates SentenceTransformer.encode for one short query (bge-small-zh on CPU
+is typically 5-15 ms). Set it to 0 to compare pure index search cost.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import faiss  # noqa: E402
+from services.vector_service import GlobalVectorIndex  # noqa: E402
+
+DIM = 512
+DOC_COUNTS = [10, 50, 100, 200, 500, 1000]
+
+
+def fake_encode(encode_ms: float):
+    if encode_ms > 0:
+        time.sleep(encode_ms / 1000.0)
+    v = np.random.rand(1, DIM).astype("float32")
+    return v
+
+
+def bench(doc_count: int, chunks_per_file: int, encode_ms: float, queries: int):
+    rng = np.random.default_rng(doc_count)
+    per_file = []
+    global_index = GlobalVectorIndex(tempfile.mkdtemp())
+    global_index.loaded = True
+    for i in range(doc_count):
+        vectors = rng.random((chunks_per_file, DIM), dtype=np.float32)
+        flat = faiss.IndexFlatL2(DIM)
+        flat.add(vectors)
+        per_file.append(flat)
+        global_index.add_vectors(f"file-{i}", vectors)
+
+    # Old path: encode + k=2 flat search for every file
+    start = time.perf_counter()
+    for _ in range(queries):
+        for flat in per_file:
+            q = fake_encode(encode_ms)
+            flat.search(q, 2)
+    loop_ms = (time.perf_counter() - start) * 1000 / queries
+
+    # New path: encode once + one HNSW search
+    start = time.perf_counter()
+    for _ in range(queries):
+        q = fake_encode(encode_ms)
+        global_index.search(q, k=20)
+    global_ms = (time.perf_counter() - start) * 1000 / queries
+
+    # New path with a file_id filter (single document)
+    start = time.perf_counter()
+    for _ in range(queries):
+        q = fake_encode(encode_ms)
+        global_index.search(q, k=5, file_ids=["file-0"])
+    filtered_ms = (time.perf_counter() - start) * 1000 / queries
+    return loop_ms, global_ms, filtered_ms
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunks-per-file", type=int, default=40)
+    parser.add_argument("--encode-ms", type=float, default=8.0)
+    parser.add_argument("--queries", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"dim={DIM} chunks/file={args.chunks_per_file} simulated encode={args.encode_ms}ms")
+    print(f"{'docs':>6} {'chunks':>8} {'per-file loop (ms)':>20} {'global HNSW (ms)':>18} {'HNSW+filter (ms)':>18}")
+    for n in DOC_COUNTS:
+        loop_ms, global_ms, filtered_ms = bench(n, args.chunks_per_file, args.encode_ms, args.queries)
+        print(f"{n:>6} {n * args.chunks_per_file:>8} {loop_ms:>20.1f} {global_ms:>18.2f} {filtered_ms:>18.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""
+Benchmark: fuzzy concept lookup over 100k global graph node names.
+
+Compares the previous search_nodes_fuzzy (load every GlobalNode.name, then
+difflib.get_close_matches) with the in-memory n-gram index of graph_cache, used by
+GraphService.search_nodes_fuzzy and GraphRAG entity linking (match_names). Names mix Latin
+multi-word terms and Chinese terms; queries are existing names with one character dropped.
+For every query it reports whether the top match scores as well as the best
+get_close_matches hit, and checks incremental index maintenance on add / remove.
+
+Usage:
+    python benchmarks/bench_graph_fuzzy_lookup.py [--names 100000] [--queries 100]
+"""
+import argparse
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+from difflib import SequenceMatcher, get_close_matches
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+# Pseudo-words from consonant-vowel(-coda) syllables; names reuse a shared vocabulary the way
+# real concept names reuse terms ("network", "learning", ...)
+SYLLABLES = [c + v + coda for c in "bcdfghklmnprstvz" for v in "aeiou" for coda in ("", "n", "r", "s", "l", "x", "m")]
+CJK = "的一是在不了有和人这中大为上个国我以要他时来用们生到作地于出就分对成会可主发年动同工也能下过子说产种面而方后多定行学法所民得经十三之进着等部度家电力里如水化高自二理起小物现实加量都两体制机当使点从业本去把性好应开它合还因由其些然前外天政四日那社义事平形相全表间样与关各重新线内数正心反你明看原又么利比或但质气第向道命此变条只没结解问意建月公无系军很情者最立代想已通并提直题党程展五果料象员革位入常文总次品式活设及管特件长求老头基资边流路级少图山统接知较将组见计别她手角期根论运农指几九区强放决西被干做必战先回则任取据处队南给色光门即保治北造百规热领七海口东导器压志世金增争济阶油思术极交受联什认六共权收证改清己美再采转更单风切打白教速花带安场身车例真务具万每目至达走积示议声报斗完类八离华名确才科张信马节话米整空元况今集温传土许步群广石记需段研界拉林律叫且究观越织装影算低持音众书布复容儿须际商非验连断深难近矿千周委素技备半办青省列习响约支般史感劳便团往酸历市克何除消构府称太准精值号率族维划选标写存候毛亲快效斯院查江型眼王按格养易置派层片始却专状育厂京识适属圆包火住调满县局照参红细引听该铁价严"
+
+
+def make_names(n: int, rng: random.Random, vocabulary: int = 20000):
+    words = sorted({"".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 3))) for _ in range(vocabulary)})
+    terms = sorted({"".join(rng.choice(CJK) for _ in range(rng.randint(2, 4))) for _ in range(vocabulary // 2)})
+
+    names = set()
+    while len(names) < n:
+        if rng.random() < 0.3:
+            names.add("".join(rng.sample(terms, rng.randint(1, 2))))
+        else:
+            names.add(" ".join(rng.choice(words) for _ in range(rng.randint(1, 3))).title())
+    return sorted(names)
+
+
+def drop_char(name: str, rng: random.Random) -> str:
+    i = rng.randrange(len(name))
+    return name[:i] + name[i + 1:]
+
+
+def best_score(query: str, found) -> float:
+    return SequenceMatcher(None, found[0].lower(), query.lower()).ratio() if found else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--names", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=100)
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    from database import Base, create_db_engine, make_session_factory
+    from models.graph import GlobalNode, GlobalEdge, NodeDocument
+    from services.graph_service import GraphService, graph_cache
+
+    rng = random.Random(0)
+    names = make_names(args.names, rng)
+    queries = [drop_char(name, rng) for name in rng.sample(names, args.queries)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_db_engine(f"sqlite:///{os.path.join(tmp, 'graph.db')}")
+        Base.metadata.create_all(engine, tables=[GlobalNode.__table__, GlobalEdge.__table__, NodeDocument.__table__])
+        Session = make_session_factory(engine)
+        db = Session()
+        db.execute(GlobalNode.__table__.insert(), [
+            {"id": f"n{i:06d}", "name": name, "category": "Concept", "digest": "", "weight": 1.0}
+            for i, name in enumerate(names)])
+        db.execute(NodeDocument.__table__.insert(), [{"node_id": f"n{i:06d}", "doc_id": "doc-bench"}
+                                                     for i in range(len(names))])
+        db.commit()
+        service = GraphService(db)
+
+        t0 = time.perf_counter()
+        graph_cache.reload(db)
+        print(f"{len(names)} names: graph cache load incl. n-gram index {time.perf_counter() - t0:6.2f}s")
+
+        # Old: every call loads all names and runs get_close_matches over them (timed on a subset)
+        old_queries = queries[:max(1, args.queries // 20)]
+        t0 = time.perf_counter()
+        for q in old_queries:
+            all_names = [n[0] for n in db.query(GlobalNode.name).all()]
+            get_close_matches(q, all_names, n=1, cutoff=0.6)
+        old_ms = 1000 * (time.perf_counter() - t0) / len(old_queries)
+
+        t0 = time.perf_counter()
+        service_results = {q: service.search_nodes_fuzzy(q, limit=1) for q in queries}
+        service_ms = 1000 * (time.perf_counter() - t0) / len(queries)
+
+        t0 = time.perf_counter()
+        with graph_cache.reading(db):
+            index_results = {q: graph_cache.match_names(q, limit=1) for q in queries}
+        index_ms = 1000 * (time.perf_counter() - t0) / len(queries)
+
+        # Reference best score of every query over all names (case-insensitive like the index;
+        # ties count as agreement)
+        lowered = [name.lower() for name in names]
+        expected = {q: best_score(q, get_close_matches(q.lower(), lowered, n=1, cutoff=0.6)) for q in queries}
+
+        def agree(found):
+            return sum(1 for q in queries if best_score(q, found(q)) == expected[q])
+
+        service_agree = agree(lambda q: [n.name for n in service_results[q]])
+        index_agree = agree(lambda q: [name for _, name, _ in index_results[q]])
+        print(f"get_close_matches (old)  {old_ms:9.2f}ms/query")
+        print(f"search_nodes_fuzzy       {service_ms:9.3f}ms/query   top-1 agrees {service_agree}/{len(queries)}")
+        print(f"graph_cache.match_names  {index_ms:9.3f}ms/query   top-1 agrees {index_agree}/{len(queries)}")
+
+        # Incremental maintenance
+        service.add_node("Zyxwvut Concept", source_doc_id="doc-new")
+        found = [n.name for n in service.search_nodes_fuzzy("Zyxwvut Concep", limit=1)]
+        service.remove_document_knowledge("doc-new")
+        gone = service.search_nodes_fuzzy("Zyxwvut Concep", limit=1)
+        with graph_cache.reading(db):
+            cached = graph_cache.match_names("Zyxwvut Concep", limit=1)
+        print(f"incremental: added node found {found}, removed node found {[n.name for n in gone]} / {cached}")
+        db.close()
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Benchmark: syncing one document's knowledge graph into the global graph.
+
+Compares the per-item GraphService.add_node / add_edge loop (a lookup, commit and refresh per
+call) with GraphService.merge_subgraph (one IN query, one transaction) on a fresh file-backed
+SQLite database using the app's engine settings (WAL, synchronous=NORMAL). Each mode syncs
+the same graph twice: first into an empty graph (inserts), then again (updates), and the
+final node / edge / weight state of both modes is compared.
+
+Usage:
+    python benchmarks/bench_graph_merge_subgraph.py [--nodes 500] [--edges 1000]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+
+def make_graph(n_nodes: int, n_edges: int, seed: int = 0):
+    rng = random.Random(seed)
+    nodes = [{"id": f"concept {i}", "label": f"concept {i}", "type": rng.choice(["Concept", "Method", "Person"])}
+             for i in range(n_nodes)]
+    edges = []
+    for _ in range(n_edges):
+        a, b = rng.sample(range(n_nodes), 2)
+        edges.append({"source": f"concept {a}", "target": f"concept {b}", "relation": "related_to"})
+    return nodes, edges
+
+
+def sync_loop(service, nodes, edges, doc_id):
+    """What process_file_background used to do"""
+    for node in nodes:
+        service.add_node(name=node.get("label") or node.get("id"), category=node.get("type", "Concept"),
+                         source_doc_id=doc_id)
+    for edge in edges:
+        service.add_edge(source_name=edge["source"], target_name=edge["target"],
+                         relation=edge.get("relation", "related_to"))
+
+
+def sync_merge(service, nodes, edges, doc_id):
+    service.merge_subgraph(nodes, edges, doc_id=doc_id)
+
+
+def snapshot(db):
+    from models.graph import GlobalNode, GlobalEdge, NodeDocument
+    names = {n.id: n.name for n in db.query(GlobalNode)}
+    docs = {}
+    for node_id, doc_id in db.query(NodeDocument.node_id, NodeDocument.doc_id):
+        docs.setdefault(node_id, []).append(doc_id)
+    nodes = sorted((n.name, n.category, tuple(sorted(docs.get(n.id, [])))) for n in db.query(GlobalNode))
+    edges = sorted((names[e.source_id], names[e.target_id], e.relation, round(e.weight, 6)) for e in db.query(GlobalEdge))
+    return nodes, edges
+
+
+def run(mode: str, sync, nodes, edges, tmp: str):
+    from database import Base, create_db_engine, make_session_factory
+    from models.graph import GlobalNode, GlobalEdge, NodeDocument
+    from services.graph_service import GraphService
+
+    engine = create_db_engine(f"sqlite:///{os.path.join(tmp, sync.__name__ + '.db')}")
+    Base.metadata.create_all(engine, tables=[GlobalNode.__table__, GlobalEdge.__table__, NodeDocument.__table__])
+    db = make_session_factory(engine)()
+    try:
+        service = GraphService(db)
+        timings = []
+        for doc_id in ("doc-1", "doc-2"):
+            t0 = time.perf_counter()
+            sync(service, nodes, edges, doc_id)
+            timings.append(time.perf_counter() - t0)
+        print(f"{mode:14s} first sync {1000 * timings[0]:9.1f}ms   re-sync {1000 * timings[1]:9.1f}ms")
+        return snapshot(db)
+    finally:
+        db.close()
+        engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--nodes", type=int, default=500)
+    parser.add_argument("--edges", type=int, default=1000)
+    args = parser.parse_args()
+
+    nodes, edges = make_graph(args.nodes, args.edges)
+    print(f"graph: {len(nodes)} nodes, {len(edges)} edges")
+    with tempfile.TemporaryDirectory() as tmp:
+        looped = run("add_node/edge", sync_loop, nodes, edges, tmp)
+        merged = run("merge_subgraph", sync_merge, nodes, edges, tmp)
+    print("same final graph:", looped == merged)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+Benchmark: /api/graph/path style queries on a 100k-edge global graph.
+
+Before the shared graph cache every request built a new GraphService whose nx_graph started
+empty, so each path query reloaded all GlobalNode / GlobalEdge rows. This compares that
+(a reload per query) with the process-wide graph_cache (loaded once, then kept current by
+deltas), and checks that the delta-maintained graph still matches a fresh load after
+add_edge / merge_subgraph / remove_document_knowledge.
+
+Usage:
+    python benchmarks/bench_graph_path_cache.py [--nodes 20000] [--edges 100000] [--queries 200]
+"""
+import argparse
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+
+def populate(db, n_nodes: int, n_edges: int, rng: random.Random):
+    from models.graph import GlobalNode, GlobalEdge, NodeDocument
+    ids = [f"n{i}" for i in range(n_nodes)]
+    db.execute(GlobalNode.__table__.insert(), [
+        {"id": ids[i], "name": f"concept {i}", "category": "Concept", "digest": "", "weight": 1.0}
+        for i in range(n_nodes)])
+    db.execute(NodeDocument.__table__.insert(), [{"node_id": ids[i], "doc_id": f"doc-{i % 50}"} for i in range(n_nodes)])
+    pairs = set()
+    while len(pairs) < n_edges:
+        a, b = rng.randrange(n_nodes), rng.randrange(n_nodes)
+        if a != b:
+            pairs.add((a, b))
+    db.execute(GlobalEdge.__table__.insert(), [
+        {"id": f"e{k}", "source_id": ids[a], "target_id": ids[b], "relation": "related_to", "weight": 1.0}
+        for k, (a, b) in enumerate(pairs)])
+    db.commit()
+
+
+def graph_state(G):
+    return (sorted((n, d.get("name"), d.get("category"), round(d.get("weight") or 0, 6)) for n, d in G.nodes(data=True)),
+            sorted((u, v, d.get("relation"), round(d.get("weight") or 0, 6)) for u, v, d in G.edges(data=True)))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--nodes", type=int, default=20000)
+    parser.add_argument("--edges", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    from database import Base, create_db_engine, make_session_factory
+    from models.graph import GlobalNode, GlobalEdge, NodeDocument
+    from services.graph_service import GraphCache, GraphService, graph_cache
+
+    rng = random.Random(0)
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_db_engine(f"sqlite:///{os.path.join(tmp, 'graph.db')}")
+        Base.metadata.create_all(engine, tables=[GlobalNode.__table__, GlobalEdge.__table__, NodeDocument.__table__])
+        Session = make_session_factory(engine)
+        db = Session()
+        populate(db, args.nodes, args.edges, rng)
+        db.close()
+        print(f"graph: {args.nodes} nodes, {args.edges} edges")
+
+        queries = [(f"concept {rng.randrange(args.nodes)}", f"concept {rng.randrange(args.nodes)}")
+                   for _ in range(args.queries)]
+
+        # Old behaviour: a fresh graph per request
+        reload_queries = queries[:max(1, args.queries // 20)]
+        t0 = time.perf_counter()
+        for start, end in reload_queries:
+            db = Session()
+            try:
+                graph_cache.invalidate()
+                GraphService(db).find_shortest_path(start, end)
+            finally:
+                db.close()
+        reload_ms = 1000 * (time.perf_counter() - t0) / len(reload_queries)
+
+        # Shared cache: first request loads, the rest reuse it
+        graph_cache.invalidate()
+        t0 = time.perf_counter()
+        found = 0
+        for start, end in queries:
+            db = Session()
+            try:
+                found += bool(GraphService(db).find_shortest_path(start, end))
+            finally:
+                db.close()
+        cached_ms = 1000 * (time.perf_counter() - t0) / len(queries)
+        print(f"reload per query {reload_ms:9.1f}ms/query   shared cache {cached_ms:7.2f}ms/query "
+              f"({reload_ms / cached_ms:6.1f}x, {found}/{len(queries)} paths found)")
+
+        # Deltas keep the cached graph equal to a fresh load
+        db = Session()
+        try:
+            service = GraphService(db)
+            service.add_edge("concept 1", "brand new concept", "defines")
+            service.add_edge("concept 1", "brand new concept", "defines")
+            service.merge_subgraph([{"id": "x", "label": "merged concept", "type": "Method"}],
+                                   [{"source": "x", "target": "concept 2"}, {"source": "concept 3", "target": "concept 4"}],
+                                   doc_id="doc-new")
+            service.remove_document_knowledge("doc-7")
+            with graph_cache.reading(db) as G:
+                cached = graph_state(G)
+            fresh = graph_state(GraphCache._load(db))
+            print(f"deltas applied: {graph_cache.stats['deltas']}, version {graph_cache.version}, "
+                  f"cached graph matches fresh load: {cached == fresh}")
+        finally:
+            db.close()
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""
+Benchmark: deleting a document's knowledge from a 100k-node global graph.
+
+Previously the nodes citing a document were found with GlobalNode.document_ids LIKE '%"doc"%'
+(a scan of every node plus a JSON parse per match), and the edges of orphaned nodes were deleted
+through unindexed source_id / target_id columns. This builds the same graph twice from legacy
+JSON document_ids: one copy keeps the old schema and runs the old removal, the other is migrated
+to node_documents (migrate_document_ids, timed) and uses remove_document_knowledge. Both remove
+the same documents and the remaining nodes, edges and node sources are compared.
+
+Usage:
+    python benchmarks/bench_graph_remove_document.py [--nodes 100000] [--edges 200000] [--docs 2000] [--removals 20]
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+
+from sqlalchemy import text
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+
+def make_graph(n_nodes: int, n_edges: int, n_docs: int, rng: random.Random):
+    nodes = [{"id": f"n{i:06d}", "name": f"concept {i}", "category": "Concept", "digest": "", "weight": 1.0,
+              "document_ids": json.dumps(rng.sample([f"doc-{d}" for d in range(n_docs)], rng.randint(1, 3)))}
+             for i in range(n_nodes)]
+    pairs = set()
+    while len(pairs) < n_edges:
+        a, b = rng.randrange(n_nodes), rng.randrange(n_nodes)
+        if a != b:
+            pairs.add((a, b))
+    edges = [{"id": f"e{k}", "source_id": nodes[a]["id"], "target_id": nodes[b]["id"], "relation": "related_to",
+              "weight": 1.0} for k, (a, b) in enumerate(pairs)]
+    return nodes, edges
+
+
+def remove_legacy(db, doc_id: str):
+    """What remove_document_knowledge used to do"""
+    from models.graph import GlobalNode, GlobalEdge
+    affected_nodes = db.query(GlobalNode).filter(GlobalNode.document_ids.like(f'%"{doc_id}"%')).all()
+    nodes_to_delete = []
+    for node in affected_nodes:
+        doc_ids = json.loads(node.document_ids or "[]")
+        if doc_id in doc_ids:
+            doc_ids.remove(doc_id)
+            if not doc_ids:
+                nodes_to_delete.append(node.id)
+            else:
+                node.document_ids = json.dumps(doc_ids)
+    if nodes_to_delete:
+        db.query(GlobalEdge).filter(
+            (GlobalEdge.source_id.in_(nodes_to_delete)) | (GlobalEdge.target_id.in_(nodes_to_delete))
+        ).delete(synchronize_session=False)
+        db.query(GlobalNode).filter(GlobalNode.id.in_(nodes_to_delete)).delete(synchronize_session=False)
+    db.commit()
+
+
+def legacy_state(db):
+    from models.graph import GlobalNode, GlobalEdge
+    nodes = sorted((n.id, tuple(sorted(json.loads(n.document_ids)))) for n in db.query(GlobalNode))
+    edges = sorted(db.query(GlobalEdge.source_id, GlobalEdge.target_id).all())
+    return nodes, [tuple(e) for e in edges]
+
+
+def migrated_state(db):
+    from models.graph import GlobalNode, GlobalEdge, NodeDocument
+    docs = {}
+    for node_id, doc_id in db.query(NodeDocument.node_id, NodeDocument.doc_id):
+        docs.setdefault(node_id, []).append(doc_id)
+    nodes = sorted((node_id, tuple(sorted(docs.get(node_id, [])))) for node_id, in db.query(GlobalNode.id))
+    edges = sorted(db.query(GlobalEdge.source_id, GlobalEdge.target_id).all())
+    return nodes, [tuple(e) for e in edges]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--nodes", type=int, default=100000)
+    parser.add_argument("--edges", type=int, default=200000)
+    parser.add_argument("--docs", type=int, default=2000)
+    parser.add_argument("--removals", type=int, default=20)
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    from database import Base, create_db_engine, make_session_factory
+    from models.graph import GlobalNode, GlobalEdge, NodeDocument
+    from services.graph_service import GraphService
+
+    rng = random.Random(0)
+    nodes, edges = make_graph(args.nodes, args.edges, args.docs, rng)
+    removed_docs = [f"doc-{d}" for d in rng.sample(range(args.docs), args.removals)]
+    print(f"graph: {len(nodes)} nodes, {len(edges)} edges, {args.docs} documents; removing {len(removed_docs)}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        states = {}
+        for mode in ("legacy", "node_documents"):
+            engine = create_db_engine(f"sqlite:///{os.path.join(tmp, mode + '.db')}")
+            Base.metadata.create_all(engine, tables=[GlobalNode.__table__, GlobalEdge.__table__, NodeDocument.__table__])
+            db = make_session_factory(engine)()
+            try:
+                db.execute(GlobalNode.__table__.insert(), nodes)
+                db.execute(GlobalEdge.__table__.insert(), edges)
+                db.commit()
+                if mode == "legacy":
+                    # The old schema had no indexes on the edge endpoints
+                    db.execute(text("DROP INDEX ix_global_edges_source_id"))
+                    db.execute(text("DROP INDEX ix_global_edges_target_id"))
+                    db.commit()
+                    remove = lambda doc_id: remove_legacy(db, doc_id)
+                else:
+                    service = GraphService(db)
+                    t0 = time.perf_counter()
+                    migrated = service.migrate_document_ids()
+                    print(f"{'':14s} migrate_document_ids {time.perf_counter() - t0:6.2f}s ({migrated} nodes)")
+                    remove = service.remove_document_knowledge
+
+                t0 = time.perf_counter()
+                for doc_id in removed_docs:
+                    remove(doc_id)
+                ms = 1000 * (time.perf_counter() - t0) / len(removed_docs)
+                print(f"{mode:14s} remove document {ms:9.2f}ms/document")
+                states[mode] = legacy_state(db) if mode == "legacy" else migrated_state(db)
+            finally:
+                db.close()
+                engine.dispose()
+    print("same remaining graph:", states["legacy"] == states["node_documents"])
+
+
+if __name__ == "__main__":
+    main()
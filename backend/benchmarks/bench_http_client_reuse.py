@@ -0,0 +1,166 @@
+"""
+Benchmark: DashScope-style calls with a new httpx.AsyncClient per call (the old pattern)
+vs. the shared pooled client in utils/http_client.py.
+
+Starts a local HTTPS stub server (self-signed cert made with the openssl CLI) that answers
+every POST with a DashScope-shaped JSON body after --latency-ms, points DASHSCOPE_BASE_URL at
+it and reports per-call latency for sequential and concurrent calls. The per-call client
+pays a TCP + TLS handshake on every request; the shared client reuses kept-alive connections.
+The stub only speaks HTTP/1.1, so this measures connection reuse, not HTTP/2 multiplexing.
+Finally it queues a burst on one route and times a single call on another route, which should
+only wait for its own request, not behind the burst.
+
+Usage:
+    python benchmarks/bench_http_client_reuse.py [--calls 200] [--concurrency 16] [--latency-ms 5]
+"""
+import argparse
+import asyncio
+import json
+import os
+import ssl
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+RESPONSE_BODY = json.dumps({
+    "output": {"choices": [{"message": {"role": "assistant", "content": "ok"}}]},
+    "usage": {"input_tokens": 10, "output_tokens": 1},
+}).encode()
+
+
+def make_cert(tmp: str):
+    cert, key = os.path.join(tmp, "cert.pem"), os.path.join(tmp, "key.pem")
+    subprocess.run(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+                    "-subj", "/CN=127.0.0.1", "-addext", "subjectAltName=IP:127.0.0.1",
+                    "-keyout", key, "-out", cert], check=True, capture_output=True)
+    return cert, key
+
+
+async def start_stub(cert: str, key: str, latency: float):
+    stats = {"connections": 0, "requests": 0}
+
+    async def handle(reader, writer):
+        stats["connections"] += 1
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                length = 0
+                for line in head.split(b"\r\n")[1:]:
+                    name, _, value = line.partition(b":")
+                    if name.strip().lower() == b"content-length":
+                        length = int(value)
+                if length:
+                    await reader.readexactly(length)
+                stats["requests"] += 1
+                await asyncio.sleep(latency)
+                writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                             b"Content-Length: %d\r\nConnection: keep-alive\r\n\r\n" % len(RESPONSE_BODY) + RESPONSE_BODY)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, ssl.SSLError):
+            pass
+        finally:
+            writer.close()
+
+    ctx = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    ctx.load_cert_chain(cert, key)
+    server = await asyncio.start_server(handle, "127.0.0.1", 0, ssl=ctx)
+    return server, server.sockets[0].getsockname()[1], stats
+
+
+def payload():
+    return {"model": "qwen-max", "input": {"messages": [{"role": "user", "content": "ping"}]},
+            "parameters": {"result_format": "message"}}
+
+
+async def per_call_client(url: str):
+    import httpx
+    async with httpx.AsyncClient() as client:
+        response = await client.post(url, json=payload(), headers={"Authorization": "Bearer test"}, timeout=30.0)
+    response.raise_for_status()
+
+
+async def shared_client(url: str):
+    from utils.http_client import dashscope_generate
+    response = await dashscope_generate(payload(), route="bench", api_key="test", timeout=30.0)
+    response.raise_for_status()
+
+
+async def route_isolation(url: str, burst: int, latency: float):
+    from utils.http_client import dashscope_generate
+
+    async def call(route):
+        t0 = time.perf_counter()
+        response = await dashscope_generate(payload(), route=route, api_key="test", timeout=30.0)
+        response.raise_for_status()
+        return time.perf_counter() - t0
+
+    queued = [asyncio.create_task(call("burst")) for _ in range(burst)]
+    await asyncio.sleep(0)
+    probe = await call("probe")
+    await asyncio.gather(*queued)
+    print(f"{burst} calls queued on one route: a call on another route took {1000 * probe:6.1f}ms "
+          f"(stub latency {1000 * latency:.1f}ms)")
+
+
+async def run(name: str, call, url: str, calls: int, concurrency: int, stats: dict):
+    latencies = []
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with sem:
+            t0 = time.perf_counter()
+            await call(url)
+            latencies.append(time.perf_counter() - t0)
+
+    before = dict(stats)
+    t0 = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(calls)))
+    wall = time.perf_counter() - t0
+    latencies.sort()
+    p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+    print(f"{name:24s} c={concurrency:<3d} wall {wall:6.2f}s  {calls / wall:7.1f} req/s  "
+          f"mean {1000 * statistics.mean(latencies):6.1f}ms  p95 {1000 * p95:6.1f}ms  "
+          f"connections {stats['connections'] - before['connections']}")
+
+
+async def main_async(args, cert: str, key: str):
+    server, port, stats = await start_stub(cert, key, args.latency_ms / 1000)
+    base = f"https://127.0.0.1:{port}"
+    os.environ["DASHSCOPE_BASE_URL"] = base
+    # Route limit for the benchmark route follows --concurrency
+    os.environ["HTTP_ROUTE_CONCURRENCY"] = f"bench={args.concurrency},burst=2,probe=2"
+    os.environ.setdefault("HTTP_MAX_CONCURRENCY", str(max(16, args.concurrency)))
+    from utils import http_client
+    url = base + http_client.DASHSCOPE_GENERATION_PATH
+    print(f"stub: {base}  latency {args.latency_ms}ms  http2={http_client._http2_available()}")
+
+    async with server:
+        await shared_client(url)  # warm-up: opens the pooled connection
+        for concurrency in (1, args.concurrency):
+            await run("new client per call", per_call_client, url, args.calls, concurrency, stats)
+            await run("shared pooled client", shared_client, url, args.calls, concurrency, stats)
+        await route_isolation(url, 2 * int(os.environ["HTTP_MAX_CONCURRENCY"]), args.latency_ms / 1000)
+        await http_client.close_http_clients()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--latency-ms", type=float, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        cert, key = make_cert(tmp)
+        # httpx trusts SSL_CERT_FILE (trust_env), so both clients accept the self-signed stub
+        os.environ["SSL_CERT_FILE"] = cert
+        asyncio.run(main_async(args, cert, key))
+
+
+if __name__ == "__main__":
+    main()
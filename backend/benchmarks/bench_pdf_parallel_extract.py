@@ -0,0 +1,101 @@
+"""
+Benchmark: serial vs. multi-process pdfplumber extraction (parsers.pdf_parser).
+
+Generates a synthetic text-heavy PDF (no extra dependencies: the file is written by hand
+with Helvetica text objects), then runs extract_pdf_layout in both modes and checks that
+the merged {text, layout} results are identical.
+
+Usage:
+    python benchmarks/bench_pdf_parallel_extract.py [--pages 500] [--lines 45] [--workers N]
+
+The speedup is bounded by the number of physical cores; on a single-core machine the
+parallel mode is only overhead.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def write_synthetic_pdf(path: str, pages: int, lines: int):
+    """Minimal PDF 1.4 writer: one content stream of `lines` text lines per page"""
+    objects = []  # index i -> bytes of object i+1
+
+    def add(body: bytes) -> int:
+        objects.append(body)
+        return len(objects)
+
+    font_id = add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    pages_id = add(b"")  # placeholder, filled in once the kids are known
+    kids = []
+    for p in range(pages):
+        ops = [b"BT /F1 10 Tf 12 TL 50 800 Td"]
+        for ln in range(lines):
+            ops.append(f"(Page {p + 1} line {ln + 1}: the quick brown fox jumps over the lazy dog {p * lines + ln}) '".encode())
+        ops.append(b"ET")
+        stream = b"\n".join(ops)
+        content_id = add(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        kids.append(add(
+            b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 595 842] "
+            b"/Resources << /Font << /F1 %d 0 R >> >> /Contents %d 0 R >>" % (pages_id, font_id, content_id)
+        ))
+    objects[pages_id - 1] = (
+        b"<< /Type /Pages /Kids [" + b" ".join(b"%d 0 R" % k for k in kids) + b"] /Count %d >>" % len(kids)
+    )
+    catalog_id = add(b"<< /Type /Catalog /Pages %d 0 R >>" % pages_id)
+
+    with open(path, "wb") as f:
+        f.write(b"%PDF-1.4\n")
+        offsets = []
+        for i, body in enumerate(objects, start=1):
+            offsets.append(f.tell())
+            f.write(b"%d 0 obj\n" % i + body + b"\nendobj\n")
+        xref = f.tell()
+        f.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+        for off in offsets:
+            f.write(b"%010d 00000 n \n" % off)
+        f.write(b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, catalog_id, xref))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, default=500)
+    parser.add_argument("--lines", type=int, default=45)
+    parser.add_argument("--workers", type=int, default=0, help="PDF_PARALLEL_WORKERS (default: all cores)")
+    args = parser.parse_args()
+
+    if args.workers:
+        os.environ["PDF_PARALLEL_WORKERS"] = str(args.workers)
+    from parsers import pdf_parser
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "synthetic.pdf")
+        write_synthetic_pdf(path, args.pages, args.lines)
+        print(f"pages={args.pages} size={os.path.getsize(path) / 1e6:.1f}MB "
+              f"workers={pdf_parser.PDF_PARALLEL_WORKERS} chunk_pages={pdf_parser.PDF_PARALLEL_CHUNK_PAGES}")
+
+        t0 = time.perf_counter()
+        serial = pdf_parser.extract_pdf_layout(path, parallel=False)
+        t_serial = time.perf_counter() - t0
+
+        # Warm the pool so worker start-up (spawn + import pdfplumber) is reported separately
+        t0 = time.perf_counter()
+        pdf_parser._get_pool().submit(pdf_parser.count_pdf_pages, path).result()
+        t_warm = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        parallel = pdf_parser.extract_pdf_layout(path, parallel=True)
+        t_parallel = time.perf_counter() - t0
+        pdf_parser.shutdown_pool()
+
+    assert serial == parallel, "parallel result differs from serial result"
+    print(f"serial   : {t_serial:7.2f}s")
+    print(f"parallel : {t_parallel:7.2f}s  (pool warm-up {t_warm:.2f}s, excluded)")
+    print(f"speedup  : {t_serial / t_parallel:5.2f}x  — results identical")
+
+
+if __name__ == "__main__":
+    main()
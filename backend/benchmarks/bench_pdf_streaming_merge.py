@@ -0,0 +1,110 @@
+"""
+Benchmark: peak memory of PdfService.merge_pdfs, streaming writer vs. pypdf PdfWriter.
+
+Generates several image-heavy synthetic PDFs (random RGB image per page, so the data
+cannot be compressed away), then merges them in a fresh subprocess per mode and reports
+wall time and the child's peak RSS. The streaming mode should stay roughly flat no matter
+how many / how large the inputs are; the PdfWriter mode grows with their combined size.
+
+Usage:
+    python benchmarks/bench_pdf_streaming_merge.py [--files 4] [--mb 100] [--page-mb 4] [--skip-legacy]
+"""
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+
+def write_image_pdf(path: str, pages: int, page_bytes: int):
+    """Minimal PDF writer: one uncompressed random RGB image per page, written object by object"""
+    side = max(1, int((page_bytes / 3) ** 0.5))
+    offsets = {}
+    with open(path, "wb") as f:
+        f.write(b"%PDF-1.4\n")
+
+        def obj(num: int, body: bytes, stream: bytes = None):
+            offsets[num] = f.tell()
+            f.write(b"%d 0 obj\n" % num + body)
+            if stream is not None:
+                f.write(b"\nstream\n")
+                f.write(stream)
+                f.write(b"\nendstream")
+            f.write(b"\nendobj\n")
+
+        # 1: catalog, 2: pages, then (image, content, page) per page
+        kids = [3 + 3 * p + 2 for p in range(pages)]
+        obj(1, b"<< /Type /Catalog /Pages 2 0 R >>")
+        obj(2, b"<< /Type /Pages /Kids [" + b" ".join(b"%d 0 R" % k for k in kids) + b"] /Count %d >>" % pages)
+        for p in range(pages):
+            image_id, content_id, page_id = 3 + 3 * p, 4 + 3 * p, 5 + 3 * p
+            data = os.urandom(side * side * 3)
+            obj(image_id, b"<< /Type /XObject /Subtype /Image /Width %d /Height %d /ColorSpace /DeviceRGB "
+                          b"/BitsPerComponent 8 /Length %d >>" % (side, side, len(data)), data)
+            content = b"q 595 0 0 842 0 0 cm /Im0 Do Q"
+            obj(content_id, b"<< /Length %d >>" % len(content), content)
+            obj(page_id, b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+                         b"/Resources << /XObject << /Im0 %d 0 R >> >> /Contents %d 0 R >>" % (image_id, content_id))
+
+        xref = f.tell()
+        size = 3 + 3 * pages
+        f.write(b"xref\n0 %d\n0000000000 65535 f \n" % size)
+        for num in range(1, size):
+            f.write(b"%010d 00000 n \n" % offsets[num])
+        f.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (size, xref))
+
+
+def run_worker(mode: str, output: str, inputs: list):
+    from services.pdf_service import pdf_service
+
+    t0 = time.perf_counter()
+    result = pdf_service.merge_pdfs(inputs, output, streaming=(mode == "streaming"))
+    elapsed = time.perf_counter() - t0
+    # ru_maxrss is KB on Linux, bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    rss_mb = rss / 1024 / 1024 if sys.platform == "darwin" else rss / 1024
+    print(f"{mode:9s}: {elapsed:7.2f}s  peak RSS {rss_mb:8.1f}MB  pages={result['total_pages']}  "
+          f"output={os.path.getsize(output) / 1e6:.1f}MB")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=4)
+    parser.add_argument("--mb", type=int, default=100, help="approximate size of each input PDF")
+    parser.add_argument("--page-mb", type=float, default=4, help="image bytes per page")
+    parser.add_argument("--skip-legacy", action="store_true", help="only run the streaming mode")
+    parser.add_argument("--worker", nargs="+", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        mode, output, *inputs = args.worker
+        run_worker(mode, output, inputs)
+        return
+
+    page_bytes = int(args.page_mb * 1024 * 1024)
+    pages = max(1, int(args.mb * 1024 * 1024 / page_bytes))
+    with tempfile.TemporaryDirectory() as tmp:
+        inputs = []
+        for i in range(args.files):
+            path = os.path.join(tmp, f"input_{i}.pdf")
+            write_image_pdf(path, pages, page_bytes)
+            inputs.append(path)
+        total = sum(os.path.getsize(p) for p in inputs) / 1e6
+        print(f"inputs: {args.files} x {pages} pages, {total:.0f}MB total")
+
+        modes = ["streaming"] if args.skip_legacy else ["streaming", "pdfwriter"]
+        for mode in modes:
+            output = os.path.join(tmp, f"merged_{mode}.pdf")
+            # Separate process per mode so peak RSS is not shared between runs
+            subprocess.run([sys.executable, os.path.abspath(__file__), "--worker", mode, output, *inputs],
+                           cwd=BACKEND_DIR, check=True)
+            os.remove(output)
+
+
+if __name__ == "__main__":
+    main()
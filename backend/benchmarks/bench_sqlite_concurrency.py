@@ -0,0 +1,133 @@
+"""
+Stress test: concurrent SQLite writers, bare engine vs. database.create_db_engine.
+
+Mimics the backend's write pattern: many threads (background analysis, UserMemory,
+learning routes) each open a session, read a little, insert/update rows and commit,
+while reader threads keep scanning. The "bare" configuration is what database.py used
+to create (rollback journal, pysqlite's own lock timeout; shortened via --bare-timeout so
+contention shows up in a short run); the "tuned" one is the WAL + busy_timeout setup,
+where writers queue on SQLite's own write lock. The "tuned+DML" run also issues bulk
+query().update() statements before commit (like the scheduler's job updates and the delete
+routes), which take SQLite's write lock as soon as they run.
+
+Usage:
+    python benchmarks/bench_sqlite_concurrency.py [--writers 16] [--readers 4] [--ops 200]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import Column, Float, String, Text, create_engine, func  # noqa: E402
+from sqlalchemy.exc import OperationalError  # noqa: E402
+from sqlalchemy.orm import declarative_base, sessionmaker  # noqa: E402
+
+from database import create_db_engine, make_session_factory  # noqa: E402
+
+Base = declarative_base()
+
+
+class Rule(Base):
+    __tablename__ = "rules"
+    id = Column(String, primary_key=True)
+    file_id = Column(String, index=True)
+    correction = Column(Text)
+    ts = Column(Float)
+
+
+def run(session_factory, writers: int, readers: int, ops: int, dml: bool = False):
+    errors = {"locked": 0, "other": 0}
+    lock = threading.Lock()
+    stop = threading.Event()
+
+    def record(e):
+        with lock:
+            errors["locked" if "locked" in str(e) else "other"] += 1
+
+    def writer(n):
+        for i in range(ops):
+            db = session_factory()
+            try:
+                file_id = f"f{(n + i) % 8}"
+                if dml and i % 2:
+                    # bulk UPDATE first, then more work in the same transaction
+                    db.query(Rule).filter(Rule.file_id == file_id).update(
+                        {Rule.ts: time.time()}, synchronize_session=False)
+                # read-then-write, like UserMemory.add_memory / save_file_to_db
+                existing = db.query(Rule).filter(Rule.file_id == file_id).order_by(Rule.ts.desc()).first()
+                if existing is not None and i % 3 == 0:
+                    existing.correction = (existing.correction or "")[-200:] + f" upd{i}"
+                db.add(Rule(id=str(uuid.uuid4()), file_id=file_id, correction="x" * 500, ts=time.time()))
+                db.commit()
+            except OperationalError as e:
+                db.rollback()
+                record(e)
+            finally:
+                db.close()
+
+    def reader():
+        while not stop.is_set():
+            db = session_factory()
+            try:
+                db.query(Rule.file_id, func.count(Rule.id)).group_by(Rule.file_id).all()
+            except OperationalError as e:
+                record(e)
+            finally:
+                db.close()
+
+    threads = [threading.Thread(target=writer, args=(n,)) for n in range(writers)]
+    reader_threads = [threading.Thread(target=reader) for _ in range(readers)]
+    t0 = time.perf_counter()
+    for t in threads + reader_threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - t0
+    stop.set()
+    for t in reader_threads:
+        t.join()
+    db = session_factory()
+    rows = db.query(Rule).count()
+    db.close()
+    return elapsed, rows, errors
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--writers", type=int, default=16)
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--ops", type=int, default=200)
+    parser.add_argument("--bare-timeout", type=float, default=0.1,
+                        help="pysqlite lock timeout (s) for the bare engine")
+    args = parser.parse_args()
+    expected = args.writers * args.ops
+
+    with tempfile.TemporaryDirectory() as tmp:
+        bare = create_engine(f"sqlite:///{tmp}/bare.db",
+                             connect_args={"check_same_thread": False, "timeout": args.bare_timeout})
+        Base.metadata.create_all(bare)
+        elapsed, rows, errors = run(sessionmaker(autocommit=False, autoflush=False, bind=bare),
+                                    args.writers, args.readers, args.ops)
+        print(f"bare  : {elapsed:6.2f}s  rows={rows}/{expected}  errors={errors}")
+        bare.dispose()
+
+        tuned = create_db_engine(f"sqlite:///{tmp}/tuned.db")
+        Base.metadata.create_all(tuned)
+        elapsed, rows, errors = run(make_session_factory(tuned), args.writers, args.readers, args.ops)
+        print(f"tuned : {elapsed:6.2f}s  rows={rows}/{expected}  errors={errors}")
+        tuned.dispose()
+
+        tuned = create_db_engine(f"sqlite:///{tmp}/tuned_dml.db")
+        Base.metadata.create_all(tuned)
+        elapsed, rows, errors = run(make_session_factory(tuned), args.writers, args.readers, args.ops, dml=True)
+        print(f"tuned+DML : {elapsed:6.2f}s  rows={rows}/{expected}  errors={errors}")
+        tuned.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Benchmark: Teacher Mode recall (UserMemory.search_memory) with thousands of rules per file.
+
+Compares the previous per-entry Python loop (np.dot per stored memory) with the per-file
+normalized matrix in services/user_memory.py (one matrix-vector product + argpartition).
+Uses random unit vectors, so no embedding model is needed; DB writes are not exercised.
+
+Usage:
+    python benchmarks/bench_user_memory_search.py [--rules 1000 5000 20000] [--dim 512] [--queries 500]
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+
+import numpy as np
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+
+def loop_search(memories: list, q_vec: np.ndarray, threshold: float):
+    """The old search_memory inner loop (without its per-candidate logging)"""
+    matches = []
+    for mem in memories:
+        score = np.dot(q_vec, mem["vector"])
+        if score >= threshold:
+            matches.append({"correction": mem["correction"], "score": score})
+    matches.sort(key=lambda x: x["score"], reverse=True)
+    return matches[:3]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rules", type=int, nargs="+", default=[1000, 5000, 20000])
+    parser.add_argument("--dim", type=int, default=512)
+    parser.add_argument("--queries", type=int, default=500)
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    from services.user_memory import UserMemory
+
+    rng = np.random.default_rng(0)
+    for n in args.rules:
+        vectors = rng.standard_normal((n, args.dim)).astype("float32")
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        queries = vectors[rng.integers(0, n, args.queries)] + 0.05 * rng.standard_normal((args.queries, args.dim)).astype("float32")
+
+        old = [{"vector": v, "correction": f"c{i}"} for i, v in enumerate(vectors)]
+        memory = UserMemory()
+        for i, v in enumerate(vectors):
+            memory.load_rule("bench", f"r{i}", f"q{i}", f"c{i}", v)
+
+        t0 = time.perf_counter()
+        for q in queries:
+            loop_search(old, q / np.linalg.norm(q), 0.62)
+        loop_ms = 1000 * (time.perf_counter() - t0) / args.queries
+
+        t0 = time.perf_counter()
+        for q in queries:
+            memory.search_memory("bench", "", threshold=0.62, q_vec=q)
+        matrix_ms = 1000 * (time.perf_counter() - t0) / args.queries
+
+        print(f"{n:6d} rules x {args.dim}d: loop {loop_ms:8.3f}ms/query   matrix {matrix_ms:7.3f}ms/query   "
+              f"({loop_ms / matrix_ms:5.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -7,6 +7,8 @@ import httpx
 import uuid
 from dotenv import load_dotenv
 
+from utils.http_client import dashscope_generate
+
 # 获取项目根目录
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 PROJECT_ROOT = os.path.dirname(os.path.dirname(BASE_DIR))
@@ -145,46 +147,17 @@ async def extract_knowledge_graph_from_text(text: str, doc_type: str = "general"
         
         logger.info(f"最终知识图谱请求大小: {len(json.dumps(final_payload))}/{max_request_size} chars")
 
-        # ✅ 直接在FastAPI的事件循环中调用，不再新建循环，添加重试机制
-        import asyncio
-        max_retries = 3
-        retry_delay = 5  # 秒
-        response = None
-        
-        async with httpx.AsyncClient() as client:
-            for retry in range(max_retries):
-                try:
-                    logger.info(f"发送知识图谱请求到Dashscope API，重试次数: {retry+1}/{max_retries}")
-                    response = await client.post(
-                        "https://dashscope.aliyuncs.com/api/v1/services/aigc/text-generation/generation",
-                        headers={
-                            "Authorization": f"Bearer {DASHSCOPE_API_KEY}",
-                            "Content-Type": "application/json"
-                        },
-                        json=final_payload,
-                        timeout=120.0  # 增加超时时间到120秒
-                    )
-                    # 处理响应
-                    response.raise_for_status()
-                    logger.info(f"成功收到知识图谱Dashscope API响应")
-                    break  # 成功，退出重试循环
-                except httpx.TimeoutException:
-                    logger.warning(f"知识图谱请求超时，{retry+1}/{max_retries}，将在{retry_delay}秒后重试...")
-                    if retry < max_retries - 1:
-                        await asyncio.sleep(retry_delay)
-                        retry_delay *= 1.5  # 指数退避
-                    else:
-                        logger.error(f"所有知识图谱请求重试都失败了，请求超时")
-                        raise
-                except httpx.RequestError as e:
-                    logger.warning(f"知识图谱请求失败，{retry+1}/{max_retries}，错误: {e}，将在{retry_delay}秒后重试...")
-                    if retry < max_retries - 1:
-                        await asyncio.sleep(retry_delay)
-                        retry_delay *= 1.5  # 指数退避
-                    else:
-                        logger.error(f"所有知识图谱请求重试都失败了，错误: {e}")
-                        raise
-        
+        # ✅ 直接在FastAPI的事件循环中调用；连接池与重试/退避由 utils/http_client.py 统一处理
+        logger.info(f"发送知识图谱请求到Dashscope API")
+        try:
+            response = await dashscope_generate(final_payload, route="kg", api_key=DASHSCOPE_API_KEY, timeout=120.0)
+        except httpx.RequestError as e:
+            logger.error(f"所有知识图谱请求重试都失败了，错误: {type(e).__name__}: {e}")
+            raise
+        # 处理响应
+        response.raise_for_status()
+        logger.info(f"成功收到知识图谱Dashscope API响应")
+
         result = response.json()
         
         # 解析返回结果
@@ -3,10 +3,11 @@ import os
 import re
 import json
 import logging
-import httpx
 from dotenv import load_dotenv
 from typing import List, Dict, Any
 
+from utils.http_client import dashscope_generate
+
 # 获取项目根目录
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 PROJECT_ROOT = os.path.dirname(os.path.dirname(BASE_DIR))
@@ -337,23 +338,20 @@ async def generate_mindmap_from_kg(kg_dict: dict, reasoning_steps: List[str]) ->
         """
 
         # 调用阿里云API生成
-        async with httpx.AsyncClient(timeout=60.0) as client:
-            response = await client.post(
-                "https://dashscope.aliyuncs.com/api/v1/services/aigc/text-generation/generation",
-                headers={
-                    "Authorization": f"Bearer {DASHSCOPE_API_KEY}",
-                    "Content-Type": "application/json"
-                },
-                json={
-                    "model": "qwen-max",
-                    "input": {"messages": [{"role": "user", "content": prompt}]},
-                    "parameters": {
-                        "temperature": 0.1,
-                        "result_format": "json",
-                        "top_p": 0.9
-                    }
+        response = await dashscope_generate(
+            {
+                "model": "qwen-max",
+                "input": {"messages": [{"role": "user", "content": prompt}]},
+                "parameters": {
+                    "temperature": 0.1,
+                    "result_format": "json",
+                    "top_p": 0.9
                 }
-            )
+            },
+            route="mindmap",
+            api_key=DASHSCOPE_API_KEY,
+            timeout=60.0
+        )
         response.raise_for_status()
         result = response.json()
 
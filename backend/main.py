@@ -1,5 +1,8 @@
 from dotenv import load_dotenv
 import os
+
+# 启动方式：uvicorn main:app 或 python run.py（不要 python main.py）。
+# PDF 解析进程池（spawn）的子进程会重新导入 __main__，而导入本模块有副作用（建表、建目录、任务管理器）
 # [FIX] Allow duplicate OpenMP libraries (MKL/Torch/Paddle conflict) - MUST BE FIRST
 os.environ["KMP_DUPLICATE_LIB_OK"] = "TRUE"
 
@@ -16,15 +19,19 @@ import os
 import re
 import json
 import uuid
+import codecs
+import shutil
+import hashlib
 import logging
 import time
+import threading
 import asyncio # [FIX] Add missing asyncio
 
 from pathlib import Path
 from typing import List, Dict, Any, Optional # [FIX] Added Optional
 from fastapi import FastAPI, File, UploadFile, HTTPException, Query, Depends, Body, BackgroundTasks, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import Response
+from fastapi.responses import Response, StreamingResponse
 import httpx
 import numpy as np # [FIX] Add numpy import for vector math
 from sqlalchemy.orm import Session
@@ -44,19 +51,24 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 # 导入数据库相关模块
-from database import engine, Base, SessionLocal, get_db
-from models import AnalysisHistory, FileTextStore
+from database import engine, Base, SessionLocal, get_db, ensure_columns, ensure_index
+from models import AnalysisHistory, FileTextStore, HISTORY_HEAVY_KEYS
 from models.qa_history import QAHistory
 from models.feedback import Feedback
 from models.teacher_rule import TeacherRule # [NEW]
 from models.graph import GlobalNode, GlobalEdge # [NEW] Graph Models
+from models.analysis_job import AnalysisJob
 from services.evaluator import evaluate_rag_response
 
 # 导入服务模块
 from services.video_processor import VideoProcessor
 from services.pdf_service import pdf_service
+from services.pdf_jobs import PdfJobManager, JobCancelled
+from services.analysis_scheduler import AnalysisScheduler
 from services.ocr_service import ocr_service
+from parsers.pdf_parser import iter_pdf_pages, extract_pdf_layout, shutdown_pool as shutdown_pdf_pool
 from services.llm import simple_llm
+from utils.http_client import dashscope_generate, dashscope_stream, close_http_clients
 from routes import dashboard, comparison, learning, graph, review # [NEW] Import new routers
 
 # 创建所有数据库表（确保在导入所有模型后执行）
@@ -79,6 +91,8 @@ app = FastAPI(title="DocMind Pro", version="2.0")
 
 # [NEW] 初始化 WebSocket 连接管理器
 manager = ConnectionManager()
+# PDF 工具任务：线程池执行，按操作类型限流，进度推送到 /ws/{job_id}
+pdf_jobs = PdfJobManager(broadcast=manager.broadcast)
 
 # CORS配置
 app.add_middleware(
@@ -109,6 +123,13 @@ DOWNLOAD_DIR.mkdir(exist_ok=True)
 
 # 校验阿里云API Key（可选，仅用于RAG功能）
 DASHSCOPE_API_KEY = os.getenv("DASHSCOPE_API_KEY")
+# 流式PDF解析时，已解析但尚未向量化的页面上限（背压）
+PDF_PAGE_QUEUE_SIZE = max(2, int(os.getenv("PDF_PAGE_QUEUE_SIZE", "8")))
+# 上传分块大小（边写盘边计算 SHA-256）；UPLOAD_DEDUP=0 关闭重复上传复用
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+# 单个上传文件大小上限（MB），0 表示不限制
+UPLOAD_MAX_BYTES = int(float(os.getenv("UPLOAD_MAX_MB", "200")) * 1024 * 1024)
+UPLOAD_DEDUP = os.getenv("UPLOAD_DEDUP", "1").lower() in ("1", "true", "yes")
 if not DASHSCOPE_API_KEY:
     logger.warning("未配置 DASHSCOPE_API_KEY，RAG功能将不可用，但学习系统功能仍然可用")
 
@@ -116,8 +137,12 @@ if not DASHSCOPE_API_KEY:
 # 全局存储
 # ======================
 # 注意：FILE_TEXT_STORE 和 ANALYSIS_HISTORY 现在从数据库获取
-# VECTOR_STORES 仍然使用内存存储（因为向量索引不适合持久化到SQLite）
-from services.vector_service import VECTOR_STORES, GLOBAL_HISTORY_STORE, VectorStore # [REFACTORED]
+# VECTOR_STORES 的索引持久化在 uploads/index/ 下，按需加载并按字节预算做 LRU 淘汰
+from services.vector_service import VECTOR_STORES, VectorStore, RAG_MIN_SIMILARITY # [REFACTORED]
+from services.embedding_service import embedding_service # 查询向量：微批处理 + LRU 缓存，不阻塞事件循环
+from services.answer_cache import answer_cache # 语义答案缓存：相似问题复用已生成的回答
+from services.user_memory import UserMemory # Teacher Mode：按文件的规则向量矩阵
+from services.layout_store import open_layout, save_layout, delete_layout, layout_path
 
 # 清理过期文件的时间间隔（秒）
 CLEANUP_INTERVAL = 3600  # 1小时
@@ -154,15 +179,23 @@ async def cleanup_expired_files():
                     except Exception as e:
                         logger.error(f"删除文件失败: {file_path}, 错误: {str(e)}")
             
-            # 从数据库删除文件记录
-            db.query(FileTextStore).filter(FileTextStore.file_id == file_id).delete()
+            # 从数据库删除文件记录（历史记录保留，先写回正文/布局）；每个文件单独提交，写事务不跨文件持有
+            try:
+                preserve_history_payload(db, file_id)
+                db.query(FileTextStore).filter(FileTextStore.file_id == file_id).delete()
+                db.query(AnalysisJob).filter(AnalysisJob.file_id == file_id).delete()
+                db.commit()
+            except Exception as e:
+                db.rollback()
+                logger.error(f"清理文件记录失败: {file_id}, 错误: {str(e)}")
+                continue
+            answer_cache.invalidate(file_id)
+            delete_layout(file_id)
             
             # 清理向量存储
             if file_id in VECTOR_STORES:
                 del VECTOR_STORES[file_id]
         
-        # 提交数据库更改
-        db.commit()
         logger.info(f"过期文件清理完成，共清理 {len(expired_file_ids)} 个文件")
     except Exception as e:
         logger.error(f"清理过期文件失败: {str(e)}")
@@ -178,7 +211,34 @@ async def startup_event():
     """启动时的初始化任务"""
     # 创建数据库表
     Base.metadata.create_all(bind=engine)
+    ensure_columns(engine, "analysis_history", {"status": "VARCHAR", "summary_preview": "TEXT"})
+    ensure_columns(engine, "file_text_store", {"ext": "VARCHAR", "size": "INTEGER"})
+    ensure_index(engine, "ix_file_text_store_ext", "file_text_store", ["ext"])
+    ensure_index(engine, "ix_file_text_store_upload_time", "file_text_store", ["upload_time"])
+    ensure_columns(engine, "file_text_store", {"content_hash": "VARCHAR"})
+    ensure_index(engine, "ix_file_text_store_content_hash", "file_text_store", ["content_hash"])
+    ensure_columns(engine, "teacher_rules", {"embedding": "BLOB", "embedding_model": "VARCHAR"})
+    ensure_index(engine, "ix_global_edges_source_id", "global_edges", ["source_id"])
+    ensure_index(engine, "ix_global_edges_target_id", "global_edges", ["target_id"])
     logger.info("数据库表创建完成")
+    # 旧文件记录：根据磁盘文件补全扩展名和大小
+    await asyncio.to_thread(backfill_file_ext_size)
+    # 旧文件记录的内容哈希需要读完整个文件，放到后台慢慢算，不阻塞启动
+    asyncio.create_task(asyncio.to_thread(backfill_content_hashes))
+    # 旧图谱节点：来源文档从 JSON 列表迁移到 node_documents（删除文档依赖它，须在调度器/请求写图谱之前完成）
+    await asyncio.to_thread(migrate_node_documents)
+    # 向量模型在 embedding 工作线程中后台预加载：首个 /ask 不会在事件循环上加载模型
+    embedding_service.preload()
+    # 启动分析任务调度器（恢复上次未完成的任务）
+    await analysis_scheduler.start()
+    # 旧文件记录：数据库中的 JSON 布局转存为 .npz（读取布局时不再写库）
+    await asyncio.to_thread(migrate_legacy_layouts)
+    # 旧历史记录：补全投影列并移除重复的正文/布局
+    await asyncio.to_thread(slim_history_results)
+    # Teacher Mode 规则：加载已保存的向量，缺失/模型已更换的在后台批量重算，不阻塞启动
+    global memory_restore_task
+    memory_restore_task = asyncio.create_task(asyncio.to_thread(rebuild_memory_from_db))
+    memory_restore_task.add_done_callback(on_memory_restored)
     
     # 确保上传目录存在
     UPLOAD_DIR.mkdir(exist_ok=True)
@@ -186,6 +246,189 @@ async def startup_event():
     # 启动定期清理任务
     asyncio.create_task(periodic_cleanup())
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    # 关闭PDF解析进程池 / PDF工具任务线程池
+    shutdown_pdf_pool()
+    pdf_jobs.shutdown()
+    # 正在执行的分析任务保持 running 状态，下次启动时自动重新排队
+    await analysis_scheduler.stop()
+    # 关闭共享的 DashScope HTTP 连接池
+    await close_http_clients()
+    # 写出全局向量索引尚未落盘的改动（写入是防抖的）
+    await asyncio.to_thread(VECTOR_STORES.flush)
+
+SUPPORTED_UPLOAD_EXTS = ["pdf", "txt", "log", "jpg", "jpeg", "png"]
+
+def backfill_file_ext_size():
+    """为 ext 为空的旧记录扫描一次 uploads 目录，写入扩展名/大小（找不到文件记为 ""）"""
+    db = SessionLocal()
+    try:
+        pending = [row.file_id for row in db.query(FileTextStore.file_id).filter(FileTextStore.ext.is_(None))]
+        if not pending:
+            return
+        on_disk = {}
+        for entry in os.scandir(UPLOAD_DIR):
+            stem, _, ext = entry.name.rpartition(".")
+            if entry.is_file() and ext in SUPPORTED_UPLOAD_EXTS and stem not in on_disk:
+                on_disk[stem] = (ext, entry.stat().st_size)
+        for file_id in pending:
+            ext, size = on_disk.get(file_id, ("", None))
+            db.query(FileTextStore).filter(FileTextStore.file_id == file_id).update(
+                {FileTextStore.ext: ext, FileTextStore.size: size}, synchronize_session=False
+            )
+        db.commit()
+        logger.info(f"文件扩展名/大小回填完成: {len(pending)} 条")
+    except Exception as e:
+        logger.error(f"文件扩展名/大小回填失败: {str(e)}")
+        db.rollback()
+    finally:
+        db.close()
+
+def hash_file(path, chunk_size: int = UPLOAD_CHUNK_SIZE) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def backfill_content_hashes():
+    """为还没有 content_hash 的旧记录计算一次上传文件的 SHA-256（文件已不存在的跳过）"""
+    db = SessionLocal()
+    try:
+        pending = db.query(FileTextStore.file_id, FileTextStore.ext).filter(
+            FileTextStore.content_hash.is_(None), FileTextStore.ext.isnot(None), FileTextStore.ext != ""
+        ).all()
+        hashed = 0
+        for row in pending:
+            file_path = UPLOAD_DIR / f"{row.file_id}.{row.ext}"
+            if not file_path.exists():
+                continue
+            db.query(FileTextStore).filter(FileTextStore.file_id == row.file_id).update(
+                {FileTextStore.content_hash: hash_file(file_path)}, synchronize_session=False
+            )
+            db.commit()
+            hashed += 1
+        if hashed:
+            logger.info(f"文件内容哈希回填完成: {hashed} 条")
+    except Exception as e:
+        logger.error(f"文件内容哈希回填失败: {str(e)}")
+        db.rollback()
+    finally:
+        db.close()
+
+def migrate_node_documents():
+    """把旧图谱节点的 document_ids（JSON 列表）迁移到 node_documents 关联表"""
+    from services.graph_service import GraphService
+    db = SessionLocal()
+    try:
+        migrated = GraphService(db).migrate_document_ids()
+        if migrated:
+            logger.info(f"🕸️ 图谱节点来源文档迁移完成: {migrated} 个节点")
+    except Exception as e:
+        logger.error(f"图谱节点来源文档迁移失败: {str(e)}")
+        db.rollback()
+    finally:
+        db.close()
+
+def slim_history_results(batch_size: int = 50):
+    """
+    一次性迁移 status 为空的旧历史记录：填充列表投影列；
+    若 FileTextStore 仍保存着正文，则从 result 中删除 extracted_text / layout_data。
+    """
+    db = SessionLocal()
+    try:
+        migrated = 0
+        while True:
+            entries = db.query(AnalysisHistory).filter(AnalysisHistory.status.is_(None)).limit(batch_size).all()
+            if not entries:
+                break
+            for entry in entries:
+                result = entry.result_dict
+                file_record = db.query(FileTextStore).filter(FileTextStore.file_id == entry.file_id).first()
+                if file_record is not None and file_record.text:
+                    if result.get("layout_data") and not file_record.layout_data and not os.path.exists(layout_path(entry.file_id)):
+                        # 正文还在但布局缺失（旧版本只写进了历史记录）：先转存到 .npz，再从结果中删除
+                        save_layout(entry.file_id, result["layout_data"])
+                    for key in HISTORY_HEAVY_KEYS:
+                        result.pop(key, None)
+                entry.result_dict = result
+                if entry.status is None:
+                    entry.status = "unknown"  # 避免空结果反复被迁移
+            db.commit()
+            migrated += len(entries)
+        if migrated:
+            logger.info(f"历史记录瘦身完成: {migrated} 条")
+    except Exception as e:
+        logger.error(f"历史记录瘦身失败: {str(e)}")
+        db.rollback()
+    finally:
+        db.close()
+
+def migrate_legacy_layouts(batch_size: int = 20):
+    """
+    一次性把 FileTextStore.layout_data 中的旧版 JSON 布局转存为列式 .npz 并清空该列。
+    先写文件再提交：提交失败时 JSON 仍在，下次启动重试；已有 .npz 的记录（如重复上传的别名）直接清空。
+    """
+    db = SessionLocal()
+    try:
+        migrated = 0
+        failed = []
+        while True:
+            query = db.query(FileTextStore).filter(FileTextStore.layout_data.isnot(None))
+            if failed:
+                query = query.filter(FileTextStore.file_id.notin_(failed))
+            records = query.limit(batch_size).all()
+            if not records:
+                break
+            for record in records:
+                try:
+                    if not os.path.exists(layout_path(record.file_id)):
+                        save_layout(record.file_id, json.loads(record.layout_data) if record.layout_data else None)
+                    record.layout_data = None
+                    migrated += 1
+                except Exception as e:
+                    failed.append(record.file_id)
+                    logger.error(f"布局迁移失败: {record.file_id}, 错误: {str(e)}")
+            db.commit()
+        if migrated:
+            logger.info(f"旧版 JSON 布局迁移完成: {migrated} 条")
+    except Exception as e:
+        logger.error(f"旧版 JSON 布局迁移失败: {str(e)}")
+        db.rollback()
+    finally:
+        db.close()
+
+def expand_history_result(db: Session, file_id: str, result: dict, include: set) -> dict:
+    """按需把 FileTextStore 中的正文 / 列式布局拼回历史结果（include: {"text", "layout"}）"""
+    if "text" in include and "extracted_text" not in result:
+        row = db.query(FileTextStore.text).filter(FileTextStore.file_id == file_id).first()
+        result["extracted_text"] = row.text if row and row.text else ""
+    if "layout" in include and "layout_data" not in result:
+        layout = read_file_layout(file_id, db=db)
+        result["layout_data"] = layout["pages"] if layout else []
+    return result
+
+def preserve_history_payload(db: Session, file_id: str) -> int:
+    """
+    删除 FileTextStore / 列式布局之前调用：把正文和布局写回该文件的历史记录，
+    历史记录保留时 include=text,layout 仍能取到。返回写回的记录数。
+    """
+    entries = db.query(AnalysisHistory).filter(AnalysisHistory.file_id == file_id).all()
+    pending = [entry for entry in entries if not all(key in entry.result_dict for key in HISTORY_HEAVY_KEYS)]
+    if not pending:
+        return 0
+    payload = expand_history_result(db, file_id, {}, {"text", "layout"})
+    for entry in pending:
+        result = entry.result_dict
+        for key in HISTORY_HEAVY_KEYS:
+            result.setdefault(key, payload[key])
+        entry.result_dict = result
+    return len(pending)
+
+def parse_include(include: Optional[str]) -> set:
+    return {part.strip() for part in (include or "").split(",") if part.strip()}
+
 async def periodic_cleanup():
     """定期清理过期文件"""
     while True:
@@ -197,11 +440,11 @@ async def periodic_cleanup():
 # ======================
 # VectorStore class moved to services/vector_service.py
 # VECTOR_STORES and GLOBAL_HISTORY_STORE imported above
-
+# VECTOR_STORES imported above
 # ======================
 # 辅助函数：保存文件到数据库
 # ======================
-def save_file_to_db(file_id: str, filename: str, text: str = "", chunks: list = None, keywords: list = None, layout_data: list = None, upload_time: float = None) -> None:
+def save_file_to_db(file_id: str, filename: str, text: str = "", chunks: list = None, keywords: list = None, layout_data: list = None, upload_time: float = None, ext: str = None, size: int = None, content_hash: str = None) -> None:
     """
     将文件信息保存到数据库
     
@@ -211,15 +454,17 @@ def save_file_to_db(file_id: str, filename: str, text: str = "", chunks: list =
         text: 提取的文本内容（默认为空）
         chunks: 文本分块列表（默认为空）
         keywords: 关键词列表（默认为空）
-        upload_time: 上传时间（默认为当前时间）
+        upload_time: 上传时间（新记录默认为当前时间；已有记录不传则保持不变）
+        ext: 磁盘文件扩展名（上传时记录，用于 /files 的 SQL 过滤）
+        size: 文件大小（字节）
+        content_hash: 文件内容 SHA-256（上传时计算，用于重复上传复用）
+        layout_data: 布局（PDF words / OCR boxes）；提交成功后写入 uploads/layout/{file_id}.npz，不传则保持不变
     """
     db = SessionLocal()
     try:
         # 设置默认值
         chunks = chunks or []
         keywords = keywords or []
-        layout_data = layout_data or [] # [NEW]
-        upload_time = upload_time or time.time()
         
         # 检查文件是否已存在
         existing_file = db.query(FileTextStore).filter(FileTextStore.file_id == file_id).first()
@@ -229,9 +474,18 @@ def save_file_to_db(file_id: str, filename: str, text: str = "", chunks: list =
             existing_file.text = text
             existing_file.set_chunks_list(chunks)
             existing_file.keywords = json.dumps(keywords, ensure_ascii=False)
-            existing_file.layout_info = layout_data # [NEW]
-            existing_file.upload_time = upload_time
+            if layout_data is not None:
+                existing_file.layout_data = None  # 旧版 JSON 布局作废，新布局在提交后写入 .npz
+            if upload_time:
+                existing_file.upload_time = upload_time
+            if ext is not None:
+                existing_file.ext = ext
+            if size is not None:
+                existing_file.size = size
+            if content_hash is not None:
+                existing_file.content_hash = content_hash
         else:
+            upload_time = upload_time or time.time()
             # 创建新文件记录
             file_record = FileTextStore(
                 file_id=file_id,
@@ -239,12 +493,20 @@ def save_file_to_db(file_id: str, filename: str, text: str = "", chunks: list =
                 text=text,
                 chunks=json.dumps(chunks, ensure_ascii=False),
                 keywords=json.dumps(keywords, ensure_ascii=False),
-                layout_data=json.dumps(layout_data, ensure_ascii=False), # [NEW]
-                upload_time=upload_time
+                upload_time=upload_time,
+                ext=ext,
+                size=size,
+                content_hash=content_hash
             )
             db.add(file_record)
         db.commit()
         logger.info(f"文件信息已保存到数据库: {file_id}")
+        if layout_data is not None:
+            # 记录提交之后再写布局文件：提交失败不会留下孤立/不一致的 .npz
+            try:
+                save_layout(file_id, layout_data)
+            except Exception as e:
+                logger.error(f"保存布局失败: {file_id}, 错误: {str(e)}")
     except Exception as e:
         logger.error(f"保存文件信息到数据库失败: {str(e)}")
         db.rollback()
@@ -252,6 +514,143 @@ def save_file_to_db(file_id: str, filename: str, text: str = "", chunks: list =
     finally:
         db.close()
 
+# ======================
+# 上传去重（内容寻址）
+# ======================
+def _upload_too_large() -> HTTPException:
+    return HTTPException(status_code=413, detail=f"文件过大，最大允许 {UPLOAD_MAX_BYTES // (1024 * 1024)}MB")
+
+async def save_upload_file(file: UploadFile, file_path: Path) -> tuple:
+    """
+    分块写盘并同时计算 SHA-256，返回 (字节数, 十六进制摘要)。
+    内存中只保留一个块；超过 UPLOAD_MAX_BYTES 时返回 413 并删除已写入的部分。
+    先写 .part 文件，完成后再改名，清理任务不会看到写了一半的文件。
+    """
+    if UPLOAD_MAX_BYTES and file.size and file.size > UPLOAD_MAX_BYTES:
+        raise _upload_too_large()
+    part_path = file_path.with_name(file_path.name + ".part")
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with open(part_path, "wb") as f:
+            while True:
+                chunk = await file.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if UPLOAD_MAX_BYTES and size > UPLOAD_MAX_BYTES:
+                    raise _upload_too_large()
+                digest.update(chunk)
+                await asyncio.to_thread(f.write, chunk)
+        os.replace(part_path, file_path)
+    except BaseException:
+        if part_path.exists():
+            part_path.unlink()
+        raise
+    return size, digest.hexdigest()
+
+def decode_text_file(path, chunk_size: int = UPLOAD_CHUNK_SIZE) -> str:
+    """按块增量解码文本文件：优先 UTF-8，出现非法字节则整体改用 GBK（无法解码的字符替换）"""
+    for encoding, errors in (("utf-8", "strict"), ("gbk", "replace")):
+        decoder = codecs.getincrementaldecoder(encoding)(errors=errors)
+        parts = []
+        try:
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(chunk_size), b""):
+                    parts.append(decoder.decode(chunk))
+            parts.append(decoder.decode(b"", final=True))
+        except UnicodeDecodeError:
+            continue
+        return "".join(parts)
+
+def link_or_copy(src, dst):
+    """硬链接（零拷贝；源文件被清理后链接仍然有效），跨文件系统等情况退回复制"""
+    if os.path.exists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+def find_analyzed_duplicate(content_hash: str, ext: str) -> Optional[str]:
+    """内容相同、扩展名相同且已成功分析过的文件ID（取最近一次分析）"""
+    db = SessionLocal()
+    try:
+        row = db.query(FileTextStore.file_id).join(
+            AnalysisHistory, AnalysisHistory.file_id == FileTextStore.file_id
+        ).filter(
+            FileTextStore.content_hash == content_hash,
+            FileTextStore.ext == ext,
+            AnalysisHistory.status == "completed"
+        ).order_by(AnalysisHistory.analysis_time.desc()).first()
+        return row.file_id if row else None
+    finally:
+        db.close()
+
+def create_upload_alias(source_id: str, file_id: str, filename: str, ext: str, size: int, content_hash: str, file_path: Path) -> Optional[dict]:
+    """
+    复用 source_id 的处理结果，为新上传创建别名 file_id（不再跑 OCR/向量化/多智能体/知识图谱）：
+    正文、分块、关键词复制到新的 FileTextStore 记录；上传文件与布局硬链接；
+    向量直接复制（不重新编码）；最近一次成功的分析结果复制为新的历史记录；
+    知识图谱中引用源文件的节点追加新的文档ID。
+    返回与完整分析相同结构的结果（含 extracted_text），源数据不完整时返回 None。
+    """
+    db = SessionLocal()
+    try:
+        src = db.query(FileTextStore).filter(FileTextStore.file_id == source_id).first()
+        history = db.query(AnalysisHistory).filter(
+            AnalysisHistory.file_id == source_id, AnalysisHistory.status == "completed"
+        ).order_by(AnalysisHistory.analysis_time.desc()).first()
+        if src is None or history is None:
+            return None
+
+        src_path = UPLOAD_DIR / f"{source_id}.{ext}"
+        if src_path.exists():
+            link_or_copy(src_path, file_path)  # 替换刚写入的副本，节省磁盘
+        if os.path.exists(layout_path(source_id)):
+            link_or_copy(layout_path(source_id), layout_path(file_id))
+
+        now = time.time()
+        db.add(FileTextStore(
+            file_id=file_id,
+            original_filename=filename,
+            text=src.text,
+            chunks=src.chunks,
+            keywords=src.keywords,
+            layout_data=src.layout_data,  # 旧版 JSON 布局（新数据已在 .npz 中链接）
+            upload_time=now,
+            ext=ext,
+            size=size,
+            content_hash=content_hash
+        ))
+        result = history.result_dict
+        result.update({"file_id": file_id, "filename": filename, "status": "completed"})
+        entry = AnalysisHistory(id=str(uuid.uuid4()), file_id=file_id, filename=filename, analysis_time=now)
+        entry.result_dict = result
+        db.add(entry)
+        db.commit()
+
+        # 向量索引在数据库记录提交之后再写盘：提交失败时不会留下没有记录的索引文件
+        if src.chunks and src.chunks != "[]":
+            try:
+                if VECTOR_STORES.alias(source_id, file_id, {"file_id": file_id, "filename": filename}) is None:
+                    logger.warning(f"源文件向量索引不存在，问答将退回全文片段: {source_id}")
+            except Exception as ve:
+                logger.error(f"❌ 向量索引别名创建失败，问答将退回全文片段: {str(ve)}")
+        try:
+            from services.graph_service import GraphService
+            GraphService(db).add_document_alias(source_id, file_id)
+        except Exception as ge:
+            logger.error(f"❌ [Global Graph] 别名同步失败: {str(ge)}")
+        return {**result, "extracted_text": src.text or ""}
+    except Exception:
+        db.rollback()
+        # 调用方会按新文件重新分析：删除已链接的布局，避免残留
+        delete_layout(file_id)
+        raise
+    finally:
+        db.close()
+
 # ======================
 # ✅ 新增：关键词提取函数
 # ======================
@@ -272,29 +671,9 @@ def extract_keywords_from_text(text: str) -> List[str]:
 # 文档解析函数
 # ======================
 def extract_text_from_pdf(pdf_path: str) -> dict:
-    """解析PDF，返回 {text, layout}"""
+    """解析PDF，返回 {text, layout}；大文件自动切换为多进程按页区间解析"""
     try:
-        import pdfplumber
-        text = ""
-        layout_data = [] # [{"page": 1, "words": [...]}]
-        
-        with pdfplumber.open(pdf_path) as pdf:
-            for i, page in enumerate(pdf.pages):
-                page_text = page.extract_text()
-                if page_text:
-                    text += page_text + "\n"
-                
-                # Extract words with coordinates
-                words = page.extract_words()
-                # words structure: [{x0, top, x1, bottom, text}, ...]
-                layout_data.append({
-                    "page": i + 1,
-                    "width": page.width, # [NEW]
-                    "height": page.height, # [NEW]
-                    "words": words
-                })
-                
-        return {"text": text.strip(), "layout": layout_data}
+        return extract_pdf_layout(pdf_path)
     except ImportError:
         raise HTTPException(status_code=500, detail="缺少PDF解析依赖：请执行 pip install pdfplumber")
     except Exception as e:
@@ -383,11 +762,9 @@ def smart_chunk_text(text: str) -> list:
 # ======================
 # ✅ RAG 问答（保留）
 # ======================
-async def rag_answer(question: str, context_chunks: list) -> str:
-    if not context_chunks:
-        return "未找到相关文档内容。"
+def build_rag_prompt(question: str, context_chunks: list) -> str:
     context = "\n".join(context_chunks)[:4000]
-    prompt = f"""
+    return f"""
 你是一个专业的学术论文分析助手。
 规则：
 1. 优先根据【文档内容】回答问题。
@@ -403,52 +780,37 @@ async def rag_answer(question: str, context_chunks: list) -> str:
 
 【回答】
 """
+
+
+def rag_payload(prompt: str) -> dict:
+    return {
+        "model": "qwen-max",
+        "input": {"messages": [{"role": "user", "content": prompt}]},
+        "parameters": {
+            "temperature": 0.3,
+            "result_format": "message"
+        }
+    }
+
+
+async def rag_answer(question: str, context_chunks: list) -> str:
+    if not context_chunks:
+        return "未找到相关文档内容。"
+    prompt = build_rag_prompt(question, context_chunks)
     try:
-        import asyncio
-        max_retries = 3
-        retry_delay = 5  # 秒
-        response = None
-        
-        async with httpx.AsyncClient() as client:
-            for retry in range(max_retries):
-                try:
-                    logger.info(f"发送RAG请求到Dashscope API，重试次数: {retry+1}/{max_retries}")
-                    response = await client.post(
-                        "https://dashscope.aliyuncs.com/api/v1/services/aigc/text-generation/generation",
-                        headers={
-                            "Authorization": f"Bearer {DASHSCOPE_API_KEY}",
-                            "Content-Type": "application/json"
-                        },
-                        json={
-                            "model": "qwen-max",
-                            "input": {"messages": [{"role": "user", "content": prompt}]},
-                            "parameters": {
-                                "temperature": 0.3,
-                                "result_format": "message"
-                            }
-                        },
-                        timeout=120.0  # 增加超时时间到120秒
-                    )
-                    response.raise_for_status()
-                    logger.info(f"成功收到RAG API响应")
-                    break  # 成功，退出重试循环
-                except httpx.TimeoutException:
-                    logger.warning(f"RAG请求超时，{retry+1}/{max_retries}，将在{retry_delay}秒后重试...")
-                    if retry < max_retries - 1:
-                        await asyncio.sleep(retry_delay)
-                        retry_delay *= 1.5  # 指数退避
-                    else:
-                        logger.error(f"所有RAG请求重试都失败了，请求超时")
-                        return "生成答案时超时，请稍后重试。"
-                except httpx.RequestError as e:
-                    logger.warning(f"RAG请求失败，{retry+1}/{max_retries}，错误: {e}，将在{retry_delay}秒后重试...")
-                    if retry < max_retries - 1:
-                        await asyncio.sleep(retry_delay)
-                        retry_delay *= 1.5  # 指数退避
-                    else:
-                        logger.error(f"所有RAG请求重试都失败了，错误: {e}")
-                        return f"生成答案时出错：{str(e)}"
-        
+        logger.info("发送RAG请求到Dashscope API")
+        try:
+            # 共享连接池 + 统一重试/退避（utils/http_client.py）
+            response = await dashscope_generate(rag_payload(prompt), route="rag", api_key=DASHSCOPE_API_KEY, timeout=120.0)
+        except httpx.TimeoutException:
+            logger.error(f"所有RAG请求重试都失败了，请求超时")
+            return "生成答案时超时，请稍后重试。"
+        except httpx.RequestError as e:
+            logger.error(f"所有RAG请求重试都失败了，错误: {e}")
+            return f"生成答案时出错：{str(e)}"
+        response.raise_for_status()
+        logger.info(f"成功收到RAG API响应")
+
         data = response.json()
         output = data.get("output", {})
         if "choices" in output and isinstance(output["choices"], list):
@@ -461,6 +823,26 @@ async def rag_answer(question: str, context_chunks: list) -> str:
     except Exception as e:
         logger.error(f"RAG 回答生成失败: {str(e)}")
         return f"生成答案时出错：{str(e)}"
+
+
+async def rag_answer_stream(question: str, context_chunks: list):
+    """rag_answer 的流式版本：逐段产出 DashScope 生成的文本（失败时产出与 rag_answer 相同的提示）"""
+    if not context_chunks:
+        yield "未找到相关文档内容。"
+        return
+    prompt = build_rag_prompt(question, context_chunks)
+    started = False
+    try:
+        logger.info("发送流式RAG请求到Dashscope API")
+        async for delta in dashscope_stream(rag_payload(prompt), route="rag", api_key=DASHSCOPE_API_KEY, timeout=120.0):
+            started = True
+            yield delta
+    except httpx.TimeoutException:
+        logger.error(f"流式RAG请求超时")
+        yield ("\n\n" if started else "") + "生成答案时超时，请稍后重试。"
+    except Exception as e:
+        logger.error(f"流式RAG回答生成失败: {str(e)}")
+        yield ("\n\n" if started else "") + f"生成答案时出错：{str(e)}"
 from utils.text_parser import parse_markdown_mindmap # [NEW] Import parser
 
 
@@ -570,27 +952,41 @@ async def websocket_endpoint(websocket: WebSocket, client_id: str):
         manager.disconnect(websocket, client_id)
 
 @app.post("/upload")
-async def upload_file(background_tasks: BackgroundTasks, file: UploadFile = File(...)):
+async def upload_file(file: UploadFile = File(...)):
     try:
         logger.info(f"开始处理文件: {file.filename}, 类型: {file.content_type}")
         file_id = str(uuid.uuid4())
         ext = file.filename.split('.')[-1].lower()
         file_path = UPLOAD_DIR / f"{file_id}.{ext}"
         
-        file_content = await file.read()
-        with open(file_path, "wb") as f:
-            f.write(file_content)
-        logger.info(f"文件已保存到: {file_path}")
+        size, content_hash = await save_upload_file(file, file_path)
+        logger.info(f"文件已保存到: {file_path} ({size} bytes, sha256={content_hash[:12]})")
 
-        # Add background task
-        background_tasks.add_task(
-            process_file_background, 
-            file_id, 
-            file_path, 
-            file.filename, 
-            ext, 
-            file_content
-        )
+        # 同一文件再次上传：直接复用已有的分析结果，只创建新的 file_id 别名
+        if UPLOAD_DEDUP:
+            source_id = await asyncio.to_thread(find_analyzed_duplicate, content_hash, ext)
+            if source_id:
+                try:
+                    reused = await asyncio.to_thread(
+                        create_upload_alias, source_id, file_id, file.filename, ext, size, content_hash, file_path
+                    )
+                except Exception as e:
+                    logger.warning(f"复用分析结果失败，重新分析: {str(e)}")
+                    reused = None
+                if reused is not None:
+                    logger.info(f"♻️ 重复上传，复用 {source_id} 的分析结果: {file.filename} -> {file_id}")
+                    return {
+                        **reused,
+                        "deduplicated": True,
+                        "source_file_id": source_id,
+                        "message": "检测到相同文件，已复用已有分析结果"
+                    }
+
+        # 上传即登记（扩展名/大小供 /files 列表使用；流式解析期间 /ask 也能找到记录）
+        await asyncio.to_thread(save_file_to_db, file_id, file.filename, ext=ext, size=size, content_hash=content_hash)
+
+        # 写入持久化任务队列（按 ANALYSIS_WORKERS / 各阶段并发上限调度，重启后恢复）
+        await analysis_scheduler.submit(file_id, file.filename, ext, file_path)
 
         return {
             "file_id": file_id,
@@ -598,6 +994,8 @@ async def upload_file(background_tasks: BackgroundTasks, file: UploadFile = File
             "status": "processing",
             "message": "文件已上传，正在后台分析中..."
         }
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"上传请求失败: {str(e)}", exc_info=True)
         return Response(
@@ -610,33 +1008,127 @@ app.include_router(dashboard.router, prefix="/api/dashboard", tags=["Dashboard"]
 app.include_router(comparison.router, prefix="/api/comparison", tags=["Comparison"])
 app.include_router(learning.router, prefix="/api/learning", tags=["Learning"])
 
-async def process_file_background(file_id: str, file_path: Path, filename: str, ext: str, file_content: bytes):
+async def stream_pdf_pipeline(file_id: str, file_path: Path, filename: str):
+    """
+    流式PDF处理：解析线程逐页产出 -> 当前协程逐页分块、向量化。
+    第一页完成后即可检索（VectorStore 提前注册到 VECTOR_STORES），
+    每页进度通过 WebSocket 推送。返回 (text, layout_data, chunks, vs)。
+    """
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue(maxsize=PDF_PAGE_QUEUE_SIZE)
+    done = object()
+    stop = threading.Event()
+
+    def produce():
+        try:
+            for page in iter_pdf_pages(str(file_path)):
+                if stop.is_set():
+                    break
+                asyncio.run_coroutine_threadsafe(queue.put(page), loop).result()
+        except BaseException as e:
+            asyncio.run_coroutine_threadsafe(queue.put(e), loop).result()
+        finally:
+            asyncio.run_coroutine_threadsafe(queue.put(done), loop).result()
+
+    producer = loop.run_in_executor(None, produce)
+
+    texts, layout_data, chunks = [], [], []
+    vs = VectorStore()
+    registered = False
+    succeeded = False
+    error = None
+    finished = False
+    try:
+        while not finished:
+            # 取出当前已就绪的所有页面，合并为一次 encode，解析慢时则逐页处理
+            batch = [await queue.get()]
+            while not queue.empty():
+                batch.append(queue.get_nowait())
+
+            new_chunks, new_meta = [], []
+            for item in batch:
+                if item is done:
+                    finished = True
+                    continue
+                if isinstance(item, BaseException):
+                    error = item
+                    continue
+                layout_data.append({"page": item["page"], "width": item["width"], "height": item["height"], "words": item["words"]})
+                if item["text"]:
+                    texts.append(item["text"])
+                    page_chunks = smart_chunk_text(item["text"])
+                    new_chunks.extend(page_chunks)
+                    new_meta.extend({"filename": filename, "file_id": file_id, "page": item["page"]} for _ in page_chunks)
+
+                await manager.broadcast({
+                    "type": "status_update",
+                    "status": "extracting",
+                    "message": f"正在解析第 {item['page']}/{item['total']} 页...",
+                    "progress": 5 + int(25 * item["page"] / max(item["total"], 1)),
+                    "page": item["page"],
+                    "total_pages": item["total"]
+                }, file_id)
+
+            if new_chunks and error is None:
+                # 向量化受 embedding 阶段的并发上限约束（解析本身在调用方的 ocr 阶段内）
+                async with analysis_scheduler.stage("embedding"):
+                    await asyncio.to_thread(vs.add_texts, new_chunks, new_meta)
+                chunks.extend(new_chunks)
+                if not registered and vs.index is not None:
+                    # 仅注册到内存，解析结束后再统一落盘
+                    VECTOR_STORES.put(file_id, vs, persist=False)
+                    registered = True
+                    logger.info(f"⚡ [后台任务] 首批片段已可检索: {filename} ({len(chunks)} chunks)")
+        succeeded = error is None
+    finally:
+        # 出错/取消时让解析线程尽快退出，并释放其可能阻塞的 put
+        stop.set()
+        while not finished and not queue.empty():
+            finished = queue.get_nowait() is done
+        # 解析/向量化失败或被取消：撤销提前注册的半成品索引（仅在内存中，尚未落盘）
+        if registered and not succeeded:
+            VECTOR_STORES.evict(file_id)
+
+    await producer
+    if error is not None:
+        if isinstance(error, ImportError):
+            raise HTTPException(status_code=500, detail="缺少PDF解析依赖：请执行 pip install pdfplumber")
+        logger.error(f"PDF解析失败: {str(error)}")
+        raise HTTPException(status_code=400, detail=f"PDF解析失败: {str(error)}")
+    return "\n".join(texts).strip(), layout_data, chunks, vs
+
+async def process_file_background(file_id: str, file_path: Path, filename: str, ext: str):
     """后台异步处理文件分析任务"""
     logger.info(f"🚀 [后台任务] 开始分析文件: {filename} ({file_id})")
     db = SessionLocal()
+
+    async def in_stage(stage: str, step):
+        # 按阶段限流并统计耗时（见 analysis_scheduler.stage）
+        async with analysis_scheduler.stage(stage, file_id):
+            return await step()
+
     try:
         # 1. 文本提取 (OCR/PDF解析) & 布局信息
         # ======================
         text = ""
         layout_data = []
+        # PDF 在解析过程中已逐页分块并向量化
+        streamed_chunks, streamed_vs = None, None
         
         if ext in ["jpg", "jpeg", "png"]:
-            result = await asyncio.to_thread(extract_text_from_image, str(file_path))
+            result = await in_stage("ocr", lambda: asyncio.to_thread(extract_text_from_image, str(file_path)))
             text = result["text"]
             layout_data = result["layout"]
         elif ext == "pdf":
-            result = await asyncio.to_thread(extract_text_from_pdf, str(file_path))
-            text = result["text"]
-            layout_data = result["layout"]
+            text, layout_data, streamed_chunks, streamed_vs = await in_stage(
+                "ocr", lambda: stream_pdf_pipeline(file_id, file_path, filename)
+            )
         elif ext in ["txt", "log"]:
-            try:
-                text = file_content.decode("utf-8")
-            except UnicodeDecodeError:
-                text = file_content.decode("gbk", errors="replace")
+            text = await asyncio.to_thread(decode_text_file, file_path)
             # layout for text files could be line-based if needed, but for now empty
             layout_data = [] 
         else:
-            raise Exception(f"不支持的文件格式: {ext}")
+            raise HTTPException(status_code=400, detail=f"不支持的文件格式: {ext}")
             
         # [FIX] Handle empty text case to avoid agent confusion
         if not text or not text.strip():
@@ -656,10 +1148,12 @@ async def process_file_background(file_id: str, file_path: Path, filename: str,
         # 2. 预处理 (关键词/分块)
         # ======================
         keywords = extract_keywords_from_text(text)
-        chunks = smart_chunk_text(text)
+        chunks = streamed_chunks if streamed_chunks else smart_chunk_text(text)
         
         # 更新数据库 (初步保存)
         save_file_to_db(file_id, filename, text, chunks, keywords, layout_data)
+        # 文档内容已更新，之前缓存的回答作废
+        answer_cache.invalidate(file_id)
         
         # 3. 并行执行：向量化 (CPU/Blocking) & Multi-Agent 分析 (I/O/API)
         # ======================
@@ -667,11 +1161,17 @@ async def process_file_background(file_id: str, file_path: Path, filename: str,
 
         # 定义向量化任务
         async def run_embedding():
+            if streamed_chunks:
+                # 已在解析阶段完成向量化，这里只需持久化
+                await asyncio.to_thread(VECTOR_STORES.put, file_id, streamed_vs)
+                logger.info(f"✅ [后台任务] 向量化完成 (Chunks: {len(chunks)}, 逐页流式)")
+                return streamed_vs
             vs = VectorStore() # Uses the imported class from services.vector_service
             # Prepare metadata for each chunk
             metadatas = [{"filename": filename, "file_id": file_id} for _ in chunks]
             await asyncio.to_thread(vs.add_texts, chunks, metadatas)
-            VECTOR_STORES[file_id] = vs
+            # 写入磁盘索引 (uploads/index/{file_id}.faiss)，重启后可直接加载
+            await asyncio.to_thread(VECTOR_STORES.put, file_id, vs)
             logger.info(f"✅ [后台任务] 向量化完成 (Chunks: {len(chunks)})")
             return vs
 
@@ -730,8 +1230,8 @@ async def process_file_background(file_id: str, file_path: Path, filename: str,
             return result, agent_types
 
         # 并行执行
-        embedding_task = asyncio.create_task(run_embedding())
-        analysis_task = asyncio.create_task(run_agent_analysis())
+        embedding_task = asyncio.create_task(in_stage("embedding", run_embedding))
+        analysis_task = asyncio.create_task(in_stage("llm", run_agent_analysis))
         
         # [STREAM] Status
         await manager.broadcast({
@@ -764,7 +1264,7 @@ async def process_file_background(file_id: str, file_path: Path, filename: str,
         # 后续逻辑不变...
         doc_type = agent_types[0] if agent_types else "general"
         try:
-            knowledge_graph = await extract_knowledge_graph_from_text(summary, doc_type=doc_type)
+            knowledge_graph = await in_stage("llm", lambda: extract_knowledge_graph_from_text(summary, doc_type=doc_type))
         except Exception as e:
             logger.error(f"❌ 知识图谱生成失败: {str(e)}")
             knowledge_graph = {"nodes": [], "edges": []}
@@ -776,25 +1276,13 @@ async def process_file_background(file_id: str, file_path: Path, filename: str,
             
             logger.info(f"🔄 [Global Graph] Syncing {len(knowledge_graph.get('nodes', []))} nodes to Global Brain...")
             
-            for node in knowledge_graph.get("nodes", []):
-                # Use label as primary key for merging, fallback to id
-                node_name = node.get("label") or node.get("id")
-                if node_name:
-                    graph_service.add_node(
-                        name=node_name, 
-                        category=node.get("type", "Concept"), 
-                        source_doc_id=file_id
-                    )
-            
-            for edge in knowledge_graph.get("edges", []):
-                # We assume edge source/target refer to node IDs (which we mapped to names)
-                # But sometimes they might be IDs. We need to be careful.
-                # In our simple extractor, usually id=label. 
-                graph_service.add_edge(
-                    source_name=edge.get("source"),
-                    target_name=edge.get("target"),
-                    relation=edge.get("relation", "related_to")
-                )
+            # 一次名称查询 + 一个事务批量写入（节点名取 label，缺省用 id；边端点为节点 id 时映射到名称）
+            stats = graph_service.merge_subgraph(
+                knowledge_graph.get("nodes", []),
+                knowledge_graph.get("edges", []),
+                doc_id=file_id
+            )
+            logger.info(f"🔄 [Global Graph] {stats}")
             
             logger.info("✅ [Global Graph] Integrated new knowledge into global brain")
         except Exception as ge:
@@ -808,7 +1296,7 @@ async def process_file_background(file_id: str, file_path: Path, filename: str,
         else:
              # Fallback to KG based generation
              try:
-                 mindmap_data = await generate_mindmap_from_kg(knowledge_graph, reasoning_steps)
+                 mindmap_data = await in_stage("llm", lambda: generate_mindmap_from_kg(knowledge_graph, reasoning_steps))
              except Exception as e:
                  logger.error(f"❌ 思维导图生成失败: {str(e)}")
                  mindmap_data = {"root": {"id": "root", "topic": "生成失败", "children": []}}
@@ -822,8 +1310,8 @@ async def process_file_background(file_id: str, file_path: Path, filename: str,
             "filename": filename,
             "mindmap": mindmap_data,
             "knowledge_graph": knowledge_graph,
-            "extracted_text": text,
-            "layout_data": layout_data,
+            # 正文/布局不复制进历史记录（见 FileTextStore 与 /files/{file_id}/layout）
+            "layout_pages": len(layout_data) if ext == "pdf" else (1 if layout_data else 0),
             "summary": summary,
             "reasoning_steps": reasoning_steps,
             "agent_types": agent_types, # [NEW] Pass to frontend for conditional UI
@@ -896,11 +1384,21 @@ async def process_file_background(file_id: str, file_path: Path, filename: str,
 
         # [NEW] WebSocket 推送
         logger.info(f"🚀 [Socket] Broadcasting to {file_id}. Payload sizes -> MindMap: {len(str(mindmap_data))}, KG: {len(str(knowledge_graph))}")
-        await manager.broadcast(response_data, file_id)
+        await manager.broadcast({**response_data, "extracted_text": text}, file_id)
         
         logger.info(f"🎉 [后台任务] 分析全部完成，结果已推送给客户端: {file_id}")
 
     except Exception as e:
+        if analysis_scheduler.will_retry(file_id, e):
+            # 调度器会按退避时间自动重试，这里不写失败记录
+            logger.warning(f"⚠️ [后台任务] 处理失败，稍后重试: {str(e)}")
+            await manager.broadcast({
+                "type": "status_update",
+                "status": "retrying",
+                "message": f"分析失败，稍后自动重试: {str(e)}",
+                "progress": 0
+            }, file_id)
+            raise
         logger.error(f"❌ [后台任务] 处理失败: {str(e)}", exc_info=True)
         # 推送错误消息
         error_response = {"status": "failed", "error": str(e), "file_id": file_id}
@@ -919,23 +1417,62 @@ async def process_file_background(file_id: str, file_path: Path, filename: str,
              db.commit()
         except:
              pass
+        # 交给调度器把任务标记为 failed
+        raise
     finally:
         db.close()
 
+async def run_analysis_job(job: dict):
+    await process_file_background(job["file_id"], Path(job["file_path"]), job["filename"], job["ext"])
+
+def is_retryable_analysis_error(exc: BaseException) -> bool:
+    # HTTPException 来自文件本身（格式不支持、PDF损坏、缺少解析依赖），重试也不会成功
+    return not isinstance(exc, HTTPException)
+
+analysis_scheduler = AnalysisScheduler(handler=run_analysis_job, is_retryable=is_retryable_analysis_error)
+
+@app.get("/analysis/metrics")
+async def get_analysis_metrics():
+    """分析任务队列指标：队列深度、运行中任务、各阶段并发与耗时"""
+    return await analysis_scheduler.metrics()
+
 @app.get("/analysis/{file_id}/status")
-async def get_analysis_status(file_id: str):
-    """查询文件分析状态"""
+async def get_analysis_status(
+    file_id: str,
+    include: Optional[str] = Query("text", description="附加字段，逗号分隔：text,layout")
+):
+    """查询文件分析状态（任务表记录排队/执行/失败，完成后的结果来自历史记录）"""
+    job = await analysis_scheduler.get(file_id)
+    if job is not None and job["status"] in ("queued", "running"):
+        return {
+            "status": "processing",
+            "job_status": job["status"],
+            "stage": job["stage"],
+            "attempts": job["attempts"],
+            "max_attempts": job["max_attempts"],
+            "error": job["error"]  # 上一次失败原因（等待重试时）
+        }
+    if job is not None and job["status"] == "failed":
+        return {"status": "failed", "error": job["error"], "attempts": job["attempts"]}
+
     db = SessionLocal()
     try:
         # 查询历史记录是否存在
         record = db.query(AnalysisHistory).filter(AnalysisHistory.file_id == file_id).order_by(AnalysisHistory.created_at.desc()).first()
         
         if not record:
-            # 可能是正在处理中，或者根本不存在
-            # 简单起见，我们假设不存在就是还没处理完（因为我们是先返回再处理）
-            # 更好的做法是有一个独立的 Task 表记录状态
-            # 这里暂时返回 processing，前端设置超时
-            return {"status": "processing"}
+            # 既没有任务也没有历史记录：已上传的文件（磁盘上有文件或有正文记录）保持原先的 processing 响应，
+            # 只有完全未知的 file_id 才返回 404
+            known = db.query(FileTextStore.file_id).filter(FileTextStore.file_id == file_id).first() is not None \
+                or any(os.path.exists(os.path.join(UPLOAD_DIR, f"{file_id}.{ext}"))
+                       for ext in SUPPORTED_UPLOAD_EXTS)
+            if known:
+                return {"status": "processing"}
+            return Response(
+                content=json.dumps({"status": "not_found"}, ensure_ascii=False),
+                media_type="application/json",
+                status_code=404
+            )
         
         result = record.result_dict
         if result.get("status") == "failed":
@@ -946,7 +1483,7 @@ async def get_analysis_status(file_id: str):
         if result.get("status") == "completed" or "mindmap" in result:
              # 返回完整结果
              result["status"] = "completed"
-             return result
+             return expand_history_result(db, file_id, result, parse_include(include))
         
         return {"status": "processing"}
     finally:
@@ -967,13 +1504,11 @@ async def upload_file_simple(file: UploadFile = File(...)):
         if ext != "pdf":
             raise HTTPException(status_code=400, detail="仅支持PDF文件上传")
         
-        file_content = await file.read()
-        with open(file_path, "wb") as f:
-            f.write(file_content)
+        size, content_hash = await save_upload_file(file, file_path)
         logger.info(f"文件已保存到: {file_path}")
         
         # 保存文件信息到数据库
-        save_file_to_db(file_id, file.filename)
+        save_file_to_db(file_id, file.filename, ext=ext, size=size, content_hash=content_hash)
         
         # 返回简单的响应
         response_data = {
@@ -1009,78 +1544,37 @@ async def get_files(
     page_size: int = Query(10, ge=1, le=100, description="每页显示的文件数量"),
     file_type: str = Query(None, description="可选的文件类型过滤，如'pdf'、'txt'等")
 ):
-    """获取上传文件列表，支持分页"""
+    """获取上传文件列表，支持分页（过滤、排序、分页均在 SQL 中完成，不加载正文等大字段）"""
     try:
-        files = []
-        
-        # 使用数据库会话获取所有文件信息
         db = SessionLocal()
         try:
-            # 获取所有文件存储记录
-            file_records = db.query(FileTextStore).all()
-            file_store_dict = {record.file_id: record for record in file_records}
+            query = db.query(
+                FileTextStore.file_id,
+                FileTextStore.original_filename,
+                FileTextStore.upload_time,
+                FileTextStore.size,
+                FileTextStore.ext
+            ).filter(FileTextStore.ext.isnot(None), FileTextStore.ext != "")
+            # 如果指定了文件类型过滤，则只返回该类型
+            if file_type:
+                query = query.filter(FileTextStore.ext == file_type.lower())
+                # 额外检查：如果是PDF类型，确保文件名包含.pdf扩展名
+                if file_type.lower() == "pdf":
+                    query = query.filter(FileTextStore.original_filename.ilike("%.pdf"))
+            
+            total = query.count()
+            # 按上传时间降序排序
+            rows = query.order_by(FileTextStore.upload_time.desc()).offset((page - 1) * page_size).limit(page_size).all()
         finally:
             db.close()
         
-        # 只处理在FileTextStore中有记录的文件
-        for file_id, record in file_store_dict.items():
-            # 检查所有支持的文件类型
-            found = False
-            # 如果指定了文件类型过滤，则只检查该类型
-            if file_type:
-                # 只检查指定的文件类型
-                ext = file_type
-                file_path = os.path.join(str(UPLOAD_DIR), f"{file_id}.{ext}")
-                if os.path.isfile(file_path):
-                    # 获取文件大小
-                    file_size = os.path.getsize(file_path)
-                    
-                    # 使用数据库中的原始文件名和上传时间
-                    original_filename = record.original_filename or f"{file_id}.{ext}"
-                    upload_time = record.upload_time or os.path.getmtime(file_path)
-                    
-                    # 额外检查：如果是PDF类型，确保文件名包含.pdf扩展名
-                    if ext == 'pdf' and not original_filename.lower().endswith('.pdf'):
-                        continue
-                    
-                    files.append({
-                        "file_id": file_id,
-                        "filename": original_filename,
-                        "upload_time": upload_time,
-                        "size": file_size,
-                        "type": ext
-                    })
-                    found = True
-            else:
-                # 如果没有指定文件类型，检查所有支持的文件类型
-                for ext in ["pdf", "txt", "log", "jpg", "jpeg", "png"]:
-                    file_path = os.path.join(str(UPLOAD_DIR), f"{file_id}.{ext}")
-                    if os.path.isfile(file_path):
-                        # 获取文件大小
-                        file_size = os.path.getsize(file_path)
-                        
-                        # 使用数据库中的原始文件名和上传时间
-                        original_filename = record.original_filename or f"{file_id}.{ext}"
-                        upload_time = record.upload_time or os.path.getmtime(file_path)
-                        
-                        files.append({
-                            "file_id": file_id,
-                            "filename": original_filename,
-                            "upload_time": upload_time,
-                            "size": file_size,
-                            "type": ext
-                        })
-                        found = True
-                        break  # 只添加第一个找到的文件（通常只有一个扩展名）
-        
-        # 按上传时间降序排序
-        files.sort(key=lambda x: x["upload_time"], reverse=True)
-        
-        # 计算总数和分页信息 - 现在总数是实际显示的文件数
-        total = len(files)
-        start = (page - 1) * page_size
-        end = start + page_size
-        paginated_files = files[start:end]
+        paginated_files = [{
+            "file_id": row.file_id,
+            "filename": row.original_filename or f"{row.file_id}.{row.ext}",
+            "upload_time": row.upload_time,
+            "size": row.size,
+            "type": row.ext
+        } for row in rows]
         
         return {
             "status": "success",
@@ -1096,6 +1590,45 @@ async def get_files(
         logger.error(f"获取文件列表失败: {str(e)}")
         raise HTTPException(status_code=500, detail=f"获取文件列表失败: {str(e)}")
 
+def read_file_layout(file_id: str, page: Optional[int] = None, db: Optional[Session] = None) -> Optional[dict]:
+    """
+    读取列式布局（只读；旧版 JSON 布局已在启动时由 migrate_legacy_layouts 转换）。
+    未知文件返回 None；db 为调用方的会话，不传则临时打开一个只读会话。
+    """
+    reader = open_layout(file_id)
+    if reader is None:
+        own_session = db is None
+        db = db or SessionLocal()
+        try:
+            known = db.query(FileTextStore.file_id).filter(FileTextStore.file_id == file_id).first() is not None
+        finally:
+            if own_session:
+                db.close()
+        if not known:
+            return None
+        return {"file_id": file_id, "kind": None, "page_count": 0, "pages": []}
+
+    with reader:
+        if page is None:
+            pages = reader.to_list()
+        else:
+            data = reader.page(page)
+            if data is None:
+                raise HTTPException(status_code=404, detail=f"页码不存在: {page}")
+            pages = data if reader.kind == "ocr" else [data]
+        return {"file_id": file_id, "kind": reader.kind, "page_count": reader.page_count, "pages": pages}
+
+@app.get("/files/{file_id}/layout")
+async def get_file_layout(
+    file_id: str,
+    page: Optional[int] = Query(None, ge=1, description="页码（从1开始）；不传则返回全部页")
+):
+    """按页获取文字坐标（PDF words / OCR boxes），与原 layout_data 结构一致"""
+    result = await asyncio.to_thread(read_file_layout, file_id, page)
+    if result is None:
+        raise HTTPException(status_code=404, detail="文件不存在")
+    return result
+
 @app.delete("/files/{file_id}")
 async def delete_file(file_id: str, db: Session = Depends(get_db)):
     """删除单个文件（保留分析历史记录）"""
@@ -1116,8 +1649,12 @@ async def delete_file(file_id: str, db: Session = Depends(get_db)):
         if file_id in VECTOR_STORES:
             del VECTOR_STORES[file_id]
             
-        # [FIX] 清理数据库记录
+        # [FIX] 清理数据库记录（历史记录保留，先写回正文/布局）
+        preserve_history_payload(db, file_id)
         db.query(FileTextStore).filter(FileTextStore.file_id == file_id).delete()
+        db.query(AnalysisJob).filter(AnalysisJob.file_id == file_id).delete()
+        answer_cache.invalidate(file_id)
+        delete_layout(file_id)
         
         # [NEW] 清理知识图谱
         try:
@@ -1175,8 +1712,13 @@ async def delete_all_files(db: Session = Depends(get_db)):
                                 deleted_count += 1
                                 logger.info(f"已删除文件: {del_file_path}")
                         
-                        # [FIX] 清理数据库记录
+                        # [FIX] 清理数据库记录（历史记录保留，先写回正文/布局）；每个文件单独提交
+                        preserve_history_payload(db, file_id)
                         db.query(FileTextStore).filter(FileTextStore.file_id == file_id).delete()
+                        db.query(AnalysisJob).filter(AnalysisJob.file_id == file_id).delete()
+                        db.commit()
+                        answer_cache.invalidate(file_id)
+                        delete_layout(file_id)
                         
                         # [NEW] 清理知识图谱
                         try:
@@ -1218,12 +1760,19 @@ async def get_analysis_history(
         # 计算偏移量和限制
         offset = (page - 1) * page_size
         
-        # 查询数据（按分析时间倒序排列）
-        history_entries = db.query(AnalysisHistory).order_by(
+        # 查询数据（按分析时间倒序排列）；只取投影列，不解析 result JSON
+        history_entries = db.query(
+            AnalysisHistory.id,
+            AnalysisHistory.file_id,
+            AnalysisHistory.filename,
+            AnalysisHistory.analysis_time,
+            AnalysisHistory.status,
+            AnalysisHistory.summary_preview
+        ).order_by(
             AnalysisHistory.analysis_time.desc()
         ).offset(offset).limit(page_size).all()
         
-        # 转换为响应格式
+        # 转换为响应格式（完整结果请求 /history/{id}）
         paginated_history = []
         for entry in history_entries:
             paginated_history.append({
@@ -1231,7 +1780,12 @@ async def get_analysis_history(
                 "file_id": entry.file_id,
                 "filename": entry.filename,
                 "analysis_time": entry.analysis_time,
-                "result": entry.result_dict
+                "result": {
+                    "file_id": entry.file_id,
+                    "filename": entry.filename,
+                    "status": entry.status,
+                    "summary": entry.summary_preview or ""
+                }
             })
         
         return {
@@ -1248,9 +1802,10 @@ async def get_analysis_history(
 @app.get("/history/{history_id}")
 async def get_analysis_history_detail(
     history_id: str,
+    include: Optional[str] = Query(None, description="附加字段，逗号分隔：text,layout"),
     db: Session = Depends(get_db)
 ):
-    """获取指定历史记录的详情"""
+    """获取指定历史记录的详情；?include=text,layout 时附带正文与布局"""
     try:
         # 查找指定的历史记录
         history_item = db.query(AnalysisHistory).filter(AnalysisHistory.id == history_id).first()
@@ -1263,7 +1818,7 @@ async def get_analysis_history_detail(
             "file_id": history_item.file_id,
             "filename": history_item.filename,
             "analysis_time": history_item.analysis_time,
-            "result": history_item.result_dict
+            "result": expand_history_result(db, history_item.file_id, history_item.result_dict, parse_include(include))
         }
         
         return {
@@ -1317,6 +1872,9 @@ async def delete_analysis_history(
             
             # 清理数据库中的文件记录
             db.query(FileTextStore).filter(FileTextStore.file_id == file_id).delete()
+            db.query(AnalysisJob).filter(AnalysisJob.file_id == file_id).delete()
+            answer_cache.invalidate(file_id)
+            delete_layout(file_id)
             
             # 清理向量存储
             if file_id in VECTOR_STORES:
@@ -1374,6 +1932,9 @@ async def delete_all_analysis_history(db: Session = Depends(get_db)):
             
             # 清理数据库中的文件记录
             db.query(FileTextStore).filter(FileTextStore.file_id == file_id).delete()
+            db.query(AnalysisJob).filter(AnalysisJob.file_id == file_id).delete()
+            answer_cache.invalidate(file_id)
+            delete_layout(file_id)
             
             # 清理向量存储
             if file_id in VECTOR_STORES:
@@ -1414,158 +1975,13 @@ async def health_check():
 # ======================
 # Semantic Teacher Mode (User Memory)
 # ======================
-class UserMemory:
-    def __init__(self):
-        # Key: file_id, Value: List of memory dicts
-        self.memories = {}
-
-    def add_memory(self, file_id, question, correction):
-        """Add a correction to semantic memory for a specific file"""
-        if GLOBAL_HISTORY_STORE.model:
-            vector = GLOBAL_HISTORY_STORE.model.encode(question)
-            try:
-                norm = np.linalg.norm(vector)
-                if norm > 0:
-                    vector = vector / norm
-            except:
-                pass
-            
-            if file_id not in self.memories:
-                self.memories[file_id] = []
-                
-            file_memories = self.memories[file_id]
-            
-            # Check for existing similar memory (Threshold > 0.95)
-            best_idx = -1
-            best_sim = -1.0
-            
-            for idx, mem in enumerate(file_memories):
-                try:
-                    sim = np.dot(vector, mem["vector"])
-                    if sim > best_sim:
-                        best_sim = sim
-                        best_idx = idx
-                except:
-                    continue
-            
-            # Merge if highly similar
-            if best_idx >= 0 and best_sim > 0.95:
-                current_text = file_memories[best_idx]["correction"]
-                if correction not in current_text:
-                    new_correction = current_text + "\n" + correction
-                    file_memories[best_idx]["correction"] = new_correction
-                    
-                    # [DB] Update existing rule
-                    try:
-                        db = SessionLocal()
-                        rule = db.query(TeacherRule).filter(TeacherRule.id == file_memories[best_idx]["id"]).first()
-                        if rule:
-                            rule.correction = new_correction
-                            db.commit()
-                        db.close()
-                    except Exception as e:
-                        logger.error(f"Failed to update rule in DB: {e}")
-
-                    logger.info(f"🧠 [Teacher Mode] MERGED concept (Sim: {best_sim:.2f}) for File {file_id}: {question} -> {new_correction}")
-                else:
-                    logger.info(f"🧠 [Teacher Mode] SKIPPED duplicate concept (Sim: {best_sim:.2f})")
-                
-                file_memories[best_idx]["timestamp"] = time.time()
-                return
-
-            # [DB] Create new rule
-            rule_id = str(uuid.uuid4())
-            try:
-                db = SessionLocal()
-                new_rule = TeacherRule(
-                    id=rule_id,
-                    file_id=file_id,
-                    question=question,
-                    correction=correction
-                )
-                db.add(new_rule)
-                db.commit()
-                db.close()
-            except Exception as e:
-                logger.error(f"Failed to save rule to DB: {e}")
-
-            file_memories.append({
-                "id": rule_id,
-                "vector": vector,
-                "question": question,
-                "correction": correction,
-                "timestamp": time.time()
-            })
-            logger.info(f"🧠 [Teacher Mode] Learned new concept for File {file_id}: {question} -> {correction}")
-            
-    # Optimized threshold for better precision
-    def search_memory(self, file_id, question, threshold=0.62):
-        """Search for relevant corrections within a specific file"""
-        if file_id not in self.memories:
-            logger.info(f"🧠 [Memory Search] Skipped: No memories for File {file_id}")
-            return None
-            
-        target_memories = self.memories[file_id]
-        logger.info(f"🧠 [Memory Search Entry] File: {file_id} | Query: '{question}' | Memories: {len(target_memories)}")
-        
-        if not GLOBAL_HISTORY_STORE.model:
-            logger.error("🧠 [Memory Search] Aborted: Embedding model not loaded!")
-            return None
-            
-        q_vec = GLOBAL_HISTORY_STORE.model.encode(question)
-        q_norm = np.linalg.norm(q_vec)
-        if q_norm > 0:
-            q_vec = q_vec / q_norm
-            
-        matches = []
-        
-        logger.info(f"🧠 [Memory Search] Query: {question}")
-        for mem in target_memories:
-            score = np.dot(q_vec, mem["vector"])
-            logger.info(f"   - Candidate: '{mem['question']}' | Score: {score:.4f}")
-            if score >= threshold:
-                matches.append({
-                    "correction": mem["correction"],
-                    "score": score
-                })
-        
-        if matches:
-            matches.sort(key=lambda x: x["score"], reverse=True)
-            top_matches = matches[:3]
-            
-            seen_corrections = set()
-            final_corrections = []
-            for m in top_matches:
-                parts = m["correction"].split('\n')
-                for part in parts:
-                    part = part.strip()
-                    if part and part not in seen_corrections:
-                        seen_corrections.add(part)
-                        final_corrections.append(part)
-            
-            combined_correction = "\n".join(final_corrections)
-            logger.info(f"🧠 [Teacher Mode] Recall triggered (Top Score: {matches[0]['score']:.4f}). Combined {len(final_corrections)} facts.")
-            return {"correction": combined_correction}
-            
-        logger.info(f"🧠 [Teacher Mode] No match found")
-        return None
-
 GLOBAL_USER_MEMORY = UserMemory()
 
 # [DEBUG] Endpoints for Teacher Mode
 @app.get("/debug/memory")
 async def get_debug_memory():
     """View current semantic memory"""
-    all_items = []
-    for fid, mems in GLOBAL_USER_MEMORY.memories.items():
-        for m in mems:
-            all_items.append({
-                "file_id": fid,
-                "question": m["question"],
-                "correction": m["correction"],
-                "timestamp": m["timestamp"]
-            })
-            
+    all_items = GLOBAL_USER_MEMORY.items()
     return {
         "count": len(all_items),
         "items": all_items
@@ -1577,35 +1993,26 @@ async def check_debug_memory(payload: dict = Body(...)):
     question = payload.get("question", "")
     target_file_id = payload.get("file_id", None)
     
-    # Calculate all scores across all files
+    # Calculate all scores across all files (one matrix-vector product per file)
     scores = []
-    if GLOBAL_HISTORY_STORE.model:
-        q_vec = GLOBAL_HISTORY_STORE.model.encode(question)
-        q_norm = np.linalg.norm(q_vec)
-        if q_norm > 0: q_vec = q_vec / q_norm
-        
-        for fid, mems in GLOBAL_USER_MEMORY.memories.items():
-            if target_file_id and fid != target_file_id:
-                continue
-                
-            for m in mems:
-                score = np.dot(q_vec, m["vector"])
-                scores.append({
-                    "file_id": fid,
-                    "question": m["question"],
-                    "correction": m["correction"],
-                    "score": float(score)
-                })
+    q_vec = await embedding_service.encode(question)
+    if q_vec is not None:
+        scores = GLOBAL_USER_MEMORY.score_all(q_vec, file_id=target_file_id)
     
     match = None
     if target_file_id:
-        match = GLOBAL_USER_MEMORY.search_memory(target_file_id, question, threshold=0.0)
+        match = GLOBAL_USER_MEMORY.search_memory(target_file_id, question, threshold=0.0, q_vec=q_vec)
     
     return {
         "best_match_for_file": match,
-        "all_scores": sorted(scores, key=lambda x: x["score"], reverse=True)
+        "all_scores": scores
     }
 
+@app.get("/debug/embedding")
+async def get_debug_embedding():
+    """Embedding service cache / micro-batch statistics"""
+    return embedding_service.get_stats()
+
 # [NEW] Persistence: Restore memory from DB on startup
 def rebuild_memory_from_db():
     """Load from TeacherRule table. If empty, migrate from QAHistory (One-time)"""
@@ -1613,36 +2020,9 @@ def rebuild_memory_from_db():
     db = SessionLocal()
     count = 0
     try:
-        # 1. Load from TeacherRule (Primary Source)
-        rules = db.query(TeacherRule).all()
-        if rules:
-            logger.info(f"🧠 [Teacher Mode] Loading {len(rules)} rules from TeacherRule table...")
-            for r in rules:
-                questions = r.question # Currently 1:1, but could be N:1
-                # If question is stored as a list in string or just string.
-                # Just add directly.
-                # Note: We must inject the ID so we can update it later.
-                if r.file_id and r.question and r.correction:
-                    if r.file_id not in GLOBAL_USER_MEMORY.memories:
-                        GLOBAL_USER_MEMORY.memories[r.file_id] = []
-                    
-                    if GLOBAL_HISTORY_STORE.model:
-                        vector = GLOBAL_HISTORY_STORE.model.encode(r.question)
-                        try:
-                            norm = np.linalg.norm(vector)
-                            if norm > 0: vector = vector / norm
-                        except:
-                            pass
-                        
-                        GLOBAL_USER_MEMORY.memories[r.file_id].append({
-                            "id": r.id,
-                            "vector": vector,
-                            "question": r.question,
-                            "correction": r.correction,
-                            "timestamp": r.created_at.timestamp() if r.created_at else time.time()
-                        })
-                        count += 1
-            logger.info(f"🧠 [Teacher Mode] Loaded {count} rules from TeacherRule table.")
+        # 1. Load from TeacherRule (Primary Source): stored embeddings, batch-encode only missing/stale rows
+        if GLOBAL_USER_MEMORY.restore_from_db():
+            logger.info(f"🧠 [Teacher Mode] Restored {GLOBAL_USER_MEMORY.count()} rules from TeacherRule table.")
             return
 
         # 2. Migration: If TeacherRule is empty, scan QAHistory (Backward Compatibility)
@@ -1668,8 +2048,20 @@ def rebuild_memory_from_db():
     finally:
         db.close()
 
-# Execute restoration immediately on startup
-rebuild_memory_from_db()
+# Restoration runs in the background from startup_event (after the server is ready)
+memory_restore_task = None
+
+def on_memory_restored(task):
+    """Log the restore outcome; answers cached before the rules were loaded ignored them, drop them all"""
+    if task.cancelled():
+        logger.warning("🧠 [Teacher Mode] Memory restore cancelled")
+        return
+    error = task.exception()
+    if error is not None:
+        logger.error(f"🧠 [Teacher Mode] Memory restore task failed: {error}")
+    else:
+        logger.info(f"🧠 [Teacher Mode] Memory restore finished ({GLOBAL_USER_MEMORY.count()} rules)")
+    answer_cache.invalidate_all(reason="rules")
 
 class FeedbackRequest(BaseModel):
     file_id: str
@@ -1702,7 +2094,8 @@ async def submit_feedback(feedback: FeedbackRequest):
             
             if question_text:
                 # Store in Semantic Memory
-                GLOBAL_USER_MEMORY.add_memory(feedback.file_id, question_text, feedback.comment)
+                q_vec = await embedding_service.encode(question_text)
+                GLOBAL_USER_MEMORY.add_memory(feedback.file_id, question_text, feedback.comment, vector=q_vec)
                 return {"status": "success", "message": "已学习新知识 (Teacher Mode Active)"}
                 
         return {"status": "success", "message": "Feedback received"}
@@ -1757,14 +2150,9 @@ async def delete_teacher_rule(rule_id: str):
         db.commit()
         
         # 2. Update In-Memory cache
-        if file_id in GLOBAL_USER_MEMORY.memories:
-            original_len = len(GLOBAL_USER_MEMORY.memories[file_id])
-            GLOBAL_USER_MEMORY.memories[file_id] = [
-                m for m in GLOBAL_USER_MEMORY.memories[file_id] 
-                if m.get("id") != rule_id
-            ]
-            new_len = len(GLOBAL_USER_MEMORY.memories[file_id])
-            logger.info(f"🧠 [Teacher Mode] Deleted rule {rule_id} from memory. ({original_len} -> {new_len})")
+        if GLOBAL_USER_MEMORY.remove_rule(file_id, rule_id):
+            logger.info(f"🧠 [Teacher Mode] Deleted rule {rule_id} from memory. ({GLOBAL_USER_MEMORY.count(file_id)} left)")
+        answer_cache.invalidate(file_id, reason="rules")
             
         return {"status": "success", "message": "Rule deleted"}
     finally:
@@ -1773,6 +2161,132 @@ async def delete_teacher_rule(rule_id: str):
 # ======================
 # 视频分析相关API路由
 # ======================
+async def prepare_ask(db, question: str, file_id: str) -> dict:
+    """
+    /ask 与 /ask/stream 共用的准备步骤。返回 {"response": ...}（可直接返回的结果：
+    5 秒内的重复提问、关键词问题、语义缓存命中），或
+    {"results": 检索片段, "final_question": 注入指正后的问题, "q_vec", "cache_version"}
+    """
+    # [TEACHER MODE POINTER]
+    # Using a higher threshold (0.62) to avoid irrelevant recollections
+    logger.info(f"⚡ [Debug] Checking UserMemory for: '{question}' (File: {file_id})")
+    teacher_instruction = ""  # Default empty string if no match
+    # 问题向量只计算一次：Teacher Mode 召回与文档检索共用
+    q_vec = await embedding_service.encode(question)
+    memory_match = GLOBAL_USER_MEMORY.search_memory(file_id, question, threshold=0.62, q_vec=q_vec)
+    if memory_match:
+        # Simplified / Softer Prompt
+        teacher_instruction = (
+            f"\n\n[User Correction / 用户指正]\n"
+            f"Note: The user previously corrected similar concepts: '{memory_match['correction']}'\n"
+            f"Instruction: IF this correction is directly relevant to the current question, use it as the ground truth. "
+            f"Otherwise, ignore it."
+        )
+        logger.info(f"💡 Injecting Teacher Instruction: {teacher_instruction}")
+
+    # 从数据库中获取文件记录
+    file_record = db.query(FileTextStore).filter(FileTextStore.file_id == file_id).first()
+    if not file_record:
+        raise HTTPException(status_code=404, detail="文件未找到，请先上传")
+
+    if not question.strip():
+        raise HTTPException(status_code=400, detail="问题不能为空")
+
+    # [NEW] 防重复提交逻辑
+    import datetime
+    five_seconds_ago = datetime.datetime.now() - datetime.timedelta(seconds=5)
+
+    existing_qa = db.query(QAHistory).filter(
+        QAHistory.file_id == file_id,
+        QAHistory.question == question,
+        QAHistory.created_at >= five_seconds_ago
+    ).order_by(QAHistory.created_at.desc()).first()
+
+    if existing_qa:
+        logger.warning(f"检测到重复请求 (5秒内): File={file_id}, Q={question}")
+        try:
+            evidence_data = json.loads(existing_qa.evidence_list)
+        except:
+            evidence_data = []
+        return {"response": {
+            "qa_id": existing_qa.id,
+            "answer": existing_qa.answer,
+            "evidence": evidence_data,
+            "note": "cached"
+        }}
+
+    lower_q = question.lower()
+    if any(trigger in lower_q for trigger in ["关键字", "关键词", "keyword", "keywords"]):
+        keywords = file_record.keywords_list
+        if keywords:
+            return {"response": {"answer": ", ".join(keywords)}}
+        else:
+            return {"response": {"answer": "文档中未提及此内容。"}}
+
+    # 语义缓存：同一文件（且文件内容/教师规则未变）下的相似问题直接复用之前的回答
+    cache_version = answer_cache.version(file_id)
+    cached = answer_cache.get(file_id, q_vec)
+    if cached:
+        logger.info(f"♻️ [AnswerCache] Hit (sim={cached['similarity']:.3f}): '{question}' ~ '{cached['question']}'")
+        qa_id = save_qa(db, file_id, question, cached["answer"], cached["evidence"])
+        return {"response": {
+            "qa_id": qa_id,
+            "answer": cached["answer"],
+            "evidence": cached["evidence"],
+            "note": "semantic_cache"
+        }}
+
+    # 首次访问时从磁盘加载索引（避免阻塞事件循环）
+    vs = await asyncio.to_thread(VECTOR_STORES.get, file_id)
+    if vs is None:
+        chunks = file_record.chunks_list
+        results = [{"text": c, "metadata": {}, "score": None} for c in chunks[:3]]
+    else:
+        # 余弦相似度低于 RAG_MIN_SIMILARITY 的片段不送给 LLM
+        results = vs.search_by_vector(q_vec, k=3, min_score=RAG_MIN_SIMILARITY)
+
+    logger.info(f"检索到 {len(results)} 个相关片段")
+
+    # [TEACHER MODE INJECTION]
+    return {"results": results, "final_question": question + teacher_instruction,
+            "q_vec": q_vec, "cache_version": cache_version}
+
+
+def evidence_from_results(results: list) -> list:
+    return [
+        {"text": r["text"], "page": r["metadata"].get("page", 1), "score": r["score"]}
+        for r in results
+    ]
+
+
+def cache_answer(file_id: str, question: str, prepared: dict, answer: str, evidence: list):
+    """只缓存正常生成的回答（不缓存超时/出错提示和"未找到相关文档内容"）"""
+    if not prepared["results"] or any(marker in answer for marker in ("生成答案时超时", "生成答案时出错")):
+        return
+    answer_cache.put(file_id, question, prepared["q_vec"], answer, evidence, version=prepared["cache_version"])
+
+
+def save_qa(db, file_id: str, question: str, answer: str, evidence: list) -> str:
+    """持久化保存 Q&A 记录，返回 qa_id（供后续评估更新使用）"""
+    new_qa = QAHistory(
+        id=str(uuid.uuid4()),
+        file_id=file_id,
+        question=question,
+        answer=answer,
+        evidence=json.dumps(evidence, ensure_ascii=False),
+        evaluation=None # 此时尚未评估
+    )
+    db.add(new_qa)
+    db.commit()
+    return new_qa.id
+
+
+@app.get("/ask/cache/metrics")
+async def ask_cache_metrics():
+    """语义答案缓存的命中率、容量与失效统计"""
+    return answer_cache.metrics()
+
+
 @app.get("/ask")
 async def ask_question(
     question: str = Query(..., description="用户提问"),
@@ -1781,89 +2295,18 @@ async def ask_question(
     # 使用数据库会话获取文件信息
     db = SessionLocal()
     try:
-        # [TEACHER MODE POINTER]
-        # Using a higher threshold (0.62) to avoid irrelevant recollections
-        logger.info(f"⚡ [Debug] Checking UserMemory for: '{question}' (File: {file_id})")
-        teacher_instruction = ""  # Default empty string if no match
-        memory_match = GLOBAL_USER_MEMORY.search_memory(file_id, question, threshold=0.62)
-        if memory_match:
-            # Simplified / Softer Prompt
-            teacher_instruction = (
-                f"\n\n[User Correction / 用户指正]\n"
-                f"Note: The user previously corrected similar concepts: '{memory_match['correction']}'\n"
-                f"Instruction: IF this correction is directly relevant to the current question, use it as the ground truth. "
-                f"Otherwise, ignore it."
-            )
-            logger.info(f"💡 Injecting Teacher Instruction: {teacher_instruction}")
+        prepared = await prepare_ask(db, question, file_id)
+        if "response" in prepared:
+            return prepared["response"]
 
-        # 从数据库中获取文件记录
-        file_record = db.query(FileTextStore).filter(FileTextStore.file_id == file_id).first()
-        if not file_record:
-            raise HTTPException(status_code=404, detail="文件未找到，请先上传")
-        
-        if not question.strip():
-            raise HTTPException(status_code=400, detail="问题不能为空")
-        
-        # [NEW] 防重复提交逻辑
-        import datetime
-        five_seconds_ago = datetime.datetime.now() - datetime.timedelta(seconds=5)
-        
-        existing_qa = db.query(QAHistory).filter(
-            QAHistory.file_id == file_id,
-            QAHistory.question == question,
-            QAHistory.created_at >= five_seconds_ago
-        ).order_by(QAHistory.created_at.desc()).first()
-        
-        if existing_qa:
-            logger.warning(f"检测到重复请求 (5秒内): File={file_id}, Q={question}")
-            try:
-                evidence_data = json.loads(existing_qa.evidence_list)
-            except:
-                evidence_data = []
-            return {
-                "qa_id": existing_qa.id,
-                "answer": existing_qa.answer,
-                "evidence": evidence_data,
-                "note": "cached"
-            }
- 
-        lower_q = question.lower()
-        if any(trigger in lower_q for trigger in ["关键字", "关键词", "keyword", "keywords"]):
-            keywords = file_record.keywords_list
-            if keywords:
-                return {"answer": ", ".join(keywords)}
-            else:
-                return {"answer": "文档中未提及此内容。"}
-        
-        vs = VECTOR_STORES.get(file_id)
-        if vs is None:
-            chunks = file_record.chunks_list
-            relevant_chunks = chunks[:3]
-        else:
-            relevant_chunks = vs.search(question, k=3)
-        
-        logger.info(f"检索到 {len(relevant_chunks)} 个相关片段")
-        
-        # [TEACHER MODE INJECTION]
-        final_question = question + teacher_instruction
-        
-        answer = await rag_answer(final_question, relevant_chunks)
-        evidence = [{"text": c, "page": 1} for c in relevant_chunks]
+        results = prepared["results"]
+        answer = await rag_answer(prepared["final_question"], [r["text"] for r in results])
+        evidence = evidence_from_results(results)
+        qa_id = save_qa(db, file_id, question, answer, evidence)
+        cache_answer(file_id, question, prepared, answer, evidence)
 
-        # 持久化保存 Q&A 记录
-        new_qa = QAHistory(
-            id=str(uuid.uuid4()),
-            file_id=file_id,
-            question=question,
-            answer=answer,
-            evidence=json.dumps(evidence, ensure_ascii=False),
-            evaluation=None # 此时尚未评估
-        )
-        db.add(new_qa)
-        db.commit()
-        
         return {
-            "qa_id": new_qa.id, # 返回ID供后续评估更新使用
+            "qa_id": qa_id, # 返回ID供后续评估更新使用
             "answer": answer, 
             "evidence": evidence
         }
@@ -1871,6 +2314,66 @@ async def ask_question(
         db.close()
 
 
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@app.get("/ask/stream")
+async def ask_question_stream(
+    question: str = Query(..., description="用户提问"),
+    file_id: str = Query(..., description="文件ID，来自 /upload 返回")
+):
+    """
+    /ask 的流式版本（Server-Sent Events，可直接用 EventSource 订阅）：
+    - evidence: {"evidence": [...]}，检索完成后立即发送
+    - token: {"delta": "..."}，DashScope 每产出一段文本发送一次
+    - done: 与 /ask 相同的完整结果 {"qa_id", "answer", "evidence"}
+
+    流结束（包括客户端中途断开）时把已生成的文本写入 QAHistory。
+    文件不存在、问题为空等错误在开始推流前以普通 HTTP 错误返回。
+    """
+    db = SessionLocal()
+    try:
+        prepared = await prepare_ask(db, question, file_id)
+    finally:
+        db.close()
+
+    async def events():
+        if "response" in prepared:
+            response = prepared["response"]
+            yield sse_event("token", {"delta": response["answer"]})
+            yield sse_event("done", response)
+            return
+
+        results = prepared["results"]
+        evidence = evidence_from_results(results)
+        yield sse_event("evidence", {"evidence": evidence})
+        parts = []
+        finished = False
+        try:
+            async for delta in rag_answer_stream(prepared["final_question"], [r["text"] for r in results]):
+                parts.append(delta)
+                yield sse_event("token", {"delta": delta})
+            finished = True
+        finally:
+            answer = "".join(parts).strip()
+            qa_id = None
+            if answer:
+                db = SessionLocal()
+                try:
+                    qa_id = save_qa(db, file_id, question, answer, evidence)
+                finally:
+                    db.close()
+            if finished:
+                cache_answer(file_id, question, prepared, answer, evidence)
+            else:
+                logger.warning(f"流式问答被中断（已保存 {len(answer)} 字）: File={file_id}")
+        yield sse_event("done", {"qa_id": qa_id, "answer": answer, "evidence": evidence})
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
 # ======================
 # 视频分析相关API路由
 # ======================
@@ -1943,6 +2446,55 @@ async def video_health_check():
 # ======================
 # PDF助手相关API路由
 # ======================
+# ======================
+# PDF 工具任务
+# ======================
+# 所有 /api/pdf/* 操作都在 pdf_jobs 线程池中执行；请求体带 "background": true 时
+# 立即返回 job_id，可通过 /api/pdf/jobs/{job_id} 轮询或订阅 /ws/{job_id} 获取进度。
+def pdf_job_accepted(job) -> dict:
+    return {"success": True, "message": "任务已提交", "data": {"job_id": job.id, "status": job.status}}
+
+def _pdf_extract_text_job(pdf_path: str, progress=None) -> dict:
+    return {"text": pdf_service.extract_text(pdf_path, progress=progress)}
+
+def _pdf_split_job(pdf_path: str, output_dir: str, split_page, pages_per_file, progress=None) -> dict:
+    result = pdf_service.split_pdf(pdf_path, output_dir, split_page, pages_per_file, progress=progress)
+    # 提取拆分后的文件路径列表
+    return {"split_files": [item['path'] for item in result]}
+
+def _pdf_merge_job(pdf_paths: list, output_path: str, progress=None) -> dict:
+    result = pdf_service.merge_pdfs(pdf_paths, output_path, progress=progress)
+    # 转换结果格式，将output_path改为merged_path以适应前端期望
+    return {
+        "merged_path": result["output_path"],
+        "merged_files": result["merged_files"],
+        "total_pages": result["total_pages"]
+    }
+
+def _pdf_metadata_job(pdf_path: str, progress=None) -> dict:
+    return pdf_service.get_metadata(pdf_path)
+
+@app.get("/api/pdf/jobs")
+async def list_pdf_jobs():
+    """列出最近的PDF任务"""
+    return {"success": True, "data": pdf_jobs.list()}
+
+@app.get("/api/pdf/jobs/{job_id}")
+async def get_pdf_job(job_id: str):
+    """查询PDF任务状态/进度/结果"""
+    job = pdf_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    return {"success": True, "data": job.to_dict()}
+
+@app.post("/api/pdf/jobs/{job_id}/cancel")
+async def cancel_pdf_job(job_id: str):
+    """取消PDF任务：排队中的任务不再执行，运行中的任务在下一页处停止"""
+    job = pdf_jobs.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    return {"success": True, "message": "已请求取消", "data": job.to_dict()}
+
 @app.post("/api/pdf/extract-images")
 async def extract_pdf_images(request: dict = Body(...)):
     file_id = request.get("file_id")
@@ -1961,8 +2513,12 @@ async def extract_pdf_images(request: dict = Body(...)):
                 break
         if not pdf_path:
             raise HTTPException(status_code=404, detail="PDF文件不存在")
-        result = pdf_service.extract_images(pdf_path)
+        if request.get("background"):
+            return pdf_job_accepted(pdf_jobs.submit("extract_images", pdf_service.extract_images, pdf_path))
+        result = await pdf_jobs.run("extract_images", pdf_service.extract_images, pdf_path)
         return {"success": True, "message": "图片提取成功", "data": result}
+    except JobCancelled:
+        raise HTTPException(status_code=409, detail="任务已取消")
     except HTTPException:
         raise
     except Exception as e:
@@ -1988,8 +2544,12 @@ async def compress_pdf_file(request: dict = Body(...)):
         if not pdf_path:
             raise HTTPException(status_code=404, detail="PDF文件不存在")
         output_path = str(DOWNLOAD_DIR / f"{file_id}_compressed.pdf")
-        result = pdf_service.compress_pdf(pdf_path, output_path)
+        if request.get("background"):
+            return pdf_job_accepted(pdf_jobs.submit("compress", pdf_service.compress_pdf, pdf_path, output_path))
+        result = await pdf_jobs.run("compress", pdf_service.compress_pdf, pdf_path, output_path)
         return {"success": True, "message": "PDF压缩成功", "data": result}
+    except JobCancelled:
+        raise HTTPException(status_code=409, detail="任务已取消")
     except HTTPException:
         raise
     except Exception as e:
@@ -2014,8 +2574,12 @@ async def extract_pdf_text(request: dict = Body(...)):
                 break
         if not pdf_path:
             raise HTTPException(status_code=404, detail="PDF文件不存在")
-        result = pdf_service.extract_text(pdf_path)
-        return {"success": True, "message": "文本提取成功", "data": {"text": result}}
+        if request.get("background"):
+            return pdf_job_accepted(pdf_jobs.submit("extract_text", _pdf_extract_text_job, pdf_path))
+        result = await pdf_jobs.run("extract_text", _pdf_extract_text_job, pdf_path)
+        return {"success": True, "message": "文本提取成功", "data": result}
+    except JobCancelled:
+        raise HTTPException(status_code=409, detail="任务已取消")
     except HTTPException:
         raise
     except Exception as e:
@@ -2043,8 +2607,12 @@ async def rotate_pdf_pages(request: dict = Body(...)):
         if not pdf_path:
             raise HTTPException(status_code=404, detail="PDF文件不存在")
         output_path = str(DOWNLOAD_DIR / f"{file_id}_rotated.pdf")
-        result = pdf_service.rotate_pdf(pdf_path, output_path, angle, pages)
+        if request.get("background"):
+            return pdf_job_accepted(pdf_jobs.submit("rotate", pdf_service.rotate_pdf, pdf_path, output_path, angle, pages))
+        result = await pdf_jobs.run("rotate", pdf_service.rotate_pdf, pdf_path, output_path, angle, pages)
         return {"success": True, "message": "PDF页面旋转成功", "data": result}
+    except JobCancelled:
+        raise HTTPException(status_code=409, detail="任务已取消")
     except HTTPException:
         raise
     except Exception as e:
@@ -2072,10 +2640,12 @@ async def split_pdf_file(request: dict = Body(...)):
         if not pdf_path:
             raise HTTPException(status_code=404, detail="PDF文件不存在")
         output_dir = str(DOWNLOAD_DIR / f"{file_id}_split")
-        result = pdf_service.split_pdf(pdf_path, output_dir, split_page, pages_per_file)
-        # 提取拆分后的文件路径列表
-        split_files = [item['path'] for item in result]
-        return {"success": True, "message": "PDF拆分成功", "data": {"split_files": split_files}}
+        if request.get("background"):
+            return pdf_job_accepted(pdf_jobs.submit("split", _pdf_split_job, pdf_path, output_dir, split_page, pages_per_file))
+        result = await pdf_jobs.run("split", _pdf_split_job, pdf_path, output_dir, split_page, pages_per_file)
+        return {"success": True, "message": "PDF拆分成功", "data": result}
+    except JobCancelled:
+        raise HTTPException(status_code=409, detail="任务已取消")
     except HTTPException:
         raise
     except Exception as e:
@@ -2114,14 +2684,12 @@ async def merge_pdf_files(request: dict = Body(...)):
         output_file_id = str(uuid.uuid4())
         output_path = str(DOWNLOAD_DIR / f"{output_file_id}.pdf")
         
-        result = pdf_service.merge_pdfs(pdf_paths, output_path)
-        # 转换结果格式，将output_path改为merged_path以适应前端期望
-        result_with_merged_path = {
-            "merged_path": result["output_path"],
-            "merged_files": result["merged_files"],
-            "total_pages": result["total_pages"]
-        }
+        if request.get("background"):
+            return pdf_job_accepted(pdf_jobs.submit("merge", _pdf_merge_job, pdf_paths, output_path))
+        result_with_merged_path = await pdf_jobs.run("merge", _pdf_merge_job, pdf_paths, output_path)
         return {"success": True, "message": "PDF合并成功", "data": result_with_merged_path}
+    except JobCancelled:
+        raise HTTPException(status_code=409, detail="任务已取消")
     except HTTPException:
         raise
     except Exception as e:
@@ -2145,7 +2713,7 @@ async def get_pdf_metadata(file_id: str):
                 break
         if not pdf_path:
             raise HTTPException(status_code=404, detail="PDF文件不存在")
-        result = pdf_service.get_metadata(pdf_path)
+        result = await pdf_jobs.run("metadata", _pdf_metadata_job, pdf_path)
         return {"success": True, "message": "获取PDF元数据成功", "data": result}
     except HTTPException:
         raise
@@ -2699,10 +3267,3 @@ async def delete_qa_history(qa_id: str, db: Session = Depends(get_db)):
         db.rollback()
         logger.error(f"删除问答记录失败: {str(e)}")
         raise HTTPException(status_code=500, detail=f"删除问答记录失败: {str(e)}")
-
-# ======================
-# 启动入口（用于本地调试）
-# ======================
-if __name__ == "__main__":
-    import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
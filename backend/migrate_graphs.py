@@ -38,25 +38,10 @@ def migrate_historical_graphs():
                 
                 logger.info(f"🔄 Syncing {record.filename}: {len(nodes)} nodes, {len(edges)} edges")
                 
-                # Add Nodes
-                for node in nodes:
-                    node_name = node.get("label") or node.get("id")
-                    if node_name:
-                        service.add_node(
-                            name=node_name,
-                            category=node.get("type", "Concept"),
-                            source_doc_id=record.file_id
-                        )
-                        total_nodes += 1
-                
-                # Add Edges
-                for edge in edges:
-                    service.add_edge(
-                        source_name=edge.get("source"),
-                        target_name=edge.get("target"),
-                        relation=edge.get("relation", "related_to")
-                    )
-                    total_edges += 1
+                # Add Nodes & Edges (one transaction per record)
+                stats = service.merge_subgraph(nodes, edges, doc_id=record.file_id)
+                total_nodes += stats["nodes_created"]
+                total_edges += stats["edges_created"]
                     
             except Exception as e:
                 logger.error(f"❌ Failed to process record {record.id}: {e}")
@@ -65,7 +50,7 @@ def migrate_historical_graphs():
         logger.info("📊 Updating Graph Statistics (PageRank)...")
         service.update_pagerank()
         
-        logger.info(f"✅ Migration Complete! Added {total_nodes} nodes and {total_edges} edges.")
+        logger.info(f"✅ Migration Complete! Created {total_nodes} nodes and {total_edges} edges.")
         
     except Exception as e:
         logger.error(f"❌ Migration failed: {e}")
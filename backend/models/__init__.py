@@ -3,6 +3,10 @@ from sqlalchemy.sql import func
 from database import Base
 import json
 
+# 正文与布局只保存在 FileTextStore / uploads/layout 中，历史结果里不再重复
+HISTORY_HEAVY_KEYS = ("extracted_text", "layout_data")
+SUMMARY_PREVIEW_CHARS = 200
+
 class AnalysisHistory(Base):
     """分析历史记录模型"""
     __tablename__ = "analysis_history"
@@ -12,7 +16,10 @@ class AnalysisHistory(Base):
     filename = Column(String)  # 文件名
     analysis_time = Column(Float)  # 分析时间（时间戳）
     created_at = Column(DateTime(timezone=True), server_default=func.now())  # 记录创建时间
-    result = Column(Text)  # 分析结果（JSON字符串）
+    result = Column(Text)  # 分析结果（JSON字符串，不含正文/布局）
+    # 列表页投影：无需解析 result
+    status = Column(String)  # completed / failed
+    summary_preview = Column(Text)  # 摘要前 SUMMARY_PREVIEW_CHARS 个字符
     
     def get_result_dict(self):
         """将result字段从JSON字符串转换为字典"""
@@ -21,8 +28,13 @@ class AnalysisHistory(Base):
         return {}
     
     def set_result_dict(self, result_dict):
-        """将字典转换为JSON字符串设置到result字段"""
+        """将字典转换为JSON字符串设置到result字段，并同步列表页投影列"""
         self.result = json.dumps(result_dict, ensure_ascii=False)
+        status = result_dict.get("status")
+        if not status and "mindmap" in result_dict:
+            status = "completed"  # 兼容旧数据：没有 status 字段但有 mindmap
+        self.status = status
+        self.summary_preview = (result_dict.get("summary") or "")[:SUMMARY_PREVIEW_CHARS]
     
     # 创建属性，方便使用
     result_dict = property(get_result_dict, set_result_dict)
@@ -36,8 +48,11 @@ class FileTextStore(Base):
     text = Column(Text)  # 提取的文本
     chunks = Column(Text)  # 文本块（JSON字符串）
     keywords = Column(Text)  # 关键词（JSON字符串）
-    layout_data = Column(Text) # [NEW] 布局信息 (JSON字符串: PDF坐标/OCR Box)
-    upload_time = Column(Float)  # 上传时间（时间戳）
+    layout_data = Column(Text) # 旧版布局信息 (JSON字符串)；新数据存放在 uploads/layout/{file_id}.npz
+    upload_time = Column(Float, index=True)  # 上传时间（时间戳）
+    ext = Column(String, index=True)  # 磁盘文件扩展名（uploads/{file_id}.{ext}）；"" 表示文件已不存在
+    size = Column(Integer)  # 文件大小（字节）
+    content_hash = Column(String, index=True)  # 文件内容 SHA-256（十六进制），用于重复上传复用分析结果
     created_at = Column(DateTime(timezone=True), server_default=func.now())  # 记录创建时间
     
     def get_chunks_list(self):
@@ -51,14 +66,10 @@ class FileTextStore(Base):
         self.chunks = json.dumps(chunks_list, ensure_ascii=False)
 
     def get_layout_data_json(self):
-        """获取布局数据"""
+        """获取旧版 JSON 布局；新数据是 uploads/layout/{file_id}.npz，由 services.layout_store 读写"""
         if self.layout_data:
             return json.loads(self.layout_data)
         return None
-
-    def set_layout_data_json(self, data):
-        """设置布局数据"""
-        self.layout_data = json.dumps(data, ensure_ascii=False)
     
     def get_keywords_list(self):
         """将keywords字段从JSON字符串转换为列表"""
@@ -73,7 +84,7 @@ class FileTextStore(Base):
     # 创建属性，方便使用
     chunks_list = property(get_chunks_list, set_chunks_list)
     keywords_list = property(get_keywords_list, set_keywords_list)
-    layout_info = property(get_layout_data_json, set_layout_data_json) # [NEW]
+    layout_info = property(get_layout_data_json) # [NEW] 只读：模型不做文件 I/O
 
 # 导入视频处理相关的模型
 from .document import BilibiliLoader
@@ -0,0 +1,37 @@
+from sqlalchemy import Column, String, Text, Float, Integer
+from database import Base
+
+
+class AnalysisJob(Base):
+    """文件分析任务（持久化队列，重启后自动恢复未完成的任务）"""
+    __tablename__ = "analysis_jobs"
+
+    file_id = Column(String, primary_key=True, index=True)  # 每个文件一条任务，重新提交会复用该行
+    filename = Column(String)  # 原始文件名
+    ext = Column(String)  # 文件扩展名
+    file_path = Column(String)  # 上传文件路径
+    status = Column(String, index=True)  # queued / running / completed / failed
+    stage = Column(String)  # 当前阶段：ocr / embedding / llm
+    attempts = Column(Integer, default=0)  # 已开始执行的次数
+    max_attempts = Column(Integer)  # 最多执行次数（含首次）
+    error = Column(Text)  # 最近一次失败原因
+    next_run_at = Column(Float)  # 重试退避：该时间之前不执行
+    created_at = Column(Float)  # 提交时间（时间戳）
+    started_at = Column(Float)  # 最近一次开始执行时间
+    finished_at = Column(Float)  # 完成/最终失败时间
+    updated_at = Column(Float)
+
+    def to_dict(self):
+        return {
+            "file_id": self.file_id,
+            "filename": self.filename,
+            "status": self.status,
+            "stage": self.stage,
+            "attempts": self.attempts,
+            "max_attempts": self.max_attempts,
+            "error": self.error,
+            "next_run_at": self.next_run_at,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
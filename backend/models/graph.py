@@ -13,7 +13,7 @@ class GlobalNode(Base):
     digest = Column(Text)  # 摘要/定义
     weight = Column(Float, default=1.0)  # 重要性权重 (可由PageRank计算更新)
     
-    # 存储来源文档ID列表 (JSON array)
+    # 旧版来源文档ID列表 (JSON array)：来源已迁移到 node_documents，迁移后置为 "[]"
     document_ids = Column(Text, default="[]") 
     
     created_at = Column(DateTime(timezone=True), server_default=func.now())
@@ -24,9 +24,17 @@ class GlobalEdge(Base):
     __tablename__ = "global_edges"
     
     id = Column(String, primary_key=True, index=True, default=lambda: str(uuid.uuid4()))
-    source_id = Column(String, ForeignKey("global_nodes.id"), nullable=False)
-    target_id = Column(String, ForeignKey("global_nodes.id"), nullable=False)
+    source_id = Column(String, ForeignKey("global_nodes.id"), nullable=False, index=True)
+    target_id = Column(String, ForeignKey("global_nodes.id"), nullable=False, index=True)
     relation = Column(String)  # 关系描述 (例如: "is_a", "invented_by")
     weight = Column(Float, default=1.0)  # 连接强度
     
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class NodeDocument(Base):
+    """节点与来源文档的关联（一个概念可来自多个文档，全部来源被删除时节点随之删除）"""
+    __tablename__ = "node_documents"
+    __table_args__ = {"sqlite_with_rowid": False}
+    
+    node_id = Column(String, ForeignKey("global_nodes.id"), primary_key=True)  # 主键 (node_id, doc_id)：按节点查来源
+    doc_id = Column(String, primary_key=True, index=True)  # 按文档查节点（删除文档/重复上传别名）
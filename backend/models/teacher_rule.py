@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, Float, DateTime, Text
+from sqlalchemy import Column, String, Float, DateTime, Text, LargeBinary
 from database import Base
 import uuid
 from datetime import datetime
@@ -11,3 +11,5 @@ class TeacherRule(Base):
     question = Column(String) # The trigger question/concept
     correction = Column(Text) # The fact/instruction
     created_at = Column(DateTime, default=datetime.now)
+    embedding = Column(LargeBinary) # float32 question embedding (L2-normalized), reused on startup
+    embedding_model = Column(String) # get_embedding_model_id() of the model that produced `embedding`
@@ -1,4 +1,21 @@
-import pdfplumber
+import os
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import pdfplumber
+except ImportError:
+    # main.py 会将 ImportError 转换为友好的安装提示
+    pdfplumber = None
+
+# 页数达到该阈值时启用多进程解析（pdfplumber 纯 Python，线程受 GIL 限制）
+PDF_PARALLEL_PAGE_THRESHOLD = int(os.getenv("PDF_PARALLEL_PAGE_THRESHOLD", "100"))
+PDF_PARALLEL_WORKERS = int(os.getenv("PDF_PARALLEL_WORKERS", "0")) or (os.cpu_count() or 1)
+# 每个子任务解析的连续页数；越小首批结果越早返回，越大每个进程重复打开文件的开销越低
+PDF_PARALLEL_CHUNK_PAGES = int(os.getenv("PDF_PARALLEL_CHUNK_PAGES", "16"))
+# 每个文档同时提交到进程池的页区间上限；结果按页码顺序消费，超前解析完的区间都驻留内存
+PDF_PARALLEL_MAX_INFLIGHT = int(os.getenv("PDF_PARALLEL_MAX_INFLIGHT", "0")) or 2 * PDF_PARALLEL_WORKERS
 
 def extract_text_from_pdf(pdf_path: str) -> str:
     """从 PDF 文件中提取纯文本"""
@@ -13,4 +30,111 @@ def extract_text_from_pdf(pdf_path: str) -> str:
     except Exception as e:
         print(f"PDF 解析出错: {e}")
         return ""
-    return text.strip()
\ No newline at end of file
+    return text.strip()
+
+# ======================
+# 逐页解析（文本 + 坐标）
+# ======================
+def _open(pdf_path: str):
+    if pdfplumber is None:
+        raise ImportError("pdfplumber is not installed")
+    return pdfplumber.open(pdf_path)
+
+def _page_record(page, total: int) -> dict:
+    # words structure: [{x0, top, x1, bottom, text}, ...]
+    return {
+        "page": page.page_number,
+        "total": total,
+        "width": page.width,
+        "height": page.height,
+        "text": page.extract_text() or "",
+        "words": page.extract_words()
+    }
+
+def count_pdf_pages(pdf_path: str) -> int:
+    with _open(pdf_path) as pdf:
+        return len(pdf.pages)
+
+def extract_page_range(pdf_path: str, start: int, end: int) -> list:
+    """解析 [start, end) 页（0 起始），进程池任务入口，必须保持模块级以便 pickle"""
+    records = []
+    with _open(pdf_path) as pdf:
+        total = len(pdf.pages)
+        for page in pdf.pages[start:end]:
+            records.append(_page_record(page, total))
+            page.flush_cache()
+    return records
+
+_pool = None
+
+def _get_pool() -> ProcessPoolExecutor:
+    """
+    进程池常驻复用；使用 spawn，避免在已有线程（uvicorn/FAISS）的进程里 fork。
+    spawn 子进程会重新导入 __main__：服务须从无副作用的入口启动（uvicorn main:app 或 python run.py）
+    """
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(
+            max_workers=PDF_PARALLEL_WORKERS,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+    return _pool
+
+def shutdown_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+def iter_pdf_pages_parallel(pdf_path: str, total: int, chunk_pages: int = PDF_PARALLEL_CHUNK_PAGES,
+                            max_inflight: int = PDF_PARALLEL_MAX_INFLIGHT):
+    """按页区间分发到进程池（最多 max_inflight 个区间在途），并按页码顺序逐页产出"""
+    pool = _get_pool()
+    starts = iter(range(0, total, chunk_pages))
+    inflight = deque()
+
+    def submit_next():
+        start = next(starts, None)
+        if start is not None:
+            inflight.append(pool.submit(extract_page_range, pdf_path, start, min(start + chunk_pages, total)))
+
+    try:
+        for _ in range(max(1, max_inflight)):
+            submit_next()
+        while inflight:
+            records = inflight.popleft().result()
+            # 先补交下一个区间，进程在消费方处理本区间时继续解析
+            submit_next()
+            yield from records
+    finally:
+        # 消费方提前退出（出错/取消）时不再解析剩余页
+        for future in inflight:
+            future.cancel()
+
+def iter_pdf_pages(pdf_path: str, parallel: bool = None):
+    """
+    逐页解析PDF（生成器），每解析完一页立即产出:
+    {"page", "total", "width", "height", "text", "words"}
+    parallel=None 时按 PDF_PARALLEL_PAGE_THRESHOLD 自动选择多进程模式。
+    """
+    total = count_pdf_pages(pdf_path)
+    if parallel is None:
+        parallel = PDF_PARALLEL_WORKERS > 1 and total >= PDF_PARALLEL_PAGE_THRESHOLD
+    if parallel:
+        yield from iter_pdf_pages_parallel(pdf_path, total)
+        return
+    with _open(pdf_path) as pdf:
+        for page in pdf.pages:
+            yield _page_record(page, total)
+            # 释放已处理页面的缓存对象，避免大文档内存持续增长
+            page.flush_cache()
+
+def extract_pdf_layout(pdf_path: str, parallel: bool = None) -> dict:
+    """解析PDF，返回 {text, layout}（页码顺序）"""
+    texts = []
+    layout_data = [] # [{"page": 1, "words": [...]}]
+    for p in iter_pdf_pages(pdf_path, parallel=parallel):
+        if p["text"]:
+            texts.append(p["text"])
+        layout_data.append({"page": p["page"], "width": p["width"], "height": p["height"], "words": p["words"]})
+    return {"text": "\n".join(texts).strip(), "layout": layout_data}
@@ -8,7 +8,7 @@ sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 from database import SessionLocal
 from models import FileTextStore, AnalysisHistory
 from models.qa_history import QAHistory
-from models.graph import GlobalNode, GlobalEdge
+from models.graph import GlobalNode, GlobalEdge, NodeDocument
 from models.teacher_rule import TeacherRule
 
 def reset_system():
@@ -24,6 +24,9 @@ def reset_system():
         db.query(GlobalEdge).delete()
         print("   - GlobalEdge cleared")
         
+        db.query(NodeDocument).delete()
+        print("   - NodeDocument cleared")
+        
         db.query(GlobalNode).delete()
         print("   - GlobalNode cleared")
         
@@ -1,12 +1,13 @@
 from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.orm import Session
 from database import get_db
-from services.graph_service import GraphService
+from services.graph_service import GraphService, graph_cache
 from pydantic import BaseModel
 from typing import List, Optional
 from services.llm import simple_llm
 import re
 import json
+import asyncio
 
 router = APIRouter(prefix="/api/graph", tags=["Knowledge Graph"])
 
@@ -16,6 +17,7 @@ class PathQuery(BaseModel):
 
 class QAQuery(BaseModel):
     question: str
+    file_ids: Optional[List[str]] = None  # Restrict document retrieval to these files
 
 @router.get("/data")
 def get_graph_data(db: Session = Depends(get_db)):
@@ -25,11 +27,17 @@ def get_graph_data(db: Session = Depends(get_db)):
 
 @router.post("/build")
 def rebuild_graph_stats(db: Session = Depends(get_db)):
-    """重新计算PageRank等图指标"""
+    """从数据库重新加载图谱并重新计算PageRank等图指标"""
     service = GraphService(db)
+    service.build_networkx_graph()
     service.update_pagerank()
     return {"status": "success", "message": "Graph stats updated"}
 
+@router.get("/cache/metrics")
+def graph_cache_metrics():
+    """内存图谱缓存状态（版本号、节点/边数、加载与增量次数）"""
+    return graph_cache.metrics()
+
 @router.post("/path")
 def find_knowledge_path(query: PathQuery, db: Session = Depends(get_db)):
     """寻找两个概念之间的逻辑路径"""
@@ -46,25 +54,23 @@ async def graph_rag_qa(query: QAQuery, db: Session = Depends(get_db)):
     """基于图谱的深度问答 (GraphRAG) + 全局文本检索 (Global Vector)"""
     service = GraphService(db)
     
-    # 0. Global Vector Search (Retrieval across ALL loaded files)
-    from services.vector_service import VECTOR_STORES
+    # 0. Global Vector Search (Retrieval across ALL files)
+    from services.vector_service import VECTOR_STORES, RAG_MIN_SIMILARITY
+    from services.embedding_service import embedding_service
     vector_context_chunks = []
     
-    # Simple iteration: Search top 2 chunks from EACH file
-    # Optimize: In production, use a single global index or parallel search.
-    for file_id, vs in VECTOR_STORES.items():
-        results = vs.search(query.question, k=2)
-        if results:
-            # Result from vs.search is now a dict: {'text':..., 'metadata':..., 'score':...}
-            for res in results:
-                # Format: [Source: filename] content...
-                meta = res.get("metadata", {})
-                filename = meta.get("filename", "Unknown File")
-                text = res.get("text", "")
-                vector_context_chunks.append(f"[Source: {filename}]\n{text}")
-    
+    # Embed the question once, then query the corpus-wide HNSW index
+    # (optionally restricted to query.file_ids)
+    query_vec = await embedding_service.encode(query.question)
     # Limit total context size to avoid LLM context overflow (approx 20 chunks)
-    vector_context_chunks = vector_context_chunks[:20]
+    results = await asyncio.to_thread(VECTOR_STORES.search_corpus, query_vec, 20, query.file_ids, RAG_MIN_SIMILARITY)
+    for res in results:
+        # Format: [Source: filename] content...
+        meta = res.get("metadata", {})
+        filename = meta.get("filename", "Unknown File")
+        text = res.get("text", "")
+        vector_context_chunks.append(f"[Source: {filename}]\n{text}")
+    
     vector_context_str = "\n---\n".join(vector_context_chunks) if vector_context_chunks else "No relevant document text found."
 
     # 1. Entity Extraction (LLM)
@@ -0,0 +1,9 @@
+"""
+启动入口（用于本地调试）：python run.py，等价于 uvicorn main:app --host 0.0.0.0 --port 8000
+
+入口模块保持无副作用：PDF 解析进程池使用 spawn，每个子进程都会重新导入 __main__。
+"""
+import uvicorn
+
+if __name__ == "__main__":
+    uvicorn.run("main:app", host="0.0.0.0", port=8000)
@@ -0,0 +1,331 @@
+import os
+import time
+import asyncio
+import logging
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from database import SessionLocal
+from models.analysis_job import AnalysisJob
+from utils.concurrency import parse_concurrency
+
+logger = logging.getLogger(__name__)
+
+# ======================
+# Configuration
+# ======================
+# Whole-document pipelines running at once (each one holds a worker until it finishes)
+ANALYSIS_WORKERS = int(os.getenv("ANALYSIS_WORKERS", "2"))
+# Per-stage limits inside those pipelines, e.g. "ocr=1,embedding=1,llm=2"
+ANALYSIS_STAGE_CONCURRENCY = os.getenv("ANALYSIS_STAGE_CONCURRENCY", "ocr=1,embedding=1,llm=2")
+ANALYSIS_DEFAULT_STAGE_CONCURRENCY = int(os.getenv("ANALYSIS_DEFAULT_STAGE_CONCURRENCY", "2"))
+# Retries: attempt n waits ANALYSIS_RETRY_BASE_SECONDS * 2^(n-1), capped
+ANALYSIS_MAX_ATTEMPTS = int(os.getenv("ANALYSIS_MAX_ATTEMPTS", "3"))
+ANALYSIS_RETRY_BASE_SECONDS = float(os.getenv("ANALYSIS_RETRY_BASE_SECONDS", "5"))
+ANALYSIS_RETRY_MAX_SECONDS = float(os.getenv("ANALYSIS_RETRY_MAX_SECONDS", "300"))
+
+ACTIVE_STATUSES = ("queued", "running")
+
+
+class StageStats:
+    """Concurrency and latency counters for one pipeline stage"""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.semaphore = asyncio.Semaphore(limit)
+        self.active = 0
+        self.waiting = 0
+        self.count = 0
+        self.failures = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.recent = deque(maxlen=200)
+
+    def record(self, seconds: float, ok: bool):
+        self.count += 1
+        if not ok:
+            self.failures += 1
+        self.total_seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+        self.recent.append(seconds)
+
+    def to_dict(self) -> dict:
+        recent = sorted(self.recent)
+        p95 = recent[min(len(recent) - 1, int(len(recent) * 0.95))] if recent else 0.0
+        return {
+            "limit": self.limit,
+            "active": self.active,
+            "waiting": self.waiting,
+            "count": self.count,
+            "failures": self.failures,
+            "avg_ms": round(1000 * self.total_seconds / self.count, 1) if self.count else 0.0,
+            "p95_ms": round(1000 * p95, 1),
+            "max_ms": round(1000 * self.max_seconds, 1),
+        }
+
+
+class AnalysisScheduler:
+    """
+    Persistent queue for document analysis (replaces FastAPI BackgroundTasks).
+
+    - Jobs live in the analysis_jobs table; queued/running jobs are re-queued on
+      startup, so a restart does not lose uploads.
+    - ANALYSIS_WORKERS pipelines run at once; inside them, stage() limits how many
+      OCR / embedding / LLM steps run concurrently and records their latency.
+    - Failed attempts are retried with exponential backoff up to ANALYSIS_MAX_ATTEMPTS.
+      The handler can call will_retry() to decide whether to report a final failure.
+    """
+
+    def __init__(self,
+                 handler: Callable[[Dict[str, Any]], Awaitable[Any]],
+                 workers: int = ANALYSIS_WORKERS,
+                 stage_concurrency: str = ANALYSIS_STAGE_CONCURRENCY,
+                 max_attempts: int = ANALYSIS_MAX_ATTEMPTS,
+                 is_retryable: Optional[Callable[[BaseException], bool]] = None,
+                 session_factory=SessionLocal):
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.max_attempts = max(1, max_attempts)
+        self.is_retryable = is_retryable or (lambda exc: True)
+        self._session_factory = session_factory
+        self._stage_limits = parse_concurrency(stage_concurrency, "ANALYSIS_STAGE_CONCURRENCY")
+        self._stages: Dict[str, StageStats] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._delayed: Dict[str, asyncio.TimerHandle] = {}
+        self._running: Dict[str, Dict[str, Any]] = {}
+        self._tasks = []
+        self._completed = 0
+        self._failed = 0
+        self._retried = 0
+
+    # ---------- lifecycle ----------
+    async def start(self):
+        """Spawn the workers and re-queue jobs left over from the previous run"""
+        if self._queue is not None:
+            return
+        self._queue = asyncio.Queue()
+        resumed = await asyncio.to_thread(self._load_pending)
+        now = time.time()
+        for file_id, next_run_at in resumed:
+            self._enqueue(file_id, delay=max(0.0, (next_run_at or 0) - now))
+        if resumed:
+            logger.info(f"♻️ [Scheduler] Resumed {len(resumed)} unfinished analysis jobs")
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+
+    async def stop(self):
+        for handle in self._delayed.values():
+            handle.cancel()
+        self._delayed.clear()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        # Interrupted jobs stay "running" in the table and are resumed on the next start
+
+    # ---------- persistence ----------
+    def _load_pending(self):
+        db = self._session_factory()
+        try:
+            jobs = db.query(AnalysisJob).filter(AnalysisJob.status.in_(ACTIVE_STATUSES)) \
+                .order_by(AnalysisJob.created_at).all()
+            for job in jobs:
+                job.status = "queued"
+                job.updated_at = time.time()
+            db.commit()
+            return [(job.file_id, job.next_run_at) for job in jobs]
+        finally:
+            db.close()
+
+    def _save_submit(self, file_id: str, filename: str, ext: str, file_path: str) -> dict:
+        db = self._session_factory()
+        try:
+            now = time.time()
+            job = db.query(AnalysisJob).filter(AnalysisJob.file_id == file_id).first()
+            if job is None:
+                job = AnalysisJob(file_id=file_id)
+                db.add(job)
+            job.filename = filename
+            job.ext = ext
+            job.file_path = file_path
+            job.status = "queued"
+            job.stage = None
+            job.attempts = 0
+            job.max_attempts = self.max_attempts
+            job.error = None
+            job.next_run_at = None
+            job.created_at = now
+            job.started_at = None
+            job.finished_at = None
+            job.updated_at = now
+            db.commit()
+            return job.to_dict()
+        finally:
+            db.close()
+
+    def _claim(self, file_id: str) -> Optional[dict]:
+        """queued -> running (attempts + 1); returns the job fields, or None if nothing to run"""
+        db = self._session_factory()
+        try:
+            job = db.query(AnalysisJob).filter(AnalysisJob.file_id == file_id).first()
+            if job is None or job.status != "queued":
+                return None
+            now = time.time()
+            job.status = "running"
+            job.attempts = (job.attempts or 0) + 1
+            job.started_at = now
+            job.updated_at = now
+            db.commit()
+            return {**job.to_dict(), "ext": job.ext, "file_path": job.file_path}
+        finally:
+            db.close()
+
+    def _update(self, file_id: str, **fields):
+        db = self._session_factory()
+        try:
+            fields["updated_at"] = time.time()
+            db.query(AnalysisJob).filter(AnalysisJob.file_id == file_id).update(fields, synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+
+    def _read(self, file_id: str) -> Optional[dict]:
+        db = self._session_factory()
+        try:
+            job = db.query(AnalysisJob).filter(AnalysisJob.file_id == file_id).first()
+            return job.to_dict() if job else None
+        finally:
+            db.close()
+
+    def _count_by_status(self) -> Dict[str, int]:
+        from sqlalchemy import func
+        db = self._session_factory()
+        try:
+            rows = db.query(AnalysisJob.status, func.count(AnalysisJob.file_id)).group_by(AnalysisJob.status).all()
+            return {status: count for status, count in rows}
+        finally:
+            db.close()
+
+    # ---------- queue ----------
+    def _enqueue(self, file_id: str, delay: float = 0.0):
+        if delay <= 0:
+            self._queue.put_nowait(file_id)
+            return
+
+        def release():
+            self._delayed.pop(file_id, None)
+            self._queue.put_nowait(file_id)
+
+        self._delayed[file_id] = asyncio.get_running_loop().call_later(delay, release)
+
+    async def submit(self, file_id: str, filename: str, ext: str, file_path: str) -> dict:
+        """Persist a job and queue it; returns the job fields"""
+        job = await asyncio.to_thread(self._save_submit, file_id, filename, ext, str(file_path))
+        self._enqueue(file_id)
+        return job
+
+    def backoff(self, attempt: int) -> float:
+        return min(ANALYSIS_RETRY_MAX_SECONDS, ANALYSIS_RETRY_BASE_SECONDS * (2 ** (attempt - 1)))
+
+    def will_retry(self, file_id: str, exc: BaseException) -> bool:
+        """True if the current attempt of file_id will be retried after exc"""
+        job = self._running.get(file_id)
+        if job is None:
+            return False
+        return job["attempts"] < job["max_attempts"] and self.is_retryable(exc)
+
+    async def _worker(self, n: int):
+        while True:
+            file_id = await self._queue.get()
+            try:
+                job = await asyncio.to_thread(self._claim, file_id)
+                if job is None:
+                    continue
+                self._running[file_id] = job
+                try:
+                    await self.handler(job)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    await self._on_failure(job, e)
+                else:
+                    self._completed += 1
+                    await asyncio.to_thread(self._update, file_id, status="completed", stage=None, next_run_at=None,
+                                            error=None, finished_at=time.time())
+                finally:
+                    self._running.pop(file_id, None)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ [Scheduler] worker {n} error on {file_id}: {e}", exc_info=True)
+            finally:
+                self._queue.task_done()
+
+    async def _on_failure(self, job: dict, exc: Exception):
+        file_id = job["file_id"]
+        if self.will_retry(file_id, exc):
+            delay = self.backoff(job["attempts"])
+            self._retried += 1
+            logger.warning(f"🔁 [Scheduler] {file_id} attempt {job['attempts']}/{job['max_attempts']} failed, "
+                           f"retrying in {delay:.1f}s: {exc}")
+            await asyncio.to_thread(self._update, file_id, status="queued", error=str(exc),
+                                    next_run_at=time.time() + delay)
+            self._enqueue(file_id, delay=delay)
+        else:
+            self._failed += 1
+            logger.error(f"❌ [Scheduler] {file_id} failed after {job['attempts']} attempt(s): {exc}")
+            await asyncio.to_thread(self._update, file_id, status="failed", error=str(exc),
+                                    finished_at=time.time())
+
+    # ---------- stages ----------
+    def _stage(self, name: str) -> StageStats:
+        stats = self._stages.get(name)
+        if stats is None:
+            limit = self._stage_limits.get(name, ANALYSIS_DEFAULT_STAGE_CONCURRENCY)
+            stats = self._stages[name] = StageStats(limit)
+        return stats
+
+    @asynccontextmanager
+    async def stage(self, name: str, file_id: Optional[str] = None):
+        """Run a pipeline step under the stage's concurrency limit and time it"""
+        stats = self._stage(name)
+        stats.waiting += 1
+        try:
+            await stats.semaphore.acquire()
+        finally:
+            stats.waiting -= 1
+        stats.active += 1
+        t0 = None
+        ok = False
+        try:
+            # Everything after acquire (including the DB update, which can fail or be cancelled) releases the slot
+            if file_id in self._running:
+                self._running[file_id]["stage"] = name
+                await asyncio.to_thread(self._update, file_id, stage=name)
+            t0 = time.perf_counter()
+            yield
+            ok = True
+        finally:
+            if t0 is not None:
+                stats.record(time.perf_counter() - t0, ok)
+            stats.active -= 1
+            stats.semaphore.release()
+
+    # ---------- queries ----------
+    async def get(self, file_id: str) -> Optional[dict]:
+        return await asyncio.to_thread(self._read, file_id)
+
+    async def metrics(self) -> dict:
+        by_status = await asyncio.to_thread(self._count_by_status)
+        return {
+            "workers": self.workers,
+            "queue_depth": (self._queue.qsize() if self._queue is not None else 0) + len(self._delayed),
+            "waiting_retry": len(self._delayed),
+            "running": [{"file_id": fid, "stage": job.get("stage"), "attempts": job["attempts"]}
+                        for fid, job in self._running.items()],
+            "jobs_by_status": by_status,
+            "completed": self._completed,
+            "failed": self._failed,
+            "retried": self._retried,
+            "stages": {name: stats.to_dict() for name, stats in self._stages.items()},
+        }
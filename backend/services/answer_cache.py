@@ -0,0 +1,176 @@
+import os
+import time
+import uuid
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# ======================
+# Configuration
+# ======================
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "1").lower() in ("1", "true", "yes")
+# Cosine similarity between question embeddings needed to reuse an answer
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "86400"))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "2000"))
+ANSWER_CACHE_MAX_PER_FILE = int(os.getenv("ANSWER_CACHE_MAX_PER_FILE", "200"))
+
+
+class SemanticAnswerCache:
+    """
+    Reuse /ask answers for near-identical questions about the same file.
+
+    - Entries are keyed on (file_id, file version) and matched by cosine similarity
+      of the question embedding (>= threshold), so rephrasings hit as well.
+    - The per-file version is bumped by invalidate(): when the file is re-analysed or
+      deleted, or its TeacherRule set changes. Older entries are dropped, and answers
+      computed against an old version are not stored (put() checks the version).
+    - invalidate_all() bumps a global generation that is part of every file's version
+      (e.g. once the TeacherRule memory has been restored at startup).
+    - Bounded by TTL, a global LRU limit and a per-file limit.
+    """
+
+    def __init__(self,
+                 threshold: float = ANSWER_CACHE_THRESHOLD,
+                 ttl: float = ANSWER_CACHE_TTL,
+                 max_entries: int = ANSWER_CACHE_MAX_ENTRIES,
+                 max_per_file: int = ANSWER_CACHE_MAX_PER_FILE,
+                 enabled: bool = ANSWER_CACHE_ENABLED):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max(1, max_entries)
+        self.max_per_file = max(1, max_per_file)
+        self.enabled = enabled
+        # entry id -> entry, least recently used first
+        self._entries: "OrderedDict[str, dict]" = OrderedDict()
+        # file_id -> entry ids (insertion order)
+        self._by_file: Dict[str, Dict[str, None]] = {}
+        self._versions: Dict[str, int] = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "stores": 0, "stale_stores": 0,
+                      "expired": 0, "evicted": 0, "invalidations": {}}
+
+    def version(self, file_id: str) -> int:
+        # Both counters only grow, so the sum changes whenever either one does
+        return self._generation + self._versions.get(file_id, 0)
+
+    # ---------- internals (caller holds the lock) ----------
+    def _remove(self, entry_id: str):
+        entry = self._entries.pop(entry_id, None)
+        if entry is None:
+            return
+        ids = self._by_file.get(entry["file_id"])
+        if ids is not None:
+            ids.pop(entry_id, None)
+            if not ids:
+                del self._by_file[entry["file_id"]]
+
+    def _purge_expired(self, file_id: str, now: float):
+        for entry_id in list(self._by_file.get(file_id, ())):
+            if now - self._entries[entry_id]["created_at"] > self.ttl:
+                self._remove(entry_id)
+                self.stats["expired"] += 1
+
+    # ---------- public ----------
+    def get(self, file_id: str, q_vec: Optional[np.ndarray]) -> Optional[dict]:
+        """Best cached answer for a question embedding, or None"""
+        if not self.enabled or q_vec is None:
+            return None
+        with self._lock:
+            self._purge_expired(file_id, time.time())
+            ids = list(self._by_file.get(file_id, ()))
+            if not ids:
+                self.stats["misses"] += 1
+                return None
+            matrix = np.vstack([self._entries[i]["vector"] for i in ids])
+            sims = matrix @ np.asarray(q_vec, dtype="float32")
+            best = int(np.argmax(sims))
+            if sims[best] < self.threshold:
+                self.stats["misses"] += 1
+                return None
+            entry = self._entries[ids[best]]
+            self._entries.move_to_end(ids[best])
+            entry["hits"] += 1
+            self.stats["hits"] += 1
+            return {**entry, "similarity": float(sims[best])}
+
+    def put(self, file_id: str, question: str, q_vec: Optional[np.ndarray], answer: str,
+            evidence: list, version: int):
+        """Store an answer computed while the file was at `version`"""
+        if not self.enabled or q_vec is None:
+            return
+        with self._lock:
+            if version != self.version(file_id):
+                # File or rules changed while the answer was being generated
+                self.stats["stale_stores"] += 1
+                return
+            vector = np.asarray(q_vec, dtype="float32")
+            norm = np.linalg.norm(vector)
+            if norm > 0:
+                vector = vector / norm
+            entry_id = str(uuid.uuid4())
+            self._entries[entry_id] = {
+                "id": entry_id,
+                "file_id": file_id,
+                "question": question,
+                "vector": vector,
+                "answer": answer,
+                "evidence": evidence,
+                "created_at": time.time(),
+                "hits": 0,
+            }
+            ids = self._by_file.setdefault(file_id, {})
+            ids[entry_id] = None
+            self.stats["stores"] += 1
+            while len(ids) > self.max_per_file:
+                self._remove(next(iter(ids)))
+                self.stats["evicted"] += 1
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.stats["evicted"] += 1
+
+    def invalidate(self, file_id: str, reason: str = "file"):
+        """Drop every answer for file_id and bump its version (reason: file / rules)"""
+        with self._lock:
+            self._versions[file_id] = self._versions.get(file_id, 0) + 1
+            dropped = list(self._by_file.get(file_id, ()))
+            for entry_id in dropped:
+                self._remove(entry_id)
+            self.stats["invalidations"][reason] = self.stats["invalidations"].get(reason, 0) + 1
+        if dropped:
+            logger.info(f"🧹 [AnswerCache] Dropped {len(dropped)} cached answers for {file_id} ({reason} changed)")
+
+    def invalidate_all(self, reason: str = "rules"):
+        """Drop every cached answer and bump the version of every file"""
+        with self._lock:
+            self._generation += 1
+            dropped = len(self._entries)
+            self._entries.clear()
+            self._by_file.clear()
+            self.stats["invalidations"][reason] = self.stats["invalidations"].get(reason, 0) + 1
+        if dropped:
+            logger.info(f"🧹 [AnswerCache] Dropped all {dropped} cached answers ({reason} changed)")
+
+    def metrics(self) -> dict:
+        with self._lock:
+            lookups = self.stats["hits"] + self.stats["misses"]
+            return {
+                "enabled": self.enabled,
+                "entries": len(self._entries),
+                "files": len(self._by_file),
+                "threshold": self.threshold,
+                "ttl_seconds": self.ttl,
+                "max_entries": self.max_entries,
+                "max_per_file": self.max_per_file,
+                "hit_rate": round(self.stats["hits"] / lookups, 4) if lookups else 0.0,
+                **{k: (dict(v) if isinstance(v, dict) else v) for k, v in self.stats.items()},
+            }
+
+
+answer_cache = SemanticAnswerCache()
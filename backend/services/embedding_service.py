@@ -0,0 +1,252 @@
+import os
+import asyncio
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+# This file is in backend/services/embedding_service.py, project root is ../../
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+logger = logging.getLogger(__name__)
+
+try:
+    from sentence_transformers import SentenceTransformer
+except ImportError:
+    # Silent fail or log, main.py will handle the error if missing
+    logger.warning("RAG dependency not found (sentence-transformers)")
+    SentenceTransformer = None
+
+# Micro-batching window: concurrent encode() calls within this window share one model call
+EMBED_BATCH_WINDOW_MS = float(os.getenv("EMBED_BATCH_WINDOW_MS", "5"))
+EMBED_MAX_BATCH = int(os.getenv("EMBED_MAX_BATCH", "32"))
+EMBED_CACHE_SIZE = int(os.getenv("EMBED_CACHE_SIZE", "4096"))
+EMBED_WORKERS = int(os.getenv("EMBED_WORKERS", "1"))
+# A failed model load is retried after this many seconds, doubling up to EMBED_MODEL_RETRY_MAX
+EMBED_MODEL_RETRY_SECONDS = float(os.getenv("EMBED_MODEL_RETRY_SECONDS", "30"))
+EMBED_MODEL_RETRY_MAX = float(os.getenv("EMBED_MODEL_RETRY_MAX", "600"))
+
+# ======================
+# Shared Model
+# ======================
+_model = None
+_model_path = None
+_model_failures = 0
+_model_retry_at = 0.0  # time.monotonic() before which a failed load is not retried
+_model_lock = threading.Lock()
+
+def get_embedding_model():
+    """
+    Load (once) and return the shared SentenceTransformer, or None if unavailable.
+    A failed load is retried with exponential backoff instead of disabling embeddings for good.
+    """
+    global _model, _model_path, _model_failures, _model_retry_at
+    local_model_path = os.path.join(PROJECT_ROOT, "models/bge-small-zh")
+    if _model is not None and _model_path == local_model_path:
+        return _model
+    if time.monotonic() < _model_retry_at:
+        return None
+    with _model_lock:
+        if _model is None or _model_path != local_model_path:
+            if time.monotonic() < _model_retry_at:
+                return None
+            try:
+                if SentenceTransformer is None:
+                    raise ImportError("Missing dependencies")
+                _model = SentenceTransformer(local_model_path)
+                _model_path = local_model_path
+                _model_failures = 0
+                logger.info(f"✅ Vector model loaded: {local_model_path}")
+            except Exception as e:
+                # Logged once per attempt; callers treat None as "embedding unavailable"
+                delay = min(EMBED_MODEL_RETRY_SECONDS * 2 ** _model_failures, EMBED_MODEL_RETRY_MAX)
+                _model_failures += 1
+                _model_retry_at = time.monotonic() + delay
+                logger.error(f"❌ Vector model load failed (retry in {delay:.0f}s): {str(e)}")
+                return None
+    return _model
+
+def loaded_embedding_model():
+    """The shared model if it is already loaded, else None. Never loads, so it is safe on the event loop"""
+    return _model
+
+def get_embedding_model_id() -> Optional[str]:
+    """Identifier stored next to persisted vectors, so a swapped model is detected on load"""
+    model = get_embedding_model()
+    if model is None:
+        return None
+    return f"{os.path.basename(_model_path)}:{model.get_sentence_embedding_dimension()}"
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    """L2-normalize each row so inner product == cosine similarity"""
+    vectors = np.asarray(vectors, dtype="float32")
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+# ======================
+# Embedding Service
+# ======================
+class EmbeddingService:
+    """
+    Query embedding front-end shared by VectorStore and UserMemory.
+
+    - encode() is awaitable: requests arriving within EMBED_BATCH_WINDOW_MS are
+      merged into one model.encode() call, executed on a worker thread so the
+      event loop (and WebSocket progress messages) never blocks on the model.
+      Loading the model (preload() at startup, or a retry after a failed load)
+      runs on the same worker thread.
+    - Results are L2-normalized and kept in an LRU cache keyed by the SHA-1 of the text.
+    - encode_sync() serves code that already runs in a worker thread.
+    """
+
+    def __init__(self,
+                 batch_window_ms: float = EMBED_BATCH_WINDOW_MS,
+                 max_batch: int = EMBED_MAX_BATCH,
+                 cache_size: int = EMBED_CACHE_SIZE,
+                 workers: int = EMBED_WORKERS):
+        self.batch_window = batch_window_ms / 1000.0
+        self.max_batch = max_batch
+        self.cache_size = cache_size
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="embedding")
+        self._cache: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+        # key -> (text, future); several callers asking for the same text share one future
+        self._pending: Dict[str, Tuple[str, asyncio.Future]] = {}
+        self._flush_timer = None
+        self._tasks = set()
+        self.stats = {"hits": 0, "misses": 0, "batches": 0, "encoded": 0}
+
+    @property
+    def model(self):
+        return get_embedding_model()
+
+    @property
+    def available(self) -> bool:
+        return self.model is not None
+
+    async def load(self):
+        """Load the model on the embedding worker thread; returns it, or None if unavailable"""
+        return await asyncio.get_running_loop().run_in_executor(self._executor, get_embedding_model)
+
+    def preload(self):
+        """Start loading the model in the background (called from the running loop at startup)"""
+        task = asyncio.get_running_loop().create_task(self.load())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    @staticmethod
+    def _key(text: str) -> str:
+        return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+    def _cache_get(self, key: str) -> Optional[np.ndarray]:
+        with self._cache_lock:
+            vec = self._cache.get(key)
+            if vec is not None:
+                self._cache.move_to_end(key)
+            return vec
+
+    def _cache_put(self, key: str, vec: np.ndarray):
+        vec.flags.writeable = False  # cached arrays are shared between callers
+        with self._cache_lock:
+            self._cache[key] = vec
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _encode_batch(self, texts: List[str]) -> np.ndarray:
+        model = self.model
+        if model is None:
+            raise RuntimeError("Embedding model not loaded")
+        vectors = model.encode(texts, convert_to_numpy=True)
+        self.stats["batches"] += 1
+        self.stats["encoded"] += len(texts)
+        # Unit vectors: every consumer scores with inner product / cosine
+        return normalize_rows(vectors)
+
+    def encode_sync(self, texts: List[str]) -> Optional[np.ndarray]:
+        """Blocking, cached encode for worker threads. Returns shape (len(texts), dim)."""
+        if not texts or self.model is None:
+            return None
+        keys = [self._key(t) for t in texts]
+        found = {k: self._cache_get(k) for k in keys}
+        missing = [(k, t) for k, t in zip(keys, texts) if found[k] is None]
+        self.stats["hits"] += len(texts) - len(missing)
+        self.stats["misses"] += len(missing)
+        if missing:
+            unique = dict(missing)
+            vectors = self._encode_batch(list(unique.values()))
+            for k, vec in zip(unique.keys(), vectors):
+                vec = np.array(vec)
+                self._cache_put(k, vec)
+                found[k] = vec
+        return np.vstack([found[k] for k in keys])
+
+    async def encode(self, text: str) -> Optional[np.ndarray]:
+        """Encode one text off the event loop with micro-batching. Returns shape (dim,)."""
+        if loaded_embedding_model() is None and await self.load() is None:
+            return None
+        key = self._key(text)
+        vec = self._cache_get(key)
+        if vec is not None:
+            self.stats["hits"] += 1
+            return vec
+        self.stats["misses"] += 1
+
+        loop = asyncio.get_running_loop()
+        if key in self._pending:
+            return await asyncio.shield(self._pending[key][1])
+        future = loop.create_future()
+        self._pending[key] = (text, future)
+
+        if len(self._pending) >= self.max_batch:
+            self._start_flush()
+        elif self._flush_timer is None:
+            self._flush_timer = loop.call_later(self.batch_window, self._start_flush)
+        return await asyncio.shield(future)
+
+    def _start_flush(self):
+        if self._flush_timer is not None:
+            self._flush_timer.cancel()
+            self._flush_timer = None
+        batch, self._pending = self._pending, {}
+        if batch:
+            task = asyncio.get_running_loop().create_task(self._flush(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _flush(self, batch: Dict[str, Tuple[str, asyncio.Future]]):
+        keys = list(batch.keys())
+        texts = [batch[k][0] for k in keys]
+        loop = asyncio.get_running_loop()
+        try:
+            vectors = await loop.run_in_executor(self._executor, self._encode_batch, texts)
+        except Exception as e:
+            logger.error(f"Embedding batch failed ({len(texts)} texts): {e}")
+            for _, future in batch.values():
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for key, vec in zip(keys, vectors):
+            vec = np.array(vec)
+            self._cache_put(key, vec)
+            future = batch[key][1]
+            if not future.done():
+                future.set_result(vec)
+
+    def get_stats(self) -> dict:
+        total = self.stats["hits"] + self.stats["misses"]
+        return {
+            **self.stats,
+            "hit_rate": (self.stats["hits"] / total) if total else 0.0,
+            "avg_batch_size": (self.stats["encoded"] / self.stats["batches"]) if self.stats["batches"] else 0.0,
+            "cache_entries": len(self._cache),
+        }
+
+# 全局单例
+embedding_service = EmbeddingService()
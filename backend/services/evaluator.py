@@ -4,6 +4,8 @@ import logging
 import json
 from dotenv import load_dotenv
 
+from utils.http_client import dashscope_generate
+
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 PROJECT_ROOT = os.path.dirname(os.path.dirname(BASE_DIR))
 load_dotenv(os.path.join(PROJECT_ROOT, ".env"))
@@ -42,55 +44,34 @@ async def evaluate_rag_response(question: str, answer: str, context: str) -> dic
 }}
 """
     try:
-        import asyncio
-        max_retries = 3
-        retry_delay = 5  # 秒
-        response = None
-        
-        async with httpx.AsyncClient() as client:
-            for retry in range(max_retries):
-                try:
-                    logger.info(f"发送评估请求到Dashscope API，重试次数: {retry+1}/{max_retries}")
-                    response = await client.post(
-                        "https://dashscope.aliyuncs.com/api/v1/services/aigc/text-generation/generation",
-                        headers={
-                            "Authorization": f"Bearer {DASHSCOPE_API_KEY}",
-                            "Content-Type": "application/json"
-                        },
-                        json={
-                            "model": "qwen-max",
-                            "input": {"messages": [{"role": "user", "content": prompt}]},
-                            "parameters": {
-                                "temperature": 0.1,
-                                "result_format": "message"
-                            }
-                        },
-                        timeout=120.0  # 增加超时时间到120秒
-                    )
-                    
-                    if response.status_code != 200:
-                        logger.error(f"Evaluation API failed: {response.text}")
-                        return {"faithfulness_score": 0.0, "relevancy_score": 0.0, "reason": "Evaluator API Error"}
+        logger.info(f"发送评估请求到Dashscope API")
+        try:
+            # 共享连接池 + 统一重试/退避（utils/http_client.py）
+            response = await dashscope_generate(
+                {
+                    "model": "qwen-max",
+                    "input": {"messages": [{"role": "user", "content": prompt}]},
+                    "parameters": {
+                        "temperature": 0.1,
+                        "result_format": "message"
+                    }
+                },
+                route="evaluate",
+                api_key=DASHSCOPE_API_KEY,
+                timeout=120.0
+            )
+        except httpx.TimeoutException:
+            logger.error(f"所有评估请求重试都失败了，请求超时")
+            return {"faithfulness_score": 0.0, "relevancy_score": 0.0, "reason": "Evaluator API Timeout"}
+        except httpx.RequestError as e:
+            logger.error(f"所有评估请求重试都失败了，错误: {e}")
+            return {"faithfulness_score": 0.0, "relevancy_score": 0.0, "reason": f"Evaluator API Error: {str(e)}"}
+
+        if response.status_code != 200:
+            logger.error(f"Evaluation API failed: {response.text}")
+            return {"faithfulness_score": 0.0, "relevancy_score": 0.0, "reason": "Evaluator API Error"}
+        logger.info(f"成功收到评估Dashscope API响应")
 
-                    logger.info(f"成功收到评估Dashscope API响应")
-                    break  # 成功，退出重试循环
-                except httpx.TimeoutException:
-                    logger.warning(f"评估请求超时，{retry+1}/{max_retries}，将在{retry_delay}秒后重试...")
-                    if retry < max_retries - 1:
-                        await asyncio.sleep(retry_delay)
-                        retry_delay *= 1.5  # 指数退避
-                    else:
-                        logger.error(f"所有评估请求重试都失败了，请求超时")
-                        return {"faithfulness_score": 0.0, "relevancy_score": 0.0, "reason": "Evaluator API Timeout"}
-                except httpx.RequestError as e:
-                    logger.warning(f"评估请求失败，{retry+1}/{max_retries}，错误: {e}，将在{retry_delay}秒后重试...")
-                    if retry < max_retries - 1:
-                        await asyncio.sleep(retry_delay)
-                        retry_delay *= 1.5  # 指数退避
-                    else:
-                        logger.error(f"所有评估请求重试都失败了，错误: {e}")
-                        return {"faithfulness_score": 0.0, "relevancy_score": 0.0, "reason": f"Evaluator API Error: {str(e)}"}
-        
         data = response.json()
         content = data["output"]["choices"][0]["message"]["content"]
         
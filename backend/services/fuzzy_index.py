@@ -0,0 +1,159 @@
+import os
+import re
+import math
+from collections import Counter
+from difflib import SequenceMatcher
+from typing import Dict, Iterable, List, Set, Tuple
+
+# Names ranked by n-gram overlap that get the exact difflib score
+FUZZY_CANDIDATES = int(os.getenv("GRAPH_FUZZY_CANDIDATES", "20"))
+# Candidates are seeded from the query's rarest n-grams: always enough of them that every name sharing
+# FUZZY_MIN_OVERLAP of the query's n-grams is seeded, then more while their postings fit the budget.
+# The remaining (common) n-grams only add to the scores of names already seeded.
+FUZZY_MIN_OVERLAP = 0.6
+FUZZY_SEED_BUDGET = int(os.getenv("GRAPH_FUZZY_SEED_BUDGET", "1000"))
+# Names with the most shared n-grams (this multiple of the candidate count) are re-ranked by Dice
+FUZZY_POOL_FACTOR = int(os.getenv("GRAPH_FUZZY_POOL_FACTOR", "4"))
+
+# CJK ideographs (Ext-A, URO, compatibility): indexed as characters + bigrams, everything else as padded trigrams
+_CJK_RUN = re.compile(r"[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]+")
+
+
+def _trigrams(segment: str, grams: Set[str]):
+    segment = segment.strip()
+    if segment:
+        padded = f" {segment} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+def name_ngrams(name: str) -> Set[str]:
+    """
+    Character n-grams of a concept name (case- and whitespace-insensitive).
+
+    Latin / digit runs give space-padded trigrams ("bert" -> " be", "ber", "ert", "rt "),
+    CJK runs give characters and bigrams ("注意力" -> "注", "意", "力", "注意", "意力"), so short
+    Chinese terms with one wrong character still share grams, and "BERT模型" shares grams
+    with both "BERT" and "模型".
+    """
+    text = " ".join(name.lower().split())
+    grams: Set[str] = set()
+    pos = 0
+    for m in _CJK_RUN.finditer(text):
+        _trigrams(text[pos:m.start()], grams)
+        run = m.group()
+        grams.update(run)
+        grams.update(run[i:i + 2] for i in range(len(run) - 1))
+        pos = m.end()
+    _trigrams(text[pos:], grams)
+    return grams
+
+
+def pick_seeds(posting_sizes: List[Tuple[int, str]], budget: int = FUZZY_SEED_BUDGET) -> List[str]:
+    """
+    posting_sizes: [(posting list size, gram)] of the query's n-grams. Returns the seed grams, rarest
+    first: the len - ceil(len * FUZZY_MIN_OVERLAP) + 1 rarest (prefix filtering: a name sharing that
+    fraction of the grams contains at least one of them), plus further grams within `budget` postings.
+    """
+    present = sorted(item for item in posting_sizes if item[0] > 0)
+    required = len(present) - math.ceil(len(present) * FUZZY_MIN_OVERLAP) + 1
+    seeds, total = [], 0
+    for size, gram in present:
+        if len(seeds) >= required and total + size > budget:
+            break
+        seeds.append(gram)
+        total += size
+    return seeds
+
+
+class NGramIndex:
+    """
+    Inverted n-gram index over concept names for fuzzy lookup.
+
+    candidates() seeds names from the query's rarest n-grams (pick_seeds), counts their shared
+    n-grams, re-ranks the best of them by Dice overlap, and search() applies
+    difflib's ratio (the get_close_matches score) to the best `candidates` of them.
+    add / remove are incremental.
+    """
+
+    def __init__(self, names: Iterable[str] = ()):
+        self.postings: Dict[str, Set[str]] = {}
+        self._grams: Dict[str, Set[str]] = {}  # name -> its n-grams
+        for name in names:
+            self.add(name)
+
+    def __len__(self):
+        return len(self._grams)
+
+    def __contains__(self, name: str):
+        return name in self._grams
+
+    def add(self, name: str):
+        if not name or name in self._grams:
+            return
+        grams = self._grams[name] = name_ngrams(name)
+        for gram in grams:
+            self.postings.setdefault(gram, set()).add(name)
+
+    def remove(self, name: str):
+        grams = self._grams.pop(name, None)
+        for gram in grams or ():
+            names = self.postings.get(gram)
+            if names is not None:
+                names.discard(name)
+                if not names:
+                    del self.postings[gram]
+
+    def candidates(self, query: str, limit: int = FUZZY_CANDIDATES, seed_budget: int = FUZZY_SEED_BUDGET) -> List[str]:
+        q_grams = name_ngrams(query)
+        seeds = pick_seeds([(len(self.postings.get(g, ())), g) for g in q_grams], seed_budget)
+        if not seeds:
+            return []
+        shared = Counter()
+        for gram in seeds:
+            shared.update(self.postings[gram])
+        # Common grams only add to names already seeded
+        seeded = set(shared)
+        for gram in q_grams.difference(seeds):
+            names = self.postings.get(gram)
+            if names:
+                shared.update(names & seeded)
+        pool = [name for name, _ in shared.most_common(FUZZY_POOL_FACTOR * limit)]
+        return sorted(pool, key=lambda name: dice(q_grams, self._grams[name]), reverse=True)[:limit]
+
+    def search(self, query: str, limit: int = 5, cutoff: float = 0.6,
+               candidates: int = FUZZY_CANDIDATES) -> List[Tuple[str, float]]:
+        """(name, score) of up to `limit` names with difflib ratio >= cutoff (ignoring case), best first"""
+        return rank_names(query, self.candidates(query, max(candidates, limit)), limit, cutoff)
+
+
+def dice(q_grams: Set[str], grams: Set[str]) -> float:
+    return 2.0 * len(q_grams & grams) / (len(q_grams) + len(grams)) if q_grams or grams else 0.0
+
+
+def rank_names(query: str, names: Iterable[str], limit: int = 5, cutoff: float = 0.6) -> List[Tuple[str, float]]:
+    """
+    Exact get_close_matches-style scoring (difflib ratio, ignoring case) of candidate names.
+    Candidates are scored in order of quick_ratio() (an upper bound of ratio()) and scoring stops
+    once that bound cannot beat the current top `limit`.
+    """
+    matcher = SequenceMatcher()
+    matcher.set_seq2(query.lower())
+    bounded = []
+    for name in names:
+        matcher.set_seq1(name.lower())
+        if matcher.real_quick_ratio() >= cutoff:
+            bound = matcher.quick_ratio()
+            if bound >= cutoff:
+                bounded.append((bound, name))
+    bounded.sort(key=lambda item: item[0], reverse=True)
+
+    scored = []
+    for bound, name in bounded:
+        if len(scored) >= limit and bound <= scored[limit - 1][1]:
+            break
+        matcher.set_seq1(name.lower())
+        score = matcher.ratio()
+        if score >= cutoff:
+            scored.append((name, score))
+            scored.sort(key=lambda item: item[1], reverse=True)
+    return scored[:limit]
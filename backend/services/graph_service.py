@@ -1,53 +1,190 @@
 import networkx as nx
+from sqlalchemy import delete, or_, update
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
-from models.graph import GlobalNode, GlobalEdge
+from models.graph import GlobalNode, GlobalEdge, NodeDocument
 import json
+import uuid
 import logging
-from difflib import get_close_matches
+import threading
+from contextlib import contextmanager
+from services.fuzzy_index import NGramIndex
 
 logger = logging.getLogger(__name__)
 
+# IN (...) 查询每批的名称/ID 数（低于 SQLite 的绑定参数上限）
+GRAPH_IN_CHUNK = 500
+# merge_subgraph 与并发写入撞上唯一约束（同名节点/同一 node_documents 行）时的重试次数
+GRAPH_MERGE_RETRIES = 3
+
+
+def _chunks(items: list, size: int = GRAPH_IN_CHUNK):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+class GraphCache:
+    """
+    Process-wide in-memory NetworkX copy of global_nodes / global_edges.
+
+    - Loaded from the DB on first use and shared by every GraphService (routes create one per request).
+    - GraphService mutations apply their committed changes as deltas (apply()) instead of forcing a reload.
+    - `version` increases on every delta / reload; readers hold the lock via reading() so a traversal
+      never sees a half-applied delta.
+    - Name resolution is served from memory too: `names` (exact name -> node id) and `name_index`
+      (n-gram index for fuzzy entity linking) follow the same deltas.
+    """
+
+    def __init__(self):
+        self._graph = None
+        self.names = {}
+        self.name_index = NGramIndex()
+        self.version = 0
+        self._lock = threading.RLock()
+        self.stats = {"loads": 0, "deltas": 0}
+
+    @staticmethod
+    def _load(db: Session) -> nx.DiGraph:
+        G = nx.DiGraph()
+        for node_id, name, category, weight in db.query(GlobalNode.id, GlobalNode.name,
+                                                         GlobalNode.category, GlobalNode.weight):
+            G.add_node(node_id, name=name, category=category, weight=weight)
+        for source_id, target_id, weight, relation in db.query(GlobalEdge.source_id, GlobalEdge.target_id,
+                                                                GlobalEdge.weight, GlobalEdge.relation):
+            G.add_edge(source_id, target_id, weight=weight, relation=relation)
+        return G
+
+    def reload(self, db: Session) -> nx.DiGraph:
+        """Rebuild from the DB (also picks up writes made by other processes, e.g. migrate_graphs.py)"""
+        with self._lock:
+            self._graph = self._load(db)
+            self.names = {data["name"]: node_id for node_id, data in self._graph.nodes(data=True) if data.get("name")}
+            self.name_index = NGramIndex(self.names)
+            self.version += 1
+            self.stats["loads"] += 1
+            logger.info(f"🕸️ [Graph Cache] Loaded {self._graph.number_of_nodes()} nodes, "
+                        f"{self._graph.number_of_edges()} edges (v{self.version})")
+            return self._graph
+
+    def get(self, db: Session) -> nx.DiGraph:
+        """The cached graph, loaded on first use. Hold reading() while traversing it."""
+        with self._lock:
+            return self._graph if self._graph is not None else self.reload(db)
+
+    @contextmanager
+    def reading(self, db: Session):
+        with self._lock:
+            yield self.get(db)
+
+    def apply(self, delta):
+        """Apply delta(cache) for a committed mutation; a no-op until the graph is first loaded"""
+        with self._lock:
+            self.version += 1
+            if self._graph is not None:
+                delta(self)
+                self.stats["deltas"] += 1
+
+    def invalidate(self):
+        with self._lock:
+            self._graph = None
+            self.names = {}
+            self.name_index = NGramIndex()
+            self.version += 1
+
+    # ---------- deltas (called through apply(), lock held) ----------
+    def add_nodes(self, nodes):
+        """nodes: [(node_id, {"name", "category", "weight"})]; existing nodes get their attributes updated"""
+        self._graph.add_nodes_from(nodes)
+        for node_id, data in nodes:
+            name = data.get("name")
+            if name and name not in self.names:
+                self.names[name] = node_id
+                self.name_index.add(name)
+
+    def add_edges(self, edges):
+        """edges: [(source_id, target_id, {"weight", "relation"})]"""
+        self._graph.add_edges_from(edges)
+
+    def remove_nodes(self, node_ids):
+        """Removing a node also drops its edges"""
+        for node_id in node_ids:
+            if node_id not in self._graph:
+                continue
+            name = self._graph.nodes[node_id].get("name")
+            if name and self.names.get(name) == node_id:
+                del self.names[name]
+                self.name_index.remove(name)
+            self._graph.remove_node(node_id)
+
+    def set_weights(self, weights: dict):
+        for node_id, weight in weights.items():
+            if node_id in self._graph:
+                self._graph.nodes[node_id]["weight"] = weight
+
+    # ---------- lookups (inside reading()) ----------
+    def node_id(self, name: str):
+        return self.names.get(name)
+
+    def node_name(self, node_id: str):
+        data = self._graph.nodes.get(node_id)
+        return data.get("name") if data else None
+
+    def match_names(self, query: str, limit: int = 5, cutoff: float = 0.6):
+        """[(node_id, name, score)] of the closest concept names, best first"""
+        return [(self.names[name], name, score) for name, score in self.name_index.search(query, limit, cutoff)]
+
+    def metrics(self) -> dict:
+        with self._lock:
+            loaded = self._graph is not None
+            return {
+                "loaded": loaded,
+                "version": self.version,
+                "nodes": self._graph.number_of_nodes() if loaded else 0,
+                "edges": self._graph.number_of_edges() if loaded else 0,
+                "indexed_names": len(self.name_index),
+                **self.stats,
+            }
+
+
+graph_cache = GraphCache()
+
+
 class GraphService:
     def __init__(self, db: Session):
-        self.db = db
-        self.nx_graph = None  # In-memory graph cache
+        self.db = db  # the NetworkX graph is shared process-wide, see graph_cache
 
     def get_node_by_name(self, name: str):
         return self.db.query(GlobalNode).filter(GlobalNode.name == name).first()
         
     def search_nodes_fuzzy(self, query: str, limit: int = 5, cutoff: float = 0.6):
-        """Fuzzy search for nodes"""
-        all_names = [n[0] for n in self.db.query(GlobalNode.name).all()]
-        matches = get_close_matches(query, all_names, n=limit, cutoff=cutoff)
-        
-        nodes = []
-        for name in matches:
-            node = self.get_node_by_name(name)
-            if node:
-                nodes.append(node)
-        return nodes
+        """Fuzzy search for nodes (in-memory n-gram index, then one query for the matches)"""
+        with graph_cache.reading(self.db):
+            matches = [node_id for node_id, _, _ in graph_cache.match_names(query, limit=limit, cutoff=cutoff)]
+        if not matches:
+            return []
+        nodes = {n.id: n for n in self.db.query(GlobalNode).filter(GlobalNode.id.in_(matches))}
+        return [nodes[node_id] for node_id in matches if node_id in nodes]
 
     def add_node(self, name: str, category: str = "Concept", digest: str = "", source_doc_id: str = None):
         """添加或更新节点"""
         node = self.get_node_by_name(name)
         if not node:
-            node = GlobalNode(name=name, category=category, digest=digest)
-            if source_doc_id:
-                node.document_ids = json.dumps([source_doc_id])
+            node = GlobalNode(id=str(uuid.uuid4()), name=name, category=category, digest=digest)
             self.db.add(node)
+            if source_doc_id:
+                self.db.queue_insert(NodeDocument.__table__, [{"node_id": node.id, "doc_id": source_doc_id}])
         else:
             # Update existing node
             if digest and len(digest) > len(node.digest or ""):
                 node.digest = digest
             
-            if source_doc_id:
-                docs = json.loads(node.document_ids)
-                if source_doc_id not in docs:
-                    docs.append(source_doc_id)
-                    node.document_ids = json.dumps(docs)
+            if source_doc_id and self.db.get(NodeDocument, (node.id, source_doc_id)) is None:
+                self.db.queue_insert(NodeDocument.__table__, [{"node_id": node.id, "doc_id": source_doc_id}])
         
         self.db.commit()
         self.db.refresh(node)
+        graph_cache.apply(lambda cache: cache.add_nodes(
+            [(node.id, {"name": node.name, "category": node.category, "weight": node.weight})]))
         return node
 
     def add_edge(self, source_name: str, target_name: str, relation: str = "related_to", weight: float = 1.0):
@@ -73,46 +210,175 @@ class GraphService:
             # Strengthen existing connection
             edge.weight += 0.1
             
+        source_id, target_id, weight, relation = source.id, target.id, edge.weight, edge.relation
         self.db.commit()
+        graph_cache.apply(lambda cache: cache.add_edges([(source_id, target_id, {"weight": weight, "relation": relation})]))
         return edge
 
+    def merge_subgraph(self, nodes: list, edges: list, doc_id: str = None) -> dict:
+        """
+        批量合并一个文档的知识图谱（add_node / add_edge 的批量版本，语义相同）：
+
+        - 节点名一次 IN 查询解析（按 GRAPH_IN_CHUNK 分批），已有边同样批量查出；
+        - 新节点/新边直接生成 ID，所有插入和更新（含新节点的 node_documents 行）在一次 commit 中完成（一个事务、一次写锁）；
+        - 节点：digest 取更长者，尚未关联 doc_id 的节点写入 node_documents；边：新建用给定权重，已存在则权重 +0.1。
+        - 与并发合并撞上唯一约束（同名新节点）时整体回滚并重新解析名称，最多 GRAPH_MERGE_RETRIES 次。
+
+        nodes: [{"label"/"id", "type", "digest"}]，edges: [{"source", "target", "relation", "weight"}]。
+        边的端点若是本图中节点的 id，会映射到该节点的名称；只出现在边上的节点同样记入 doc_id。
+        返回新建/更新的节点数和边数。
+        """
+        # 1. 整理本次要写入的节点（同名合并）和边
+        wanted = {}
+        id_to_name = {}
+
+        def want(name, category="Concept", digest=""):
+            spec = wanted.get(name)
+            if spec is None:
+                spec = wanted[name] = {"category": category or "Concept", "digest": ""}
+            if digest and len(digest) > len(spec["digest"]):
+                spec["digest"] = digest
+
+        for node in nodes or []:
+            # Use label as primary key for merging, fallback to id
+            name = node.get("label") or node.get("id")
+            if not name:
+                continue
+            if node.get("id"):
+                id_to_name[node["id"]] = name
+            want(name, node.get("type") or node.get("category"), node.get("digest") or "")
+
+        edge_specs = []
+        for edge in edges or []:
+            source = id_to_name.get(edge.get("source"), edge.get("source"))
+            target = id_to_name.get(edge.get("target"), edge.get("target"))
+            if not source or not target:
+                continue
+            want(source)
+            want(target)
+            edge_specs.append((source, target, edge.get("relation") or "related_to", float(edge.get("weight", 1.0))))
+
+        if not wanted:
+            return {"nodes_created": 0, "nodes_updated": 0, "edges_created": 0, "edges_updated": 0}
+
+        # 名称解析与写入之间，其它会话可能已插入同名节点：唯一约束冲突时回滚并重新解析（重新查到的节点走更新分支）
+        for attempt in range(1, GRAPH_MERGE_RETRIES + 1):
+            try:
+                counts, touched_nodes, touched_edges = self._write_subgraph(wanted, edge_specs, doc_id)
+                break
+            except IntegrityError as e:
+                self.db.rollback()
+                if attempt == GRAPH_MERGE_RETRIES:
+                    raise
+                logger.info(f"🔁 合并图谱时与并发写入冲突，重试 ({attempt}/{GRAPH_MERGE_RETRIES}): {e.orig}")
+            except Exception:
+                self.db.rollback()
+                raise
+
+        def delta(cache):
+            cache.add_nodes(touched_nodes)
+            cache.add_edges(touched_edges)
+        graph_cache.apply(delta)
+        return counts
+
+    def _write_subgraph(self, wanted: dict, edge_specs: list, doc_id: str = None):
+        """merge_subgraph 的一次尝试：解析名称、写入并提交；返回 (计数, 缓存节点增量, 缓存边增量)"""
+        # 2. 一次（分批）IN 查询解析所有名称
+        existing = {}
+        for chunk in _chunks(list(wanted)):
+            for node in self.db.query(GlobalNode).filter(GlobalNode.name.in_(chunk)):
+                existing[node.name] = node
+        linked = set()
+        if doc_id:
+            for chunk in _chunks([node.id for node in existing.values()]):
+                linked.update(node_id for node_id, in self.db.query(NodeDocument.node_id).filter(
+                    NodeDocument.doc_id == doc_id, NodeDocument.node_id.in_(chunk)))
+
+        name_to_id = {}
+        link_rows = []
+        touched_nodes = []
+        nodes_created = nodes_updated = 0
+        for name, spec in wanted.items():
+            node = existing.get(name)
+            if node is None:
+                node = GlobalNode(id=str(uuid.uuid4()), name=name, category=spec["category"],
+                                  digest=spec["digest"], weight=1.0)
+                self.db.add(node)
+                if doc_id:
+                    link_rows.append({"node_id": node.id, "doc_id": doc_id})
+                nodes_created += 1
+            else:
+                changed = False
+                if spec["digest"] and len(spec["digest"]) > len(node.digest or ""):
+                    node.digest = spec["digest"]
+                    changed = True
+                if doc_id and node.id not in linked:
+                    link_rows.append({"node_id": node.id, "doc_id": doc_id})
+                    changed = True
+                nodes_updated += changed
+            name_to_id[name] = node.id
+            touched_nodes.append((node.id, {"name": name, "category": node.category, "weight": node.weight}))
+
+        # 3. 已有边：按起点批量查出，再按 (起点, 终点) 匹配
+        pairs = {(name_to_id[s], name_to_id[t]) for s, t, _, _ in edge_specs}
+        existing_edges = {}
+        source_ids = list({s for s, _ in pairs})
+        for chunk in _chunks(source_ids):
+            for edge in self.db.query(GlobalEdge).filter(GlobalEdge.source_id.in_(chunk)):
+                key = (edge.source_id, edge.target_id)
+                if key in pairs and key not in existing_edges:
+                    existing_edges[key] = edge
+
+        edges_created = edges_updated = 0
+        for source, target, relation, weight in edge_specs:
+            key = (name_to_id[source], name_to_id[target])
+            edge = existing_edges.get(key)
+            if edge is None:
+                edge = existing_edges[key] = GlobalEdge(id=str(uuid.uuid4()), source_id=key[0], target_id=key[1],
+                                                        relation=relation, weight=weight)
+                self.db.add(edge)
+                edges_created += 1
+            else:
+                # Strengthen existing connection
+                edge.weight += 0.1
+                edges_updated += 1
+
+        self.db.queue_insert(NodeDocument.__table__, link_rows)
+        touched_edges = [(e.source_id, e.target_id, {"weight": e.weight, "relation": e.relation})
+                         for e in existing_edges.values()]
+        # autoflush=False：所有 INSERT/UPDATE 都在这一次 commit 的 flush 中批量执行
+        self.db.commit()
+        counts = {"nodes_created": nodes_created, "nodes_updated": nodes_updated,
+                  "edges_created": edges_created, "edges_updated": edges_updated}
+        return counts, touched_nodes, touched_edges
+
     def build_networkx_graph(self):
-        """从数据库构建内存中的NetworkX图"""
-        G = nx.DiGraph()
-        
-        nodes = self.db.query(GlobalNode).all()
-        edges = self.db.query(GlobalEdge).all()
-        
-        for n in nodes:
-            G.add_node(n.id, name=n.name, category=n.category, weight=n.weight)
-            
-        for e in edges:
-            G.add_edge(e.source_id, e.target_id, weight=e.weight, relation=e.relation)
-            
-        self.nx_graph = G
-        return G
+        """从数据库重新加载共享的内存 NetworkX 图"""
+        return graph_cache.reload(self.db)
 
     def update_pagerank(self):
         """计算PageRank并更新数据库中的节点权重"""
-        if not self.nx_graph:
-            self.build_networkx_graph()
-            
-        if len(self.nx_graph.nodes) == 0:
-            return
-            
-        pagerank = nx.pagerank(self.nx_graph, weight='weight')
+        with graph_cache.reading(self.db) as G:
+            if len(G.nodes) == 0:
+                return
+            pagerank = nx.pagerank(G, weight='weight')
         
         # Batch update in DB
         for node_id, score in pagerank.items():
             self.db.query(GlobalNode).filter(GlobalNode.id == node_id).update({"weight": score})
             
         self.db.commit()
+
+        graph_cache.apply(lambda cache: cache.set_weights(pagerank))
         logger.info("PageRank updated for all nodes")
 
     def get_full_graph_data(self):
         """获取用于前端3D可视化的完整数据"""
         nodes = self.db.query(GlobalNode).all()
         edges = self.db.query(GlobalEdge).all()
+        docs = {}
+        for node_id, doc_id in self.db.query(NodeDocument.node_id, NodeDocument.doc_id):
+            docs.setdefault(node_id, []).append(doc_id)
         
         return {
             "nodes": [
@@ -122,7 +388,7 @@ class GraphService:
                     "val": n.weight * 10,  # Scale for visibility
                     "group": n.category,
                     "desc": n.digest,
-                    "docs": json.loads(n.document_ids) if n.document_ids else [] # [NEW] Return source docs
+                    "docs": docs.get(n.id, [])  # [NEW] Return source docs
                 } for n in nodes
             ],
             "links": [
@@ -136,85 +402,82 @@ class GraphService:
 
     def find_shortest_path(self, start_name: str, end_name: str):
         """寻找两个概念之间的最短路径"""
-        start_node = self.get_node_by_name(start_name)
-        end_node = self.get_node_by_name(end_name)
-        
-        if not start_node or not end_node:
-            return None
-            
-        if not self.nx_graph:
-            self.build_networkx_graph()
-            
-        try:
-            path_ids = nx.shortest_path(self.nx_graph, source=start_node.id, target=end_node.id)
+        with graph_cache.reading(self.db) as G:
+            start_id = graph_cache.node_id(start_name)
+            end_id = graph_cache.node_id(end_name)
+
+            if not start_id or not end_id:
+                return None
+
+            try:
+                path_ids = nx.shortest_path(G, source=start_id, target=end_id)
+            except (nx.NetworkXNoPath, nx.NodeNotFound):
+                return []
             # Convert IDs back to names
-            path_names = []
-            for nid in path_ids:
-                n = self.db.query(GlobalNode).filter(GlobalNode.id == nid).first()
-                path_names.append(n.name)
-            return path_names
-        except nx.NetworkXNoPath:
-            return []
+            return [graph_cache.node_name(nid) for nid in path_ids]
 
     def get_subgraph_context(self, question_entities: list[str], max_hops: int = 1):
         """
         Retrieves a text context based on the subgraph surrounding the question entities.
+        Names are resolved from the in-memory graph; only the matched concepts' digests are queried.
         Returns: (context_text, context_data_dict)
         """
-        if not self.nx_graph:
-            self.build_networkx_graph()
-            
-        context_parts = []
-        found_nodes = set()
-        
-        # 1. Map entities to nodes
-        for entity in question_entities:
-            # Try exact match first
-            node = self.get_node_by_name(entity)
-            if not node:
-                 # Try fuzzy
-                 fuzzy = self.search_nodes_fuzzy(entity, limit=1)
-                 if fuzzy:
-                     node = fuzzy[0]
-            
-            if node:
-                found_nodes.add(node.id)
-                context_parts.append(f"Concept: {node.name} ({node.category})\nSummary: {node.digest or 'N/A'}")
-        
-        if not found_nodes:
-            return "", {"nodes": [], "edges": []}
-            
-        # 2. Expand to neighbors
-        subgraph_nodes = set(found_nodes)
-        for node_id in found_nodes:
-            if node_id in self.nx_graph:
-                # Get neighbors
-                neighbors = list(self.nx_graph.neighbors(node_id))
-                subgraph_nodes.update(neighbors)
-                
-                # If we have multiple start nodes, try to find paths between them
-                if len(found_nodes) > 1:
-                    for other_id in found_nodes:
-                        if node_id != other_id:
-                            try:
-                                path = nx.shortest_path(self.nx_graph, node_id, other_id)
-                                subgraph_nodes.update(path)
-                            except:
-                                pass
-
-        # 3. Construct text from edges in subgraph
+        with graph_cache.reading(self.db) as G:
+            # 1. Map entities to nodes
+            found_nodes = []
+            for entity in question_entities:
+                if not isinstance(entity, str) or not entity.strip():
+                    continue
+                # Try exact match first
+                node_id = graph_cache.node_id(entity)
+                if not node_id:
+                    # Try fuzzy
+                    fuzzy = graph_cache.match_names(entity, limit=1)
+                    if fuzzy:
+                        node_id = fuzzy[0][0]
+                if node_id and node_id not in found_nodes:
+                    found_nodes.append(node_id)
+
+            if not found_nodes:
+                return "", {"nodes": [], "edges": []}
+
+            concepts = [(nid, G.nodes[nid].get("name"), G.nodes[nid].get("category")) for nid in found_nodes]
+
+            # 2. Expand to neighbors
+            subgraph_nodes = set(found_nodes)
+            for node_id in found_nodes:
+                if node_id in G:
+                    # Get neighbors
+                    neighbors = list(G.neighbors(node_id))
+                    subgraph_nodes.update(neighbors)
+
+                    # If we have multiple start nodes, try to find paths between them
+                    if len(found_nodes) > 1:
+                        for other_id in found_nodes:
+                            if node_id != other_id:
+                                try:
+                                    path = nx.shortest_path(G, node_id, other_id)
+                                    subgraph_nodes.update(path)
+                                except:
+                                    pass
+
+            # 3. Relationships between named nodes of the subgraph
+            relationships = []
+            for u, v, edge_data in G.subgraph(subgraph_nodes).edges(data=True):
+                u_name, v_name = graph_cache.node_name(u), graph_cache.node_name(v)
+                if u_name and v_name:
+                    relationships.append((u, v, u_name, v_name, edge_data.get('relation', 'related_to')))
+
+        digests = dict(self.db.query(GlobalNode.id, GlobalNode.digest).filter(GlobalNode.id.in_(found_nodes)))
+        context_parts = [f"Concept: {name} ({category})\nSummary: {digests.get(nid) or 'N/A'}"
+                         for nid, name, category in concepts]
+
+        # 4. Construct text from edges in subgraph
         final_edges = []
         context_parts.append("\nRelationships:")
-        if len(subgraph_nodes) > 0:
-            subgraph = self.nx_graph.subgraph(subgraph_nodes)
-            for u, v in subgraph.edges():
-                u_node = self.db.query(GlobalNode).filter(GlobalNode.id == u).first()
-                v_node = self.db.query(GlobalNode).filter(GlobalNode.id == v).first()
-                edge_data = self.nx_graph.get_edge_data(u, v)
-                if u_node and v_node:
-                    relation = edge_data.get('relation', 'related_to')
-                    context_parts.append(f"- {u_node.name} {relation} {v_node.name}")
-                    final_edges.append({"source": u, "target": v, "relation": relation})
+        for u, v, u_name, v_name, relation in relationships:
+            context_parts.append(f"- {u_name} {relation} {v_name}")
+            final_edges.append({"source": u, "target": v, "relation": relation})
 
         context_data = {
             "nodes": list(subgraph_nodes),
@@ -222,45 +485,79 @@ class GraphService:
         }
         return "\n".join(context_parts), context_data
 
+    def add_document_alias(self, source_doc_id: str, alias_doc_id: str) -> int:
+        """
+        A re-upload of an identical file reuses the source's extraction:
+        every node citing source_doc_id now also cites alias_doc_id.
+        Returns the number of nodes updated.
+        """
+        aliased = {node_id for node_id, in self._document_nodes(alias_doc_id)}
+        rows = [{"node_id": node_id, "doc_id": alias_doc_id}
+                for node_id, in self._document_nodes(source_doc_id) if node_id not in aliased]
+        self.db.queue_insert(NodeDocument.__table__, rows)
+        self.db.commit()
+        return len(rows)
+
+    def _document_nodes(self, doc_id: str):
+        return self.db.query(NodeDocument.node_id).filter(NodeDocument.doc_id == doc_id)
+
     def remove_document_knowledge(self, doc_id: str):
         """
         When a document is deleted:
-        1. Find all nodes citing this doc_id.
-        2. Remove doc_id from their document_ids list.
+        1. Find all nodes citing this doc_id (node_documents, by the doc_id index).
+        2. Drop the document's node_documents rows.
         3. If a node has NO other sources, delete the node AND its connected edges.
+        Every step is an index lookup, so the cost follows the document's own nodes, not the graph size.
         """
-        # 1. Find potentially affected nodes using LIKE query for efficiency
-        # JSON list format: ["id1", "id2"] so we look for "id"
-        search_pattern = f'%"{doc_id}"%'
-        affected_nodes = self.db.query(GlobalNode).filter(GlobalNode.document_ids.like(search_pattern)).all()
-        
-        nodes_to_delete = []
-        
-        for node in affected_nodes:
-            try:
-                doc_ids = json.loads(node.document_ids or "[]")
-                if doc_id in doc_ids:
-                    doc_ids.remove(doc_id)
-                    
-                    if not doc_ids:
-                        # No more sources, mark for deletion
-                        nodes_to_delete.append(node.id)
-                    else:
-                        # Update with remaining sources
-                        node.document_ids = json.dumps(doc_ids)
-            except json.JSONDecodeError:
-                continue
-                
+        node_ids = [node_id for node_id, in self._document_nodes(doc_id)]
+        if not node_ids:
+            return
+
+        cited_elsewhere = set()
+        for chunk in _chunks(node_ids):
+            cited_elsewhere.update(node_id for node_id, in self.db.query(NodeDocument.node_id).filter(
+                NodeDocument.node_id.in_(chunk), NodeDocument.doc_id != doc_id).distinct())
+        nodes_to_delete = [node_id for node_id in node_ids if node_id not in cited_elsewhere]
+
+        self.db.queue_execute(delete(NodeDocument).where(NodeDocument.doc_id == doc_id))
+        for chunk in _chunks(nodes_to_delete):
+            # Edges connected to these nodes, then their name index rows and the nodes themselves
+            self.db.queue_execute(delete(GlobalEdge).where(
+                or_(GlobalEdge.source_id.in_(chunk), GlobalEdge.target_id.in_(chunk))))
+            self.db.queue_execute(delete(GlobalNode).where(GlobalNode.id.in_(chunk)))
+        self.db.commit()
+
         if nodes_to_delete:
-            # 2. Delete edges connected to these nodes
-            self.db.query(GlobalEdge).filter(
-                (GlobalEdge.source_id.in_(nodes_to_delete)) | 
-                (GlobalEdge.target_id.in_(nodes_to_delete))
-            ).delete(synchronize_session=False)
-            
-            # 3. Delete the nodes
-            self.db.query(GlobalNode).filter(GlobalNode.id.in_(nodes_to_delete)).delete(synchronize_session=False)
-            
             logger.info(f"🗑️ [Graph Cleanup] Deleted {len(nodes_to_delete)} nodes orphaned by file {doc_id}")
-        
-        self.db.commit()
+            graph_cache.apply(lambda cache: cache.remove_nodes(nodes_to_delete))
+
+    def migrate_document_ids(self, batch_size: int = 1000) -> int:
+        """
+        旧数据迁移：把 GlobalNode.document_ids（JSON 列表）中的来源写入 node_documents，
+        并把该列置为 "[]"（可重复执行、可中断续跑）。返回迁移的节点数。
+        """
+        migrated, last_id = 0, ""
+        while True:
+            batch = self.db.query(GlobalNode.id, GlobalNode.document_ids).filter(
+                GlobalNode.id > last_id,
+                GlobalNode.document_ids.isnot(None),
+                GlobalNode.document_ids.notin_(["", "[]"])
+            ).order_by(GlobalNode.id).limit(batch_size).all()
+            if not batch:
+                return migrated
+            last_id = batch[-1].id
+            ids = [row.id for row in batch]
+            linked = set(self.db.query(NodeDocument.node_id, NodeDocument.doc_id).filter(NodeDocument.node_id.in_(ids)))
+            rows = []
+            for row in batch:
+                try:
+                    doc_ids = json.loads(row.document_ids)
+                except json.JSONDecodeError:
+                    doc_ids = []
+                for doc_id in dict.fromkeys(d for d in doc_ids if isinstance(d, str) and d):
+                    if (row.id, doc_id) not in linked:
+                        rows.append({"node_id": row.id, "doc_id": doc_id})
+            self.db.queue_insert(NodeDocument.__table__, rows)
+            self.db.queue_execute(update(GlobalNode).where(GlobalNode.id.in_(ids)).values(document_ids="[]"))
+            self.db.commit()
+            migrated += len(batch)
@@ -0,0 +1,183 @@
+import os
+import logging
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+# This file is in backend/services/layout_store.py, project root is ../../
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+LAYOUT_DIR = os.getenv("LAYOUT_DIR") or os.path.join(PROJECT_ROOT, "uploads", "layout")
+
+logger = logging.getLogger(__name__)
+
+# ======================
+# Columnar Layout Format
+# ======================
+# One uncompressed .npz per file. npz members are read lazily, so a single page
+# only costs its own arrays plus the shared string table:
+#   kind         "pdf" (pdfplumber words) | "ocr" (RapidOCR boxes)
+#   pages        int32 (P,)    page numbers
+#   sizes        float32 (P,2) page width/height (NaN when unknown)
+#   str_offsets  int64 (S+1,)  interned strings: str_blob[off[i]:off[i+1]] is string i
+#   str_blob     uint8 (B,)    UTF-8 bytes of all distinct strings
+#   coords_{i}   float32 (n,4) x0/top/x1/bottom per word, or (n,8) quad for OCR
+#   text_{i}     int32 (n,)    index into the string table
+
+WORD_KEYS = ("x0", "top", "x1", "bottom")
+
+def layout_path(file_id: str) -> str:
+    return os.path.join(LAYOUT_DIR, f"{file_id}.npz")
+
+def _layout_kind(layout: List[Dict[str, Any]]) -> str:
+    if layout and "box" in layout[0]:
+        return "ocr"
+    return "pdf"
+
+class _StringTable:
+    def __init__(self):
+        self.index: Dict[str, int] = {}
+
+    def intern(self, s: str) -> int:
+        i = self.index.get(s)
+        if i is None:
+            i = self.index[s] = len(self.index)
+        return i
+
+    def arrays(self):
+        encoded = [s.encode("utf-8") for s in self.index]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        if encoded:
+            np.cumsum([len(b) for b in encoded], out=offsets[1:])
+        blob = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+        return offsets, blob
+
+def encode_layout(layout: List[Dict[str, Any]]) -> Dict[str, np.ndarray]:
+    """Convert the JSON-style layout (PDF pages or OCR boxes) into npz arrays"""
+    kind = _layout_kind(layout)
+    strings = _StringTable()
+    arrays: Dict[str, np.ndarray] = {"kind": np.array(kind)}
+
+    if kind == "ocr":
+        # OCR output is a flat list of boxes for a single image
+        coords = np.array([np.asarray(item["box"], dtype=np.float32).reshape(8) for item in layout],
+                          dtype=np.float32).reshape(-1, 8)
+        arrays["pages"] = np.array([1], dtype=np.int32)
+        arrays["sizes"] = np.full((1, 2), np.nan, dtype=np.float32)
+        arrays["coords_0"] = coords
+        arrays["text_0"] = np.array([strings.intern(item.get("text") or "") for item in layout], dtype=np.int32)
+    else:
+        arrays["pages"] = np.array([p.get("page", i + 1) for i, p in enumerate(layout)], dtype=np.int32)
+        arrays["sizes"] = np.array(
+            [[p.get("width") or np.nan, p.get("height") or np.nan] for p in layout], dtype=np.float32
+        ).reshape(-1, 2)
+        for i, p in enumerate(layout):
+            words = p.get("words") or []
+            arrays[f"coords_{i}"] = np.array(
+                [[w.get(k, 0.0) for k in WORD_KEYS] for w in words], dtype=np.float32
+            ).reshape(-1, 4)
+            arrays[f"text_{i}"] = np.array([strings.intern(w.get("text") or "") for w in words], dtype=np.int32)
+
+    arrays["str_offsets"], arrays["str_blob"] = strings.arrays()
+    return arrays
+
+def save_layout(file_id: str, layout: Optional[List[Dict[str, Any]]]) -> Optional[str]:
+    """Write the layout for file_id (atomic rename); an empty layout removes the file"""
+    if not layout:
+        delete_layout(file_id)
+        return None
+    os.makedirs(LAYOUT_DIR, exist_ok=True)
+    path = layout_path(file_id)
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        np.savez(f, **encode_layout(layout))
+    os.replace(tmp, path)
+    return path
+
+def delete_layout(file_id: str):
+    path = layout_path(file_id)
+    if os.path.exists(path):
+        try:
+            os.remove(path)
+        except OSError as e:
+            logger.error(f"Failed to delete layout {path}: {e}")
+
+# ======================
+# Lazy Reader
+# ======================
+class LayoutReader:
+    """Read pages from a layout .npz without materializing the whole document"""
+
+    def __init__(self, path: str):
+        self._npz = np.load(path, allow_pickle=False)
+        self.kind = str(self._npz["kind"])
+        self.pages = self._npz["pages"]
+        self.sizes = self._npz["sizes"]
+        self._str_offsets = None
+        self._str_blob = None
+
+    def close(self):
+        self._npz.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def page_count(self) -> int:
+        return len(self.pages)
+
+    def _strings(self, idx: np.ndarray) -> List[str]:
+        if self._str_offsets is None:
+            self._str_offsets = self._npz["str_offsets"]
+            self._str_blob = self._npz["str_blob"].tobytes()
+        off, blob = self._str_offsets, self._str_blob
+        return [blob[off[i]:off[i + 1]].decode("utf-8") for i in idx.tolist()]
+
+    def page_arrays(self, page: int):
+        """Raw (coords, texts) for a 1-based page number, or None if absent"""
+        hits = np.nonzero(self.pages == page)[0]
+        if len(hits) == 0:
+            return None
+        i = int(hits[0])
+        text_idx = self._npz[f"text_{i}"]
+        return self._npz[f"coords_{i}"], self._strings(text_idx)
+
+    def page(self, page: int) -> Optional[Any]:
+        """One page in the legacy JSON shape (pdf page dict, or OCR box list)"""
+        arrays = self.page_arrays(page)
+        if arrays is None:
+            return None
+        coords, texts = arrays
+        # float32 -> 2 decimals, enough for highlighting and keeps the JSON small
+        coords = np.round(coords.astype(np.float64), 2).tolist()
+        if self.kind == "ocr":
+            return [{"text": t, "box": [c[j:j + 2] for j in range(0, 8, 2)]} for c, t in zip(coords, texts)]
+        i = int(np.nonzero(self.pages == page)[0][0])
+        width, height = (None if np.isnan(v) else round(float(v), 2) for v in self.sizes[i])
+        return {
+            "page": page,
+            "width": width,
+            "height": height,
+            "words": [dict(zip(WORD_KEYS, c), text=t) for c, t in zip(coords, texts)]
+        }
+
+    def to_list(self) -> List[Dict[str, Any]]:
+        """Whole document in the legacy JSON shape (what layout_info used to return)"""
+        if self.kind == "ocr":
+            return self.page(1) or []
+        return [self.page(int(p)) for p in self.pages]
+
+def open_layout(file_id: str) -> Optional[LayoutReader]:
+    path = layout_path(file_id)
+    if not os.path.exists(path):
+        return None
+    return LayoutReader(path)
+
+def load_layout(file_id: str) -> Optional[List[Dict[str, Any]]]:
+    reader = open_layout(file_id)
+    if reader is None:
+        return None
+    with reader:
+        return reader.to_list()
@@ -0,0 +1,187 @@
+import os
+import time
+import uuid
+import asyncio
+import logging
+import threading
+import functools
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from utils.concurrency import parse_concurrency
+
+logger = logging.getLogger(__name__)
+
+# ======================
+# Configuration
+# ======================
+# Worker threads shared by all PDF operations (pypdf is synchronous; running it here
+# keeps the event loop, WebSockets and other requests responsive)
+PDF_JOB_WORKERS = int(os.getenv("PDF_JOB_WORKERS", "4"))
+# Per-operation concurrency, e.g. "merge=1,compress=2". Unlisted operations use the default.
+PDF_JOB_DEFAULT_CONCURRENCY = int(os.getenv("PDF_JOB_DEFAULT_CONCURRENCY", "2"))
+PDF_JOB_CONCURRENCY = os.getenv("PDF_JOB_CONCURRENCY", "merge=1,split=1,compress=1,metadata=4")
+# Finished jobs kept for status polling
+PDF_JOB_RETENTION = int(os.getenv("PDF_JOB_RETENTION", "200"))
+
+
+class JobCancelled(Exception):
+    """Raised inside the worker (from the progress callback) when a job is cancelled"""
+
+
+class PdfJob:
+    def __init__(self, op: str):
+        self.id = str(uuid.uuid4())
+        self.op = op
+        self.status = "queued"  # queued -> running -> completed | failed | cancelled
+        self.done = 0
+        self.total = 0
+        self.result: Any = None
+        self.error: Optional[str] = None
+        self.exception: Optional[BaseException] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.cancel_event = threading.Event()
+        self.task: Optional[asyncio.Task] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("completed", "failed", "cancelled")
+
+    @property
+    def progress(self) -> int:
+        if self.status == "completed":
+            return 100
+        return int(100 * self.done / self.total) if self.total else 0
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.id,
+            "op": self.op,
+            "status": self.status,
+            "progress": self.progress,
+            "done": self.done,
+            "total": self.total,
+            "result": self.result,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class PdfJobManager:
+    """
+    Runs blocking PdfService calls on a bounded thread pool.
+
+    - Each operation type has its own semaphore (PDF_JOB_CONCURRENCY), so e.g. a
+      200 MB merge cannot take every worker.
+    - Progress is pushed over the WebSocket channel named after the job id
+      (/ws/{job_id}) and kept on the job for polling.
+    - Cancellation: queued jobs never start; running jobs stop at the next page
+      via the progress callback.
+    """
+
+    def __init__(self,
+                 broadcast: Optional[Callable[[dict, str], Awaitable[None]]] = None,
+                 workers: int = PDF_JOB_WORKERS,
+                 concurrency: str = PDF_JOB_CONCURRENCY,
+                 default_concurrency: int = PDF_JOB_DEFAULT_CONCURRENCY):
+        self.broadcast = broadcast
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="pdf-job")
+        self._limits = parse_concurrency(concurrency, "PDF_JOB_CONCURRENCY")
+        self._default_limit = default_concurrency
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._jobs: "OrderedDict[str, PdfJob]" = OrderedDict()
+
+    def _semaphore(self, op: str) -> asyncio.Semaphore:
+        sem = self._semaphores.get(op)
+        if sem is None:
+            sem = self._semaphores[op] = asyncio.Semaphore(self._limits.get(op, self._default_limit))
+        return sem
+
+    def _prune(self):
+        finished = [jid for jid, job in self._jobs.items() if job.finished]
+        for jid in finished[:max(0, len(finished) - PDF_JOB_RETENTION)]:
+            del self._jobs[jid]
+
+    async def _notify(self, job: PdfJob):
+        if self.broadcast is None:
+            return
+        try:
+            await self.broadcast({"type": "pdf_job", **job.to_dict()}, job.id)
+        except Exception as e:
+            logger.error(f"Failed to broadcast PDF job {job.id}: {e}")
+
+    def submit(self, op: str, fn: Callable[..., Any], *args, **kwargs) -> PdfJob:
+        """Queue fn(*args, progress=..., **kwargs) and return immediately"""
+        job = PdfJob(op)
+        self._jobs[job.id] = job
+        self._prune()
+        job.task = asyncio.get_running_loop().create_task(self._run(job, fn, args, kwargs))
+        return job
+
+    async def run(self, op: str, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """Submit and wait for the result (raises the job's exception)"""
+        job = self.submit(op, fn, *args, **kwargs)
+        await asyncio.shield(job.task)
+        if job.status == "cancelled":
+            raise JobCancelled(job.id)
+        if job.status == "failed":
+            raise job.exception
+        return job.result
+
+    async def _run(self, job: PdfJob, fn, args, kwargs):
+        loop = asyncio.get_running_loop()
+        last_sent = [-1]
+
+        def progress(done: int, total: int):
+            # Called from the worker thread after/before every page
+            if job.cancel_event.is_set():
+                raise JobCancelled(job.id)
+            job.done, job.total = done, total
+            if job.progress != last_sent[0]:
+                last_sent[0] = job.progress
+                asyncio.run_coroutine_threadsafe(self._notify(job), loop)
+
+        try:
+            async with self._semaphore(job.op):
+                if job.cancel_event.is_set():
+                    raise JobCancelled(job.id)
+                job.status = "running"
+                job.started_at = time.time()
+                await self._notify(job)
+                call = functools.partial(fn, *args, progress=progress, **kwargs)
+                job.result = await loop.run_in_executor(self._executor, call)
+            job.status = "completed"
+        except (JobCancelled, asyncio.CancelledError):
+            job.status = "cancelled"
+            logger.info(f"PDF job cancelled: {job.op} {job.id}")
+        except Exception as e:
+            job.status = "failed"
+            job.error = str(e)
+            job.exception = e
+            logger.error(f"PDF job failed: {job.op} {job.id}: {e}")
+        finally:
+            job.finished_at = time.time()
+            await self._notify(job)
+
+    def get(self, job_id: str) -> Optional[PdfJob]:
+        return self._jobs.get(job_id)
+
+    def list(self) -> list:
+        return [job.to_dict() for job in reversed(self._jobs.values())]
+
+    def cancel(self, job_id: str) -> Optional[PdfJob]:
+        job = self._jobs.get(job_id)
+        if job is None or job.finished:
+            return job
+        job.cancel_event.set()
+        return job
+
+    def shutdown(self):
+        for job in self._jobs.values():
+            job.cancel_event.set()
+        self._executor.shutdown(wait=False, cancel_futures=True)
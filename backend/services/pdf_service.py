@@ -2,14 +2,49 @@
 
 from pathlib import Path
 from io import BytesIO
+from contextlib import contextmanager
+import os
 import shutil
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Callable, Optional
 import logging
 
 from pypdf import PdfReader, PdfWriter
 
+from services.pdf_stream_writer import StreamingPdfWriter, open_reader, trace_peak_memory
+
 logger = logging.getLogger(__name__)
 
+# 合并/拆分/压缩默认使用流式写出（逐页写盘、读取器按文件句柄打开），内存不随输入总大小增长；
+# 设为 0 则退回 pypdf PdfWriter 的整本内存写出
+PDF_STREAMING_WRITE = os.getenv("PDF_STREAMING_WRITE", "1").lower() in ("1", "true", "yes")
+
+# 进度回调：progress(已处理页数, 总页数)；由任务管理器传入，也可在回调中抛异常以取消操作
+ProgressCallback = Optional[Callable[[int, int], None]]
+
+
+def _report(progress: ProgressCallback, done: int, total: int):
+    if progress is not None:
+        progress(done, total)
+
+
+def _ticker(progress: ProgressCallback, total: int) -> Callable[[], None]:
+    """每调用一次报告一页（报告的是调用前已完成的页数）"""
+    done = [0]
+
+    def tick():
+        _report(progress, done[0], total)
+        done[0] += 1
+    return tick
+
+
+@contextmanager
+def _open_pdf(pdf_path, streaming: bool):
+    if streaming:
+        with open_reader(str(pdf_path)) as reader:
+            yield reader
+    else:
+        yield PdfReader(pdf_path)
+
 
 class PdfService:
     """PDF处理服务类，提供各种PDF操作功能"""
@@ -18,11 +53,12 @@ class PdfService:
         """初始化PDF服务"""
         pass
     
-    def extract_images(self, pdf_path: str) -> List[Dict[str, Any]]:
+    def extract_images(self, pdf_path: str, progress: ProgressCallback = None) -> List[Dict[str, Any]]:
         """从PDF文件中提取图片
         
         Args:
             pdf_path: PDF文件路径
+            progress: 可选的逐页进度回调
             
         Returns:
             提取的图片信息列表，包含路径、名称等
@@ -49,7 +85,9 @@ class PdfService:
                 output_dir = DOWNLOAD_DIR / file_id
             output_dir.mkdir(exist_ok=True)
             
+            total_pages = len(reader.pages)
             for page_index, page in enumerate(reader.pages):
+                _report(progress, page_index, total_pages)
                 for image_file_object in page.images:
                     image_path = output_dir / f"{page_index:04d}-{image_file_object.name}"
                     with open(image_path, "wb") as fp:
@@ -63,22 +101,30 @@ class PdfService:
                         "size": len(image_file_object.data)
                     })
             
+            _report(progress, total_pages, total_pages)
             logger.info(f"从PDF中提取了 {len(extracted_images)} 张图片")
             return extracted_images
         except Exception as e:
             logger.error(f"提取PDF图片失败: {str(e)}")
             raise
     
-    def compress_pdf(self, pdf_path: str, output_path: str) -> Dict[str, Any]:
+    def compress_pdf(self, pdf_path: str, output_path: str, progress: ProgressCallback = None,
+                     streaming: Optional[bool] = None) -> Dict[str, Any]:
         """压缩PDF文件
         
         Args:
             pdf_path: 输入PDF文件路径
             output_path: 输出PDF文件路径
+            progress: 可选的逐页进度回调
+            streaming: 是否流式写出（默认取 PDF_STREAMING_WRITE）
             
         Returns:
             压缩结果信息，包含原始大小、压缩后大小等
         """
+        if streaming is None:
+            streaming = PDF_STREAMING_WRITE
+        if streaming:
+            return self._compress_pdf_streaming(pdf_path, output_path, progress)
         try:
             pdf = Path(pdf_path)
             output = Path(output_path)
@@ -95,8 +141,11 @@ class PdfService:
                 writer.add_metadata(reader.metadata)
             
             # 压缩内容流
-            for page in writer.pages:
+            total_pages = len(writer.pages)
+            for i, page in enumerate(writer.pages):
+                _report(progress, i, total_pages)
                 page.compress_content_streams()
+            _report(progress, total_pages, total_pages)
             
             # 先写入内存缓冲区
             compressed_buffer = BytesIO()
@@ -135,11 +184,55 @@ class PdfService:
             logger.error(f"压缩PDF失败: {str(e)}")
             raise
     
-    def extract_text(self, pdf_path: str) -> str:
+    def _compress_pdf_streaming(self, pdf_path: str, output_path: str, progress: ProgressCallback = None) -> Dict[str, Any]:
+        """流式压缩：未压缩的流逐个 Flate 压缩后直接写入输出文件，不在内存中缓冲整份结果"""
+        try:
+            pdf = Path(pdf_path)
+            output = Path(output_path)
+            
+            with trace_peak_memory() as mem:
+                with open_reader(str(pdf)) as reader, StreamingPdfWriter(output, compress=True) as writer:
+                    total_pages = len(reader.pages)
+                    writer.add_metadata(reader.metadata)
+                    writer.add_pages(reader, range(total_pages), _ticker(progress, total_pages))
+                _report(progress, total_pages, total_pages)
+                
+                comp_size = output.stat().st_size
+                orig_size = pdf.stat().st_size
+                
+                # 如果压缩后更大，使用原始文件
+                if comp_size >= orig_size:
+                    logger.warning(f"压缩结果更大 ({comp_size} >= {orig_size} bytes)，使用原始文件")
+                    shutil.copy2(pdf, output)
+                    final_size = orig_size
+                    ratio = 100.0
+                    status = "No compression applied (would increase size)"
+                else:
+                    final_size = comp_size
+                    ratio = (comp_size / orig_size) * 100
+                    status = f"Compressed ({ratio:.1f}% of original)"
+            
+            result = {
+                "original_size": orig_size,
+                "compressed_size": final_size,
+                "compression_ratio": ratio,
+                "status": status,
+                "output_path": str(output),
+                **mem
+            }
+            
+            logger.info(f"PDF压缩完成: {result}")
+            return result
+        except Exception as e:
+            logger.error(f"压缩PDF失败: {str(e)}")
+            raise
+    
+    def extract_text(self, pdf_path: str, progress: ProgressCallback = None) -> str:
         """从PDF文件中提取文本
         
         Args:
             pdf_path: PDF文件路径
+            progress: 可选的逐页进度回调
             
         Returns:
             提取的文本内容
@@ -147,14 +240,17 @@ class PdfService:
         try:
             reader = PdfReader(pdf_path)
             text = ""
-            for page in reader.pages:
+            total_pages = len(reader.pages)
+            for i, page in enumerate(reader.pages):
+                _report(progress, i, total_pages)
                 text += (page.extract_text() or "") + "\n"
+            _report(progress, total_pages, total_pages)
             return text.strip()
         except Exception as e:
             logger.error(f"提取PDF文本失败: {str(e)}")
             raise
     
-    def rotate_pdf(self, pdf_path: str, output_path: str, degrees: int, pages: str = ":") -> Dict[str, Any]:
+    def rotate_pdf(self, pdf_path: str, output_path: str, degrees: int, pages: str = ":", progress: ProgressCallback = None) -> Dict[str, Any]:
         """旋转PDF页面
         
         Args:
@@ -162,6 +258,7 @@ class PdfService:
             output_path: 输出PDF文件路径
             degrees: 旋转角度
             pages: 页面范围（如 ":" 表示所有页面，"1-5" 表示1-5页）
+            progress: 可选的逐页进度回调
             
         Returns:
             旋转结果信息
@@ -186,7 +283,9 @@ class PdfService:
                         page_indices.append(int(part)-1)
             
             # 旋转指定页面
+            total_pages = len(reader.pages)
             for i, page in enumerate(reader.pages):
+                _report(progress, i, total_pages)
                 if i in page_indices:
                     page.rotate(degrees)
                 writer.add_page(page)
@@ -210,23 +309,35 @@ class PdfService:
             logger.error(f"旋转PDF页面失败: {str(e)}")
             raise
     
-    def merge_pdfs(self, pdf_paths: List[str], output_path: str) -> Dict[str, Any]:
+    def merge_pdfs(self, pdf_paths: List[str], output_path: str, progress: ProgressCallback = None,
+                   streaming: Optional[bool] = None) -> Dict[str, Any]:
         """合并多个PDF文件
         
         Args:
             pdf_paths: 要合并的PDF文件路径列表
             output_path: 输出PDF文件路径
+            progress: 可选的逐页进度回调（总页数为所有输入文件之和）
+            streaming: 是否流式写出（默认取 PDF_STREAMING_WRITE）；流式模式同一时刻只打开一个输入文件
             
         Returns:
             合并结果信息
         """
+        if streaming is None:
+            streaming = PDF_STREAMING_WRITE
+        if streaming:
+            return self._merge_pdfs_streaming(pdf_paths, output_path, progress)
         try:
             writer = PdfWriter()
+            readers = [PdfReader(pdf_path) for pdf_path in pdf_paths]
+            total_pages = sum(len(reader.pages) for reader in readers)
+            done = 0
             
-            for pdf_path in pdf_paths:
-                reader = PdfReader(pdf_path)
+            for reader in readers:
                 for page in reader.pages:
+                    _report(progress, done, total_pages)
                     writer.add_page(page)
+                    done += 1
+            _report(progress, done, total_pages)
             
             with open(output_path, "wb") as fp:
                 writer.write(fp)
@@ -243,7 +354,38 @@ class PdfService:
             logger.error(f"合并PDF失败: {str(e)}")
             raise
     
-    def split_pdf(self, pdf_path: str, output_dir: str, split_page: int = None, pages_per_file: int = None) -> List[Dict[str, Any]]:
+    def _merge_pdfs_streaming(self, pdf_paths: List[str], output_path: str, progress: ProgressCallback = None) -> Dict[str, Any]:
+        """流式合并：逐个打开输入文件、逐页写出，写完一个文件即释放其读取器"""
+        try:
+            with trace_peak_memory() as mem:
+                # 只解析 xref 和页面树，用于进度总数
+                total_pages = 0
+                for pdf_path in pdf_paths:
+                    with open_reader(pdf_path) as reader:
+                        total_pages += len(reader.pages)
+                
+                tick = _ticker(progress, total_pages)
+                with StreamingPdfWriter(output_path) as writer:
+                    for pdf_path in pdf_paths:
+                        with open_reader(pdf_path) as reader:
+                            writer.add_pages(reader, range(len(reader.pages)), tick)
+                _report(progress, total_pages, total_pages)
+            
+            result = {
+                "output_path": output_path,
+                "merged_files": pdf_paths,
+                "total_pages": writer.page_count,
+                **mem
+            }
+            
+            logger.info(f"PDF合并完成: {result}")
+            return result
+        except Exception as e:
+            logger.error(f"合并PDF失败: {str(e)}")
+            raise
+    
+    def split_pdf(self, pdf_path: str, output_dir: str, split_page: int = None, pages_per_file: int = None,
+                  progress: ProgressCallback = None, streaming: Optional[bool] = None) -> List[Dict[str, Any]]:
         """将PDF文件拆分
         
         Args:
@@ -251,93 +393,78 @@ class PdfService:
             output_dir: 输出目录
             split_page: 拆分位置，如果提供则按此位置拆分为两个文件
             pages_per_file: 每页包含的页数，如果提供则按此页数进行分页
+            progress: 可选的进度回调（按已写出的页数）
+            streaming: 是否流式写出（默认取 PDF_STREAMING_WRITE）
             
         Returns:
             拆分结果信息列表
         """
+        if streaming is None:
+            streaming = PDF_STREAMING_WRITE
         try:
             pdf = Path(pdf_path)
             output = Path(output_dir)
             output.mkdir(exist_ok=True)
             
-            reader = PdfReader(pdf)
-            results = []
-            total_pages = len(reader.pages)
-            
-            if split_page is not None:
-                # 按指定位置拆分
-                if split_page < 1 or split_page >= total_pages:
-                    raise ValueError(f"拆分位置必须在1到{total_pages-1}之间")
-                
-                # 第一个文件：1到split_page页
-                writer1 = PdfWriter()
-                for i in range(split_page):
-                    writer1.add_page(reader.pages[i])
-                output_path1 = output / f"{pdf.stem}_part1_1-{split_page}.pdf"
-                with open(output_path1, "wb") as fp:
-                    writer1.write(fp)
-                results.append({
-                    "pages": f"1-{split_page}",
-                    "path": str(output_path1),
-                    "file_name": output_path1.name
-                })
+            with trace_peak_memory() as mem, _open_pdf(pdf, streaming) as reader:
+                total_pages = len(reader.pages)
+                # 拆分方案：(起始页, 结束页(不含), 输出文件名, 结果信息)
+                parts = []
+                copy_metadata = False
                 
-                # 第二个文件：split_page+1到最后一页
-                writer2 = PdfWriter()
-                for i in range(split_page, total_pages):
-                    writer2.add_page(reader.pages[i])
-                output_path2 = output / f"{pdf.stem}_part2_{split_page+1}-{total_pages}.pdf"
-                with open(output_path2, "wb") as fp:
-                    writer2.write(fp)
-                results.append({
-                    "pages": f"{split_page+1}-{total_pages}",
-                    "path": str(output_path2),
-                    "file_name": output_path2.name
-                })
-            elif pages_per_file is not None:
-                # 按指定页数进行分页
-                if pages_per_file < 1:
-                    raise ValueError(f"每页包含的页数必须大于0")
-                
-                part_number = 1
-                for start_page in range(0, total_pages, pages_per_file):
-                    end_page = min(start_page + pages_per_file, total_pages)
+                if split_page is not None:
+                    # 按指定位置拆分
+                    if split_page < 1 or split_page >= total_pages:
+                        raise ValueError(f"拆分位置必须在1到{total_pages-1}之间")
                     
-                    writer = PdfWriter()
-                    for i in range(start_page, end_page):
-                        writer.add_page(reader.pages[i])
+                    # 第一个文件：1到split_page页；第二个文件：split_page+1到最后一页
+                    parts.append((0, split_page, f"{pdf.stem}_part1_1-{split_page}.pdf",
+                                  {"pages": f"1-{split_page}"}))
+                    parts.append((split_page, total_pages, f"{pdf.stem}_part2_{split_page+1}-{total_pages}.pdf",
+                                  {"pages": f"{split_page+1}-{total_pages}"}))
+                elif pages_per_file is not None:
+                    # 按指定页数进行分页
+                    if pages_per_file < 1:
+                        raise ValueError(f"每页包含的页数必须大于0")
                     
                     # 保留元数据
-                    if reader.metadata:
-                        writer.add_metadata(reader.metadata)
-                    
-                    output_path = output / f"{pdf.stem}_part{part_number}_{start_page+1}-{end_page}.pdf"
-                    with open(output_path, "wb") as fp:
-                        writer.write(fp)
-                    
-                    results.append({
-                        "pages": f"{start_page+1}-{end_page}",
-                        "path": str(output_path),
-                        "file_name": output_path.name
-                    })
-                    part_number += 1
-            else:
-                # 按页拆分
-                for i, page in enumerate(reader.pages):
-                    writer = PdfWriter()
-                    writer.add_page(page)
-                    
-                    output_path = output / f"{pdf.stem}_page_{i+1}.pdf"
-                    with open(output_path, "wb") as fp:
-                        writer.write(fp)
+                    copy_metadata = True
+                    for part_number, start_page in enumerate(range(0, total_pages, pages_per_file), start=1):
+                        end_page = min(start_page + pages_per_file, total_pages)
+                        parts.append((start_page, end_page, f"{pdf.stem}_part{part_number}_{start_page+1}-{end_page}.pdf",
+                                      {"pages": f"{start_page+1}-{end_page}"}))
+                else:
+                    # 按页拆分
+                    for i in range(total_pages):
+                        parts.append((i, i + 1, f"{pdf.stem}_page_{i+1}.pdf", {"page": i+1}))
+                
+                tick = _ticker(progress, total_pages)
+                results = []
+                for start_page, end_page, file_name, info in parts:
+                    output_path = output / file_name
+                    if streaming:
+                        with StreamingPdfWriter(output_path) as writer:
+                            if copy_metadata:
+                                writer.add_metadata(reader.metadata)
+                            writer.add_pages(reader, range(start_page, end_page), tick)
+                    else:
+                        writer = PdfWriter()
+                        for i in range(start_page, end_page):
+                            tick()
+                            writer.add_page(reader.pages[i])
+                        if copy_metadata and reader.metadata:
+                            writer.add_metadata(reader.metadata)
+                        with open(output_path, "wb") as fp:
+                            writer.write(fp)
                     
                     results.append({
-                        "page": i+1,
+                        **info,
                         "path": str(output_path),
                         "file_name": output_path.name
                     })
             
-            logger.info(f"PDF拆分完成，共生成 {len(results)} 个文件")
+            _report(progress, total_pages, total_pages)
+            logger.info(f"PDF拆分完成，共生成 {len(results)} 个文件" + (f"，峰值内存 {mem['peak_memory_mb']}MB" if mem else ""))
             return results
         except Exception as e:
             logger.error(f"拆分PDF失败: {str(e)}")
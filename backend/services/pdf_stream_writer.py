@@ -0,0 +1,247 @@
+"""增量写出的PDF写入器：逐页复制对象并立即写盘，内存占用与单页对象图相关，而非整份文档"""
+
+import os
+import zlib
+import tracemalloc
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from pypdf import PdfReader
+from pypdf.generic import (
+    ArrayObject,
+    DictionaryObject,
+    IndirectObject,
+    NameObject,
+    StreamObject,
+)
+
+# 流式写出时，未压缩的流（内容流、字体等）低于该字节数时不做 Flate 压缩
+PDF_STREAM_COMPRESS_MIN_BYTES = int(os.getenv("PDF_STREAM_COMPRESS_MIN_BYTES", "256"))
+
+
+class StreamingPdfWriter:
+    """
+    与 PdfWriter 不同，对象不在内存中累积：
+
+    - 每添加一页，就沿引用复制该页可达的对象并立即写入输出文件，只保留 xref 偏移量；
+    - 同一输入文件中被多页共享的对象（字体、图片）只写一次（按输入对象号去重）；
+    - 写完一页后清空 PdfReader 的已解析对象缓存，已写出的对象随之释放；
+    - 先写到 .tmp 再原子替换，失败时不会留下半个文件。
+
+    页面从原页面树中摘出：/Parent 指向新的页面树，指向未被复制的页面的引用（如注释中的跳转目标）置为 null。
+    """
+
+    def __init__(self, output_path: str, compress: bool = False):
+        self.output_path = str(output_path)
+        self.compress = compress
+        self._tmp_path = self.output_path + ".tmp"
+        self._fp = open(self._tmp_path, "wb")
+        self._fp.write(b"%PDF-1.7\n%\xe2\xe3\xcf\xd3\n")
+        self._offsets: List[Optional[int]] = [None]  # 对象号 -> 文件偏移，0 号不用
+        self._pages_id = self._reserve()
+        self._kids: List[int] = []
+        self._info: Optional[DictionaryObject] = None
+        # 当前输入文件的对象映射：(输入对象号, generation) -> 输出对象号
+        self._id_map: Dict[Tuple[int, int], int] = {}
+        self._page_refs: Dict[Tuple[int, int], int] = {}
+        self._pending: List[Tuple[int, IndirectObject]] = []
+
+    # ---------- 对象编号 ----------
+    def _reserve(self) -> int:
+        self._offsets.append(None)
+        return len(self._offsets) - 1
+
+    def _ref(self, ref: IndirectObject) -> Optional[int]:
+        key = (ref.idnum, ref.generation)
+        num = self._id_map.get(key) or self._page_refs.get(key)
+        if num is not None:
+            return num
+        # 不跟随到页面树节点，也不把未选中的页面拖进来
+        target = ref.get_object()
+        if isinstance(target, DictionaryObject) and target.get("/Type") in ("/Page", "/Pages"):
+            return None
+        num = self._id_map[key] = self._reserve()
+        self._pending.append((num, ref))
+        return num
+
+    # ---------- 序列化 ----------
+    def _serialize(self, obj, out, page: bool = False):
+        if isinstance(obj, IndirectObject):
+            num = self._ref(obj)
+            if num is None:
+                out.write(b"null")
+            else:
+                out.write(b"%d 0 R" % num)
+        elif isinstance(obj, StreamObject):
+            self._serialize_stream(obj, out)
+        elif isinstance(obj, DictionaryObject):
+            out.write(b"<<")
+            for key, value in obj.items():
+                out.write(b"\n")
+                NameObject(key).write_to_stream(out)
+                out.write(b" ")
+                if page and key == "/Parent":
+                    out.write(b"%d 0 R" % self._pages_id)
+                else:
+                    self._serialize(value, out)
+            out.write(b"\n>>")
+        elif isinstance(obj, ArrayObject):
+            out.write(b"[")
+            for i, item in enumerate(obj):
+                if i:
+                    out.write(b" ")
+                self._serialize(item, out)
+            out.write(b"]")
+        elif obj is None:
+            out.write(b"null")
+        else:
+            obj.write_to_stream(out)
+
+    def _serialize_stream(self, obj: StreamObject, out):
+        # _data 是文件中的原始（已解密）字节，过滤器保持不变；/Length 按实际长度重写
+        data = obj._data
+        deflated = False
+        if self.compress and "/Filter" not in obj and len(data) >= PDF_STREAM_COMPRESS_MIN_BYTES:
+            packed = zlib.compress(data)
+            if len(packed) < len(data):
+                data, deflated = packed, True
+        out.write(b"<<")
+        for key, value in obj.items():
+            if key == "/Length":
+                continue
+            out.write(b"\n")
+            NameObject(key).write_to_stream(out)
+            out.write(b" ")
+            self._serialize(value, out)
+        if deflated:
+            out.write(b"\n/Filter /FlateDecode")
+        out.write(b"\n/Length %d\n>>\nstream\n" % len(data))
+        out.write(data)
+        out.write(b"\nendstream")
+
+    def _write_object(self, num: int, obj, page: bool = False):
+        self._offsets[num] = self._fp.tell()
+        self._fp.write(b"%d 0 obj\n" % num)
+        self._serialize(obj, self._fp, page=page)
+        self._fp.write(b"\nendobj\n")
+
+    def _drain(self):
+        while self._pending:
+            num, ref = self._pending.pop()
+            self._write_object(num, ref.get_object())
+
+    # ---------- 公共接口 ----------
+    def add_pages(self, reader: PdfReader, page_indices: Iterable[int],
+                  progress: Optional[Callable[[], None]] = None):
+        """复制 reader 中的指定页（0 基）。调用方在其后即可关闭/丢弃 reader"""
+        indices = list(page_indices)
+        self._id_map = {}
+        self._page_refs = {}
+        pages = reader.pages
+        # 先为本次复制的所有页面分配对象号，页面之间的跳转链接可以互相引用
+        for i in indices:
+            ref = pages[i].indirect_reference
+            num = self._reserve()
+            self._kids.append(num)
+            if ref is not None:
+                self._page_refs[(ref.idnum, ref.generation)] = num
+        first = len(self._kids) - len(indices)
+        for n, i in enumerate(indices):
+            if progress is not None:
+                progress()
+            self._write_object(self._kids[first + n], pages[i], page=True)
+            self._drain()
+            # 已写出的对象无需保留；共享对象靠 _id_map 去重，再次遇到时不会重复解析
+            reader.resolved_objects.clear()
+        self._id_map = {}
+        self._page_refs = {}
+
+    def add_metadata(self, metadata):
+        if metadata:
+            # 只保留标量（标题、作者、日期等）；DictionaryObject 的 [] 会解析间接引用
+            self._info = DictionaryObject({
+                NameObject(k): metadata[k] for k in metadata
+                if not isinstance(metadata[k], (DictionaryObject, ArrayObject))
+            })
+
+    @property
+    def page_count(self) -> int:
+        return len(self._kids)
+
+    def close(self) -> str:
+        """写页面树、目录、xref 和 trailer，然后原子替换到目标路径"""
+        fp = self._fp
+        self._offsets[self._pages_id] = fp.tell()
+        kids = b" ".join(b"%d 0 R" % k for k in self._kids)
+        fp.write(b"%d 0 obj\n<< /Type /Pages /Kids [%s] /Count %d >>\nendobj\n"
+                 % (self._pages_id, kids, len(self._kids)))
+        catalog_id = self._reserve()
+        self._offsets[catalog_id] = fp.tell()
+        fp.write(b"%d 0 obj\n<< /Type /Catalog /Pages %d 0 R >>\nendobj\n" % (catalog_id, self._pages_id))
+        info_id = None
+        if self._info:
+            info_id = self._reserve()
+            self._write_object(info_id, self._info)
+
+        xref = fp.tell()
+        fp.write(b"xref\n0 %d\n0000000000 65535 f \n" % len(self._offsets))
+        for off in self._offsets[1:]:
+            fp.write(b"%010d 00000 n \n" % off)
+        fp.write(b"trailer\n<< /Size %d /Root %d 0 R" % (len(self._offsets), catalog_id))
+        if info_id is not None:
+            fp.write(b" /Info %d 0 R" % info_id)
+        fp.write(b" >>\nstartxref\n%d\n%%%%EOF\n" % xref)
+        fp.close()
+        os.replace(self._tmp_path, self.output_path)
+        return self.output_path
+
+    def abort(self):
+        if not self._fp.closed:
+            self._fp.close()
+        if os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+@contextmanager
+def open_reader(pdf_path: str):
+    """按文件句柄打开 PdfReader（传路径时 pypdf 会把整个文件读进内存）"""
+    fh = open(pdf_path, "rb")
+    try:
+        yield PdfReader(fh)
+    finally:
+        fh.close()
+
+
+# ======================
+# 峰值内存统计（可选）
+# ======================
+# PDF_TRACE_MEMORY=1 时用 tracemalloc 统计 Python 堆峰值并写入结果（会明显变慢，仅用于排查/压测）。
+# tracemalloc 是进程级的，多个任务并发时数值包含其它任务的分配。
+PDF_TRACE_MEMORY = os.getenv("PDF_TRACE_MEMORY", "0").lower() in ("1", "true", "yes")
+
+
+@contextmanager
+def trace_peak_memory(enabled: bool = PDF_TRACE_MEMORY):
+    stats: Dict[str, float] = {}
+    if not enabled:
+        yield stats
+        return
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    try:
+        yield stats
+    finally:
+        stats["peak_memory_mb"] = round(tracemalloc.get_traced_memory()[1] / 1024 / 1024, 2)
+        if started:
+            tracemalloc.stop()
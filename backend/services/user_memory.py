@@ -0,0 +1,317 @@
+import os
+import time
+import uuid
+import logging
+import threading
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from database import SessionLocal
+from models.teacher_rule import TeacherRule
+from services.answer_cache import answer_cache
+from services.embedding_service import embedding_service, get_embedding_model_id
+
+logger = logging.getLogger(__name__)
+
+# Corrections with a question this similar to an existing rule are merged into it
+MERGE_THRESHOLD = 0.95
+# Rules re-encoded per model call when restoring rules without a (current) stored embedding
+TEACHER_RULE_ENCODE_BATCH = int(os.getenv("TEACHER_RULE_ENCODE_BATCH", "64"))
+
+
+class FileMemories:
+    """
+    Teacher-mode rules of one file as a contiguous, L2-normalized float32 matrix.
+
+    Row i of `matrix` belongs to ids[i] / questions[i] / corrections[i] / timestamps[i].
+    The buffer grows by doubling; removal moves the last row into the freed slot, so
+    add / delete / merge are O(dim) row updates and search is one matrix-vector product.
+    """
+
+    def __init__(self, dim: int, capacity: int = 16):
+        self.dim = dim
+        self._buf = np.zeros((capacity, dim), dtype="float32")
+        self.size = 0
+        self.ids: List[str] = []
+        self.questions: List[str] = []
+        self.corrections: List[str] = []
+        self.timestamps: List[float] = []
+        self._rows: Dict[str, int] = {}  # rule id -> row
+
+    @property
+    def matrix(self) -> np.ndarray:
+        return self._buf[:self.size]
+
+    def index_of(self, rule_id: str) -> int:
+        return self._rows.get(rule_id, -1)
+
+    def append(self, rule_id: str, vector: np.ndarray, question: str, correction: str, timestamp: float):
+        if self.size == len(self._buf):
+            grown = np.zeros((2 * len(self._buf), self.dim), dtype="float32")
+            grown[:self.size] = self._buf[:self.size]
+            self._buf = grown
+        self._buf[self.size] = vector
+        self._rows[rule_id] = self.size
+        self.size += 1
+        self.ids.append(rule_id)
+        self.questions.append(question)
+        self.corrections.append(correction)
+        self.timestamps.append(timestamp)
+
+    def remove(self, i: int):
+        last = self.size - 1
+        del self._rows[self.ids[i]]
+        if i != last:
+            self._buf[i] = self._buf[last]
+            for column in (self.ids, self.questions, self.corrections, self.timestamps):
+                column[i] = column[last]
+            self._rows[self.ids[i]] = i
+        for column in (self.ids, self.questions, self.corrections, self.timestamps):
+            column.pop()
+        self.size -= 1
+
+    def scores(self, q_vec: np.ndarray) -> np.ndarray:
+        return self.matrix @ q_vec
+
+    def top_k(self, q_vec: np.ndarray, k: int, threshold: float):
+        """(row, score) pairs of the best k rows scoring >= threshold, best first"""
+        if self.size == 0:
+            return []
+        sims = self.scores(q_vec)
+        k = min(k, self.size)
+        rows = np.argpartition(-sims, k - 1)[:k] if k < self.size else np.arange(self.size)
+        rows = rows[np.argsort(-sims[rows])]
+        return [(int(r), float(sims[r])) for r in rows if sims[r] >= threshold]
+
+
+def _normalize(vector) -> Optional[np.ndarray]:
+    try:
+        vector = np.asarray(vector, dtype="float32").reshape(-1)
+    except (TypeError, ValueError):
+        return None
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+
+class UserMemory:
+    """Semantic Teacher Mode: per-file corrections recalled by question similarity"""
+
+    def __init__(self):
+        # Key: file_id, Value: FileMemories
+        self.files: Dict[str, FileMemories] = {}
+        self._lock = threading.Lock()
+
+    def _file(self, file_id: str, dim: int) -> Optional[FileMemories]:
+        memories = self.files.get(file_id)
+        if memories is None:
+            memories = self.files[file_id] = FileMemories(dim)
+        elif memories.dim != dim:
+            logger.warning(f"🧠 [Teacher Mode] Vector dim {dim} != {memories.dim} for File {file_id}, skipped")
+            return None
+        return memories
+
+    def load_rule(self, file_id: str, rule_id: str, question: str, correction: str, vector, timestamp: float = None):
+        """Add an already-persisted rule (startup restore); no DB write"""
+        vector = _normalize(vector)
+        if vector is None:
+            return False
+        with self._lock:
+            memories = self._file(file_id, len(vector))
+            if memories is None or memories.index_of(rule_id) >= 0:
+                return False
+            memories.append(rule_id, vector, question, correction, timestamp or time.time())
+        return True
+
+    def restore_from_db(self, session_factory=SessionLocal, batch_size: int = TEACHER_RULE_ENCODE_BATCH) -> int:
+        """
+        Load every TeacherRule with one query (blocking; run in a worker thread).
+
+        Rows whose stored embedding came from the current model are loaded as-is; missing or
+        stale ones are encoded batch_size at a time and written back. Returns the number of
+        rows in the table.
+        """
+        model_id = get_embedding_model_id()
+        db = session_factory()
+        try:
+            rows = db.query(TeacherRule.id, TeacherRule.file_id, TeacherRule.question, TeacherRule.correction,
+                            TeacherRule.created_at, TeacherRule.embedding, TeacherRule.embedding_model).all()
+            rows = [r for r in rows if r.file_id and r.question and r.correction]
+            loaded, stale = 0, []
+            for r in rows:
+                if r.embedding and model_id and r.embedding_model == model_id:
+                    vector = np.frombuffer(r.embedding, dtype="float32")
+                    if self.load_rule(r.file_id, r.id, r.question, r.correction, vector,
+                                      r.created_at.timestamp() if r.created_at else None):
+                        loaded += 1
+                else:
+                    stale.append(r)
+            logger.info(f"🧠 [Teacher Mode] Loaded {loaded} stored rule embeddings, {len(stale)} to encode")
+            if stale and model_id is None:
+                logger.warning(f"🧠 [Teacher Mode] Embedding model unavailable, {len(stale)} rules not loaded")
+                return len(rows)
+
+            for start in range(0, len(stale), batch_size):
+                batch = stale[start:start + batch_size]
+                vectors = embedding_service.encode_sync([r.question for r in batch])
+                updates = []
+                for r, vector in zip(batch, vectors):
+                    vector = _normalize(vector)
+                    self.load_rule(r.file_id, r.id, r.question, r.correction, vector,
+                                   r.created_at.timestamp() if r.created_at else None)
+                    updates.append({"id": r.id, "embedding": vector.tobytes(), "embedding_model": model_id})
+                db.bulk_update_mappings(TeacherRule, updates)
+                db.commit()
+            if stale:
+                logger.info(f"🧠 [Teacher Mode] Encoded and saved {len(stale)} rule embeddings ({model_id})")
+            return len(rows)
+        finally:
+            db.close()
+
+    def add_memory(self, file_id, question, correction, vector=None):
+        """Add a correction to semantic memory for a specific file.
+        Async callers should pass `vector` from `await embedding_service.encode(question)`."""
+        if vector is None and embedding_service.available:
+            vector = embedding_service.encode_sync([question])[0]
+        vector = _normalize(vector) if vector is not None else None
+        if vector is None:
+            return
+
+        with self._lock:
+            memories = self._file(file_id, len(vector))
+            if memories is None:
+                return
+            # Check for existing similar memory (Threshold > 0.95)
+            best = memories.top_k(vector, 1, threshold=-1.0)
+            if best and best[0][1] > MERGE_THRESHOLD:
+                row, best_sim = best[0]
+                rule_id = memories.ids[row]
+                current_text = memories.corrections[row]
+                memories.timestamps[row] = time.time()
+                new_correction = None
+                if correction not in current_text:
+                    new_correction = memories.corrections[row] = current_text + "\n" + correction
+            else:
+                row, best_sim = -1, None
+                rule_id = str(uuid.uuid4())
+                memories.append(rule_id, vector, question, correction, time.time())
+
+        if row >= 0:
+            if new_correction is None:
+                logger.info(f"🧠 [Teacher Mode] SKIPPED duplicate concept (Sim: {best_sim:.2f})")
+                return
+            # [DB] Update existing rule
+            try:
+                db = SessionLocal()
+                rule = db.query(TeacherRule).filter(TeacherRule.id == rule_id).first()
+                if rule:
+                    rule.correction = new_correction
+                    db.commit()
+                db.close()
+            except Exception as e:
+                logger.error(f"Failed to update rule in DB: {e}")
+            logger.info(f"🧠 [Teacher Mode] MERGED concept (Sim: {best_sim:.2f}) for File {file_id}: {question} -> {new_correction}")
+        else:
+            # [DB] Create new rule
+            try:
+                db = SessionLocal()
+                db.add(TeacherRule(
+                    id=rule_id,
+                    file_id=file_id,
+                    question=question,
+                    correction=correction,
+                    embedding=vector.tobytes(),
+                    embedding_model=get_embedding_model_id()
+                ))
+                db.commit()
+                db.close()
+            except Exception as e:
+                logger.error(f"Failed to save rule to DB: {e}")
+            logger.info(f"🧠 [Teacher Mode] Learned new concept for File {file_id}: {question} -> {correction}")
+        answer_cache.invalidate(file_id, reason="rules")
+
+    def remove_rule(self, file_id: str, rule_id: str) -> bool:
+        """Drop a rule from memory (the caller deletes the TeacherRule row)"""
+        with self._lock:
+            memories = self.files.get(file_id)
+            row = memories.index_of(rule_id) if memories is not None else -1
+            if row < 0:
+                return False
+            memories.remove(row)
+            if memories.size == 0:
+                del self.files[file_id]
+        return True
+
+    def count(self, file_id: Optional[str] = None) -> int:
+        if file_id is not None:
+            memories = self.files.get(file_id)
+            return memories.size if memories is not None else 0
+        return sum(m.size for m in self.files.values())
+
+    def items(self) -> List[dict]:
+        with self._lock:
+            return [
+                {
+                    "id": m.ids[i],
+                    "file_id": fid,
+                    "question": m.questions[i],
+                    "correction": m.corrections[i],
+                    "timestamp": m.timestamps[i],
+                }
+                for fid, m in self.files.items() for i in range(m.size)
+            ]
+
+    def score_all(self, q_vec, file_id: Optional[str] = None) -> List[dict]:
+        """Similarity of q_vec to every rule (optionally of one file), best first"""
+        q_vec = _normalize(q_vec)
+        scores = []
+        with self._lock:
+            for fid, m in self.files.items():
+                if (file_id and fid != file_id) or m.dim != len(q_vec):
+                    continue
+                sims = m.scores(q_vec)
+                scores.extend({
+                    "file_id": fid,
+                    "question": m.questions[i],
+                    "correction": m.corrections[i],
+                    "score": float(sims[i]),
+                } for i in range(m.size))
+        return sorted(scores, key=lambda x: x["score"], reverse=True)
+
+    # Optimized threshold for better precision
+    def search_memory(self, file_id, question, threshold=0.62, q_vec=None, top_k=3):
+        """Search for relevant corrections within a specific file.
+        Async callers should pass `q_vec` from `await embedding_service.encode(question)`."""
+        memories = self.files.get(file_id)
+        if memories is None or memories.size == 0:
+            logger.debug(f"🧠 [Memory Search] Skipped: No memories for File {file_id}")
+            return None
+
+        if q_vec is None:
+            if not embedding_service.available:
+                logger.error("🧠 [Memory Search] Aborted: Embedding model not loaded!")
+                return None
+            q_vec = embedding_service.encode_sync([question])[0]
+        q_vec = _normalize(q_vec)
+
+        with self._lock:
+            if memories.dim != len(q_vec):
+                return None
+            matches = [(memories.corrections[row], score) for row, score in memories.top_k(q_vec, top_k, threshold)]
+
+        if matches:
+            seen_corrections = set()
+            final_corrections = []
+            for correction, _ in matches:
+                for part in correction.split('\n'):
+                    part = part.strip()
+                    if part and part not in seen_corrections:
+                        seen_corrections.add(part)
+                        final_corrections.append(part)
+
+            combined_correction = "\n".join(final_corrections)
+            logger.info(f"🧠 [Teacher Mode] Recall triggered (Top Score: {matches[0][1]:.4f}). Combined {len(final_corrections)} facts.")
+            return {"correction": combined_correction}
+
+        logger.info(f"🧠 [Teacher Mode] No match found among {memories.size} rules for File {file_id}")
+        return None
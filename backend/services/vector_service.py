@@ -1,6 +1,9 @@
 
 import os
+import json
 import logging
+import threading
+from collections import OrderedDict
 from typing import List, Dict, Any, Optional
 import numpy as np
 
@@ -9,52 +12,139 @@ import numpy as np
 # So project root is ../../
 PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+# Per-file FAISS indexes are persisted here as {file_id}.faiss + {file_id}.meta.json
+INDEX_DIR = os.getenv("VECTOR_INDEX_DIR") or os.path.join(PROJECT_ROOT, "uploads", "index")
+# Byte budget for indexes kept resident in memory (LRU eviction beyond this; mmapped vectors are not counted)
+VECTOR_CACHE_MAX_BYTES = int(os.getenv("VECTOR_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+# Per-file index type: "flat" (exact IndexFlatIP) or "hnsw" (IndexHNSWFlat, inner product)
+VECTOR_INDEX_BACKEND = os.getenv("VECTOR_INDEX_BACKEND", "flat").lower()
+# Chunks whose cosine similarity to the question is below this are not sent to the LLM
+RAG_MIN_SIMILARITY = float(os.getenv("RAG_MIN_SIMILARITY", "0.35"))
+
 logger = logging.getLogger(__name__)
 
 # Import vector retrieval dependencies
+# (the embedding model itself is loaded by services/embedding_service.py)
+from services.embedding_service import (embedding_service, get_embedding_model, get_embedding_model_id,
+                                       loaded_embedding_model, normalize_rows)
+
 try:
-    from sentence_transformers import SentenceTransformer
     import faiss
 except ImportError:
-    # Silent fail or log, main.py will handle the error if missing
-    logger.warning("RAG dependencies not found (sentence-transformers, faiss-cpu)")
-    SentenceTransformer = None
+    logger.warning("RAG dependency not found (faiss-cpu)")
     faiss = None
 
 # ======================
 # Vector Store Class
 # ======================
+def new_ip_index(dim: int, backend: str = VECTOR_INDEX_BACKEND):
+    """Inner-product index over unit vectors, so scores are cosine similarities"""
+    if backend == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, 32, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efSearch = 64
+        return index
+    return faiss.IndexFlatIP(dim)
+
 class VectorStore:
-    # Class-level variables for singleton model
-    _shared_model = None
-    _model_path = None
-    
     def __init__(self):
-        try:
-            if SentenceTransformer is None:
-                raise ImportError("Missing dependencies")
-                
-            local_model_path = os.path.join(PROJECT_ROOT, "models/bge-small-zh")
-            # Load model only if not loaded or path changed
-            if VectorStore._shared_model is None or VectorStore._model_path != local_model_path:
-                VectorStore._model_path = local_model_path
-                # Check if model exists locally, otherwise it might download (or fail if offline)
-                # But sentence_transformers usually handles this.
-                # If we want to force local:
-                # if not os.path.exists(local_model_path): ...
-                
-                VectorStore._shared_model = SentenceTransformer(local_model_path)
-                logger.info(f"✅ Vector model loaded: {local_model_path}")
-            self.model = VectorStore._shared_model
-        except Exception as e:
-            logger.error(f"❌ Vector model load failed: {str(e)}")
-            # Fallback or raise? For now, we allow init but define model as None
-            self.model = None
-            
         self.index = None
         self.chunks = []
         self.metadata = [] # [NEW] Store metadata (filename, page, etc.)
-        self.dim = 512
+        # Dimension comes from the loaded model (bge-small-zh: 512), never hardcoded. Stores are
+        # created on the event loop, so only look at an already loaded model here; add_texts()
+        # fills dim / model_id once vectors exist
+        model = loaded_embedding_model()
+        self.dim = model.get_sentence_embedding_dimension() if model is not None else None
+        self.model_id = get_embedding_model_id() if model is not None else None
+        # Pages are appended while the upload is still being parsed, and /ask may search meanwhile
+        self._lock = threading.RLock()
+        # Vectors served from a memory-mapped index file (page cache, not heap); see nbytes
+        self._mmapped_vectors = 0
+
+    @property
+    def model(self):
+        # The SentenceTransformer is a process-wide singleton owned by embedding_service;
+        # resolved on each use, so stores created while it was unavailable pick it up once loaded
+        return get_embedding_model()
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Approximate resident size (heap vectors + chunk text), used for the LRU byte budget.
+        Vectors of a memory-mapped index are not counted: the OS pages them in and out on
+        its own, so evicting the store would free almost nothing.
+        """
+        vector_bytes = 0
+        if self.index is not None:
+            vector_bytes = max(self.index.ntotal - self._mmapped_vectors, 0) * self.index.d * 4
+        text_bytes = sum(len(c) for c in self.chunks) * 2
+        return vector_bytes + text_bytes
+
+    def save(self, index_path: str, meta_path: str):
+        """Persist the FAISS index and its chunk/metadata sidecar (atomic rename)"""
+        if self.index is None or faiss is None:
+            return
+        tmp_index = index_path + ".tmp"
+        tmp_meta = meta_path + ".tmp"
+        with self._lock:
+            faiss.write_index(self.index, tmp_index)
+            with open(tmp_meta, "w", encoding="utf-8") as f:
+                json.dump({
+                    "dim": self.dim,
+                    "metric": "ip",
+                    "model": self.model_id,
+                    "chunks": self.chunks,
+                    "metadata": self.metadata
+                }, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp_index, index_path)
+        os.replace(tmp_meta, meta_path)
+
+    @classmethod
+    def load(cls, index_path: str, meta_path: str) -> "VectorStore":
+        """Load a persisted store, memory-mapping the index when FAISS supports it"""
+        vs = cls()
+        mmap_flag = getattr(faiss, "IO_FLAG_MMAP_IFC", None) or getattr(faiss, "IO_FLAG_MMAP", None)
+        try:
+            vs.index = faiss.read_index(index_path, mmap_flag) if mmap_flag else faiss.read_index(index_path)
+            if mmap_flag:
+                vs._mmapped_vectors = vs.index.ntotal
+        except Exception:
+            # Some index types / platforms cannot be mmapped; read it fully instead
+            vs.index = faiss.read_index(index_path)
+        with open(meta_path, "r", encoding="utf-8") as f:
+            sidecar = json.load(f)
+        vs.dim = vs.index.d
+        vs.chunks = sidecar.get("chunks", [])
+        vs.metadata = sidecar.get("metadata", [{} for _ in vs.chunks])
+        vs.stale = False
+        current_model = get_embedding_model_id()
+        if current_model and sidecar.get("model") and sidecar["model"] != current_model:
+            # Embedded by a different model: vectors are meaningless now, re-embed from the stored chunks
+            logger.warning(f"Index {index_path} was built with {sidecar['model']}, re-embedding with {current_model}")
+            vs.reembed()
+            vs.stale = True
+        elif sidecar.get("metric") != "ip" or vs.index.metric_type != faiss.METRIC_INNER_PRODUCT:
+            # Legacy IndexFlatL2 from raw embeddings: normalize the stored vectors, no re-embedding needed
+            vectors = vs.index.reconstruct_n(0, vs.index.ntotal) if vs.index.ntotal else np.zeros((0, vs.dim), "float32")
+            vs.index = new_ip_index(vs.dim)
+            vs._mmapped_vectors = 0
+            if len(vectors):
+                vs.index.add(normalize_rows(vectors))
+            vs.stale = True
+        if vs.stale:
+            vs.model_id = current_model or sidecar.get("model")
+        return vs
+
+    def reembed(self):
+        """Rebuild the index from self.chunks with the current model"""
+        if self.model is None:
+            return
+        self.dim = self.model.get_sentence_embedding_dimension()
+        self.index = new_ip_index(self.dim)
+        self._mmapped_vectors = 0
+        if self.chunks:
+            self.index.add(normalize_rows(self.model.encode(self.chunks, convert_to_numpy=True)))
+        self.model_id = get_embedding_model_id()
 
     def add_texts(self, texts: list, metadatas: Optional[List[Dict[str, Any]]] = None):
         """
@@ -67,15 +157,18 @@ class VectorStore:
             return
         
         try:
-            embeddings = self.model.encode(texts, convert_to_numpy=True)
-            if self.index is None:
-                if faiss:
-                    self.index = faiss.IndexFlatL2(self.dim)
-                else:
-                    logger.error("FAISS not available")
-                    return
-            
-            if self.index:
+            # Encode outside the lock so searches are not blocked by the model
+            embeddings = normalize_rows(self.model.encode(texts, convert_to_numpy=True))
+            with self._lock:
+                if self.index is None:
+                    if faiss:
+                        self.dim = embeddings.shape[1]
+                        self.model_id = self.model_id or get_embedding_model_id()
+                        self.index = new_ip_index(self.dim)
+                    else:
+                        logger.error("FAISS not available")
+                        return
+                
                 self.index.add(embeddings)
                 self.chunks.extend(texts)
                 
@@ -89,36 +182,475 @@ class VectorStore:
         except Exception as e:
             logger.error(f"Failed to add vectors: {e}")
 
-    def search(self, query: str, k=3):
+    def embed_query(self, query: str) -> Optional[np.ndarray]:
+        """Encode a query once so it can be reused across several indexes. Shape (1, dim)."""
+        # Goes through the shared LRU cache; async callers should prefer
+        # `await embedding_service.encode(query)` to stay off the event loop
+        return embedding_service.encode_sync([query])
+
+    def search(self, query: str, k=3, min_score: Optional[float] = None):
         """
         Returns list of dicts: {'text': str, 'metadata': dict, 'score': float}
+        score is the cosine similarity (higher is better).
         """
         if self.index is None or len(self.chunks) == 0 or self.model is None:
             return []
+        return self.search_by_vector(self.embed_query(query), k=k, min_score=min_score)
+
+    def search_by_vector(self, query_vec: np.ndarray, k=3, min_score: Optional[float] = None):
+        """Same as search() but with a pre-computed query embedding"""
+        if self.index is None or len(self.chunks) == 0 or query_vec is None:
+            return []
         
         try:
-            query_vec = self.model.encode([query], convert_to_numpy=True)
-            distances, indices = self.index.search(query_vec, min(k, len(self.chunks)))
-            
-            # FAISS returns L2 distance (lower is better), but we often want similarity.
-            # Here we just iterate the results.
-            results = []
-            for i, idx in enumerate(indices[0]):
-                if idx < 0 or idx >= len(self.chunks): continue
+            query_vec = normalize_rows(np.asarray(query_vec, dtype="float32").reshape(1, -1))
+            if query_vec.shape[1] != self.index.d:
+                logger.error(f"Query dim {query_vec.shape[1]} != index dim {self.index.d}")
+                return []
+            with self._lock:
+                scores, indices = self.index.search(query_vec, min(k, len(self.chunks)))
                 
-                results.append({
-                    "text": self.chunks[idx],
-                    "metadata": self.metadata[idx] if idx < len(self.metadata) else {},
-                    "score": float(distances[0][i])
-                })
+                results = []
+                for i, idx in enumerate(indices[0]):
+                    if idx < 0 or idx >= len(self.chunks): continue
+                    score = float(scores[0][i])
+                    if min_score is not None and score < min_score:
+                        continue
+                    
+                    results.append({
+                        "text": self.chunks[idx],
+                        "metadata": self.metadata[idx] if idx < len(self.metadata) else {},
+                        "score": score
+                    })
             return results
         except Exception as e:
             logger.error(f"Vector search failed: {e}")
             return []
 
+# ======================
+# Corpus-wide ANN Index
+# ======================
+GLOBAL_INDEX_HNSW_M = int(os.getenv("GLOBAL_INDEX_HNSW_M", "32"))
+GLOBAL_INDEX_EF_SEARCH = int(os.getenv("GLOBAL_INDEX_EF_SEARCH", "64"))
+# Rebuild the HNSW graph once this fraction of its entries are tombstoned
+GLOBAL_INDEX_REBUILD_RATIO = float(os.getenv("GLOBAL_INDEX_REBUILD_RATIO", "0.3"))
+# Added vectors are written to disk at most once per this many seconds (0 = on every change)
+GLOBAL_INDEX_SAVE_DELAY = float(os.getenv("GLOBAL_INDEX_SAVE_DELAY", "30"))
+
+class GlobalVectorIndex:
+    """
+    One HNSW index over the chunks of every file.
+
+    Chunk ids are the HNSW insertion order. For each id we keep the owning
+    file_id and the chunk's position inside that file's VectorStore, so text
+    and metadata are still served by the per-file sidecars. HNSW cannot delete
+    in place: removed files are tombstoned, filtered out at query time through
+    an IDSelector, and compacted away by a rebuild once they pile up.
+
+    Rewriting the whole graph on every added file is expensive, so additions are
+    persisted by a debounced save (schedule_save / flush, also run on shutdown).
+    Files added after the last save are re-added from their per-file indexes by
+    the reconcile on the next load.
+    """
+
+    def __init__(self, index_dir: str = INDEX_DIR):
+        self.index_path = os.path.join(index_dir, "_global.faiss")
+        self.ids_path = os.path.join(index_dir, "_global.ids.npz")
+        self.index = None
+        self.dim = None
+        self.chunk_file: List[str] = []  # chunk id -> file_id
+        self.chunk_pos: List[int] = []   # chunk id -> row in the file's VectorStore
+        self.file_chunks: Dict[str, List[int]] = {}
+        self.deleted: set = set()
+        self.loaded = False
+        self._dirty = False  # in-memory graph has changes not yet written
+        self._save_timer = None
+        self._lock = threading.RLock()
+
+    def _new_index(self, dim: int):
+        index = faiss.IndexHNSWFlat(dim, GLOBAL_INDEX_HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efSearch = GLOBAL_INDEX_EF_SEARCH
+        return index
+
+    def load(self):
+        """Read the persisted index; returns False if there is none (or it is unreadable)"""
+        with self._lock:
+            self.loaded = True
+            if faiss is None or not (os.path.exists(self.index_path) and os.path.exists(self.ids_path)):
+                return False
+            try:
+                index = faiss.read_index(self.index_path)
+                if index.metric_type != faiss.METRIC_INNER_PRODUCT:
+                    raise ValueError("legacy L2 index")
+                ids = np.load(self.ids_path, allow_pickle=False)
+                files = json.loads(str(ids["files"]))
+                self.chunk_file = [files[i] for i in ids["chunk_file"].tolist()]
+                self.chunk_pos = ids["chunk_pos"].tolist()
+                self.deleted = set(ids["deleted"].tolist())
+            except Exception as e:
+                logger.error(f"Failed to load global vector index, it will be rebuilt: {e}")
+                self.index, self.chunk_file, self.chunk_pos, self.deleted = None, [], [], set()
+                return False
+            self.index = index
+            self.dim = index.d
+            self.file_chunks = {}
+            for cid, fid in enumerate(self.chunk_file):
+                if cid not in self.deleted:
+                    self.file_chunks.setdefault(fid, []).append(cid)
+            return True
+
+    def save(self, include_index: bool = True):
+        """
+        Persist the id mapping, and the HNSW graph itself unless include_index=False
+        (the graph is still written if it has unsaved additions, so the two files match)
+        """
+        with self._lock:
+            if not self.loaded:
+                return
+            include_index = include_index or self._dirty
+            self._dirty = False
+            if self.index is None:
+                for path in (self.index_path, self.ids_path):
+                    if os.path.exists(path):
+                        os.remove(path)
+                return
+            files = sorted(set(self.chunk_file))
+            file_idx = {fid: i for i, fid in enumerate(files)}
+            if include_index:
+                faiss.write_index(self.index, self.index_path + ".tmp")
+            with open(self.ids_path + ".tmp", "wb") as f:
+                np.savez(
+                    f,
+                    files=np.array(json.dumps(files)),
+                    chunk_file=np.array([file_idx[fid] for fid in self.chunk_file], dtype=np.int32),
+                    chunk_pos=np.array(self.chunk_pos, dtype=np.int32),
+                    deleted=np.array(sorted(self.deleted), dtype=np.int64),
+                )
+            if include_index:
+                os.replace(self.index_path + ".tmp", self.index_path)
+            os.replace(self.ids_path + ".tmp", self.ids_path)
+
+    def schedule_save(self):
+        """Debounced save(): changes within GLOBAL_INDEX_SAVE_DELAY seconds share one write"""
+        with self._lock:
+            self._dirty = True
+            if GLOBAL_INDEX_SAVE_DELAY <= 0:
+                self.save()
+                return
+            if self._save_timer is None:
+                self._save_timer = threading.Timer(GLOBAL_INDEX_SAVE_DELAY, self.flush)
+                self._save_timer.daemon = True
+                self._save_timer.start()
+
+    def flush(self):
+        """Write pending changes now (debounce timer, shutdown)"""
+        with self._lock:
+            timer, self._save_timer = self._save_timer, None
+            if timer is not None:
+                timer.cancel()
+            if self._dirty:
+                self.save()
+
+    def files(self) -> set:
+        return set(self.file_chunks.keys())
+
+    def add_vectors(self, file_id: str, vectors: np.ndarray):
+        """Index one file's chunk vectors (row i == chunk i of its VectorStore)"""
+        if faiss is None or vectors is None or len(vectors) == 0:
+            return
+        vectors = np.ascontiguousarray(vectors, dtype="float32")
+        with self._lock:
+            if file_id in self.file_chunks:
+                self._tombstone(file_id)
+            if self.index is None:
+                self.dim = vectors.shape[1]
+                self.index = self._new_index(self.dim)
+            elif vectors.shape[1] != self.dim:
+                logger.error(f"Global index dim {self.dim} != {vectors.shape[1]} for {file_id}, skipped")
+                return
+            start = self.index.ntotal
+            self.index.add(normalize_rows(vectors))
+            self.chunk_file.extend([file_id] * len(vectors))
+            self.chunk_pos.extend(range(len(vectors)))
+            self.file_chunks[file_id] = list(range(start, start + len(vectors)))
+
+    def add_store(self, file_id: str, vs: "VectorStore"):
+        if vs.index is None or vs.index.ntotal == 0:
+            return
+        self.add_vectors(file_id, vs.index.reconstruct_n(0, vs.index.ntotal))
+
+    def _tombstone(self, file_id: str):
+        self.deleted.update(self.file_chunks.pop(file_id, []))
+
+    def remove_file(self, file_id: str) -> bool:
+        """Tombstone a file's chunks; returns True if this triggered a compaction"""
+        with self._lock:
+            if file_id not in self.file_chunks:
+                return False
+            self._tombstone(file_id)
+            if self.index is not None and len(self.deleted) > GLOBAL_INDEX_REBUILD_RATIO * self.index.ntotal:
+                self._compact()
+                return True
+            return False
+
+    def _compact(self):
+        """Rebuild the HNSW graph without tombstoned entries (vectors are reconstructed, not re-embedded)"""
+        alive = [cid for cid in range(self.index.ntotal) if cid not in self.deleted]
+        old_index, old_file, old_pos = self.index, self.chunk_file, self.chunk_pos
+        self.index, self.chunk_file, self.chunk_pos = None, [], []
+        self.file_chunks, self.deleted = {}, set()
+        if not alive:
+            return
+        self.index = self._new_index(self.dim)
+        vectors = np.vstack([old_index.reconstruct(cid) for cid in alive]).astype("float32")
+        self.index.add(vectors)
+        for new_id, cid in enumerate(alive):
+            self.chunk_file.append(old_file[cid])
+            self.chunk_pos.append(old_pos[cid])
+            self.file_chunks.setdefault(old_file[cid], []).append(new_id)
+        logger.info(f"♻️ Global vector index compacted: {len(old_file)} -> {len(alive)} chunks")
+
+    def search(self, query_vec: np.ndarray, k: int = 20, file_ids: Optional[List[str]] = None):
+        """Returns [(file_id, chunk_pos, cosine score)], optionally restricted to file_ids"""
+        with self._lock:
+            if self.index is None or self.index.ntotal == 0 or query_vec is None:
+                return []
+            if file_ids is not None:
+                allowed = [cid for fid in file_ids for cid in self.file_chunks.get(fid, [])]
+                if not allowed:
+                    return []
+                selector = faiss.IDSelectorBatch(np.array(allowed, dtype=np.int64))
+            elif self.deleted:
+                excluded = faiss.IDSelectorBatch(np.array(sorted(self.deleted), dtype=np.int64))
+                selector = faiss.IDSelectorNot(excluded)
+            else:
+                selector = None
+            params = faiss.SearchParametersHNSW(sel=selector, efSearch=max(GLOBAL_INDEX_EF_SEARCH, k)) if selector else None
+            query_vec = normalize_rows(np.asarray(query_vec, dtype="float32").reshape(1, -1))
+            if query_vec.shape[1] != self.dim:
+                return []
+            distances, ids = self.index.search(query_vec, k, params=params)
+            results = []
+            for dist, cid in zip(distances[0], ids[0]):
+                if cid < 0 or cid in self.deleted:
+                    continue
+                results.append((self.chunk_file[cid], self.chunk_pos[cid], float(dist)))
+            return results
+
+# ======================
+# Persistent Store Cache
+# ======================
+class VectorStoreCache:
+    """
+    Dict-like {file_id: VectorStore} backed by on-disk indexes.
+
+    Stores are written to INDEX_DIR when added, loaded lazily on first access
+    after a restart, and evicted (least recently used first) once the resident
+    size exceeds max_bytes. Evicted stores are simply reloaded from disk.
+    """
+
+    def __init__(self, index_dir: str = INDEX_DIR, max_bytes: int = VECTOR_CACHE_MAX_BYTES):
+        self.index_dir = index_dir
+        self.max_bytes = max_bytes
+        self.global_index = GlobalVectorIndex(index_dir)
+        self._stores: "OrderedDict[str, VectorStore]" = OrderedDict()
+        self._sizes: Dict[str, int] = {}
+        self._resident_bytes = 0
+        self._lock = threading.RLock()
+        os.makedirs(self.index_dir, exist_ok=True)
+
+    def _paths(self, file_id: str):
+        return (
+            os.path.join(self.index_dir, f"{file_id}.faiss"),
+            os.path.join(self.index_dir, f"{file_id}.meta.json"),
+        )
+
+    def _on_disk(self, file_id: str) -> bool:
+        index_path, meta_path = self._paths(file_id)
+        return os.path.exists(index_path) and os.path.exists(meta_path)
+
+    def _remember(self, file_id: str, vs: VectorStore):
+        size = vs.nbytes
+        self._resident_bytes += size - self._sizes.get(file_id, 0)
+        self._sizes[file_id] = size
+        self._stores[file_id] = vs
+        self._stores.move_to_end(file_id)
+        # Evict least recently used stores, but always keep the newest one
+        while self._resident_bytes > self.max_bytes and len(self._stores) > 1:
+            old_id, _ = self._stores.popitem(last=False)
+            self._resident_bytes -= self._sizes.pop(old_id, 0)
+            logger.info(f"♻️ Evicted vector index from memory: {old_id}")
+
+    def put(self, file_id: str, vs: VectorStore, persist: bool = True):
+        """Register a store; persist=True also writes it to disk"""
+        if persist:
+            index_path, meta_path = self._paths(file_id)
+            try:
+                vs.save(index_path, meta_path)
+            except Exception as e:
+                logger.error(f"Failed to persist vector index {file_id}: {e}")
+            try:
+                self.ensure_global_index()
+                self.global_index.add_store(file_id, vs)
+                self.global_index.schedule_save()
+            except Exception as e:
+                logger.error(f"Failed to add {file_id} to global vector index: {e}")
+        with self._lock:
+            self._remember(file_id, vs)
+
+    def get(self, file_id: str, default=None) -> Optional[VectorStore]:
+        with self._lock:
+            vs = self._stores.get(file_id)
+            if vs is not None:
+                self._stores.move_to_end(file_id)
+                return vs
+        if not self._on_disk(file_id):
+            return default
+        try:
+            vs = VectorStore.load(*self._paths(file_id))
+            if vs.stale:
+                # Upgraded on load (legacy L2 index or swapped model): write it back once
+                vs.save(*self._paths(file_id))
+                if self.global_index.loaded:
+                    self.global_index.add_store(file_id, vs)
+                    self.global_index.schedule_save()
+        except Exception as e:
+            logger.error(f"Failed to load vector index {file_id}: {e}")
+            return default
+        with self._lock:
+            # Another thread may have loaded it meanwhile
+            if file_id in self._stores:
+                return self._stores[file_id]
+            self._remember(file_id, vs)
+        logger.info(f"📂 Loaded vector index from disk: {file_id}")
+        return vs
+
+    def alias(self, source_id: str, file_id: str, metadata_overrides: Optional[dict] = None) -> Optional[VectorStore]:
+        """
+        Register file_id as a copy of source_id's store (identical upload).
+        Vectors are copied, not re-embedded; chunk metadata gets metadata_overrides
+        (e.g. the new file_id / filename) so search results point at the alias.
+        """
+        metadata_overrides = metadata_overrides or {}
+        src = self.get(source_id)
+        if src is None or src.index is None:
+            return None
+        vs = VectorStore()
+        with src._lock:
+            vs.index = faiss.clone_index(src.index)
+            vs.dim = src.dim
+            vs.model_id = src.model_id
+            vs.chunks = list(src.chunks)
+            vs.metadata = [{**meta, **metadata_overrides} for meta in src.metadata]
+        self.put(file_id, vs)
+        return vs
+
+    def ensure_global_index(self):
+        """Load the corpus-wide index and reconcile it with the per-file indexes on disk"""
+        if self.global_index.loaded or faiss is None:
+            return
+        with self.global_index._lock:
+            if self.global_index.loaded:
+                return
+            self.global_index.load()
+            on_disk = {fid for fid in self.keys() if self._on_disk(fid)}
+            indexed = self.global_index.files()
+            missing, stale = on_disk - indexed, indexed - on_disk
+            for fid in stale:
+                self.global_index.remove_file(fid)
+            for fid in missing:
+                # Rebuilt from the stored vectors: no re-embedding needed
+                vs = self.get(fid)
+                if vs is not None:
+                    self.global_index.add_store(fid, vs)
+            if missing or stale:
+                logger.info(f"🌐 Global vector index reconciled (+{len(missing)} / -{len(stale)} files)")
+                self.global_index.schedule_save()
+
+    def search_corpus(self, query_vec: np.ndarray, k: int = 20, file_ids: Optional[List[str]] = None,
+                      min_score: Optional[float] = None):
+        """
+        Search every file with one pre-computed query vector.
+        Returns the same dicts as VectorStore.search, best first.
+        """
+        self.ensure_global_index()
+        results = []
+        for fid, pos, score in self.global_index.search(query_vec, k=k, file_ids=file_ids):
+            if min_score is not None and score < min_score:
+                continue
+            vs = self.get(fid)
+            if vs is None or pos >= len(vs.chunks):
+                continue
+            results.append({
+                "text": vs.chunks[pos],
+                "metadata": vs.metadata[pos] if pos < len(vs.metadata) else {},
+                "score": score
+            })
+        return results
+
+    def evict(self, file_id: str):
+        """Drop a store from memory only (it stays on disk)"""
+        with self._lock:
+            if self._stores.pop(file_id, None) is not None:
+                self._resident_bytes -= self._sizes.pop(file_id, 0)
+
+    def flush(self):
+        """Write pending global index changes to disk (shutdown)"""
+        self.global_index.flush()
+
+    def keys(self) -> List[str]:
+        """All known file_ids: resident ones plus every index persisted on disk"""
+        ids = set(self._stores.keys())
+        try:
+            for name in os.listdir(self.index_dir):
+                if name.endswith(".faiss") and not name.startswith("_"):
+                    ids.add(name[:-len(".faiss")])
+        except FileNotFoundError:
+            pass
+        return list(ids)
+
+    def items(self):
+        for file_id in self.keys():
+            vs = self.get(file_id)
+            if vs is not None:
+                yield file_id, vs
+
+    def __contains__(self, file_id: str) -> bool:
+        return file_id in self._stores or self._on_disk(file_id)
+
+    def __getitem__(self, file_id: str) -> VectorStore:
+        vs = self.get(file_id)
+        if vs is None:
+            raise KeyError(file_id)
+        return vs
+
+    def __setitem__(self, file_id: str, vs: VectorStore):
+        self.put(file_id, vs)
+
+    def __delitem__(self, file_id: str):
+        """Remove from memory AND disk (used when the file itself is deleted)"""
+        self.evict(file_id)
+        try:
+            # If the global index is not loaded yet, the reconcile on load drops this file
+            if self.global_index.loaded:
+                compacted = self.global_index.remove_file(file_id)
+                self.global_index.save(include_index=compacted)
+        except Exception as e:
+            logger.error(f"Failed to remove {file_id} from global vector index: {e}")
+        for path in self._paths(file_id):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                logger.error(f"Failed to remove vector index file {path}: {e}")
+
+    def __len__(self) -> int:
+        return len(self.keys())
+
 # ======================
 # Global Store
 # ======================
-# Use memory storage (in-memory, strictly server-side)
-VECTOR_STORES: Dict[str, VectorStore] = {}  # {file_id: VectorStore}
+# Persisted per-file indexes with an in-memory LRU (see VectorStoreCache)
+VECTOR_STORES = VectorStoreCache()  # {file_id: VectorStore}
 GLOBAL_HISTORY_STORE = VectorStore() # Global history vector store
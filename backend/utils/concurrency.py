@@ -0,0 +1,18 @@
+"""并发配置解析（PDF 任务池、分析调度器、共享 HTTP 客户端共用）"""
+import logging
+from typing import Dict
+
+logger = logging.getLogger(__name__)
+
+
+def parse_concurrency(spec: str, setting: str = "concurrency") -> Dict[str, int]:
+    """解析 "merge=1,compress=2" 形式的按名称并发上限（每项至少为 1，无效项忽略）"""
+    limits = {}
+    for part in (spec or "").split(","):
+        if "=" in part:
+            op, _, value = part.partition("=")
+            try:
+                limits[op.strip()] = max(1, int(value))
+            except ValueError:
+                logger.warning(f"Ignoring invalid {setting} entry: {part}")
+    return limits
@@ -0,0 +1,273 @@
+"""
+应用级共享 HTTP 客户端（DashScope / Qwen 调用统一入口）
+
+- 每个事件循环一个 httpx.AsyncClient，连接池 + keep-alive，安装了 h2 时启用 HTTP/2，
+  避免每次调用都重新建立 TCP/TLS 连接；
+- 全局并发上限 + 按调用方（route）的并发上限：先取 route 名额再取全局名额，
+  某个 route 的突发请求只在自己的队列里等待，不会占满全局名额挡住其它 route；
+- 统一的重试与指数退避：超时、网络错误、429 和 5xx 会重试（遵循 Retry-After）；
+- 同步调用（call_qwen）共用一个线程安全的 httpx.Client。
+"""
+import os
+import json
+import time
+import random
+import asyncio
+import logging
+import threading
+from typing import Any, AsyncIterator, Dict, Optional
+
+import httpx
+
+from utils.concurrency import parse_concurrency
+
+logger = logging.getLogger(__name__)
+
+# ======================
+# 配置
+# ======================
+DASHSCOPE_BASE_URL = os.getenv("DASHSCOPE_BASE_URL", "https://dashscope.aliyuncs.com").rstrip("/")
+DASHSCOPE_GENERATION_PATH = "/api/v1/services/aigc/text-generation/generation"
+
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "32"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "16"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "90"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "10"))
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "1").lower() in ("1", "true", "yes")
+# 同时在途的请求数：全局上限 + 按调用方的上限（如 "rag=4,kg=2"，未列出的使用默认值）
+HTTP_MAX_CONCURRENCY = int(os.getenv("HTTP_MAX_CONCURRENCY", "16"))
+HTTP_ROUTE_CONCURRENCY = os.getenv("HTTP_ROUTE_CONCURRENCY", "rag=6,evaluate=2,kg=2,mindmap=2,classify=4,anomaly=2,qwen=4")
+HTTP_DEFAULT_ROUTE_CONCURRENCY = int(os.getenv("HTTP_DEFAULT_ROUTE_CONCURRENCY", "4"))
+# 重试：第 n 次重试等待 HTTP_RETRY_BASE_SECONDS * 2^(n-1)（带抖动，最多 HTTP_RETRY_MAX_SECONDS）
+HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", "2"))
+HTTP_RETRY_BASE_SECONDS = float(os.getenv("HTTP_RETRY_BASE_SECONDS", "2"))
+HTTP_RETRY_MAX_SECONDS = float(os.getenv("HTTP_RETRY_MAX_SECONDS", "30"))
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+_ROUTE_LIMITS = parse_concurrency(HTTP_ROUTE_CONCURRENCY, "HTTP_ROUTE_CONCURRENCY")
+
+
+def _http2_available() -> bool:
+    if not HTTP2_ENABLED:
+        return False
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        logger.warning("h2 未安装，共享 HTTP 客户端使用 HTTP/1.1 keep-alive（pip install h2 启用 HTTP/2）")
+        return False
+
+
+def _client_kwargs() -> Dict[str, Any]:
+    return {
+        "http2": _http2_available(),
+        "limits": httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+        ),
+        "timeout": httpx.Timeout(60.0, connect=HTTP_CONNECT_TIMEOUT),
+    }
+
+
+# ======================
+# 客户端
+# ======================
+class _LoopState:
+    """一个事件循环内共享的 AsyncClient 与信号量（httpx/asyncio 对象不能跨事件循环使用）"""
+
+    def __init__(self):
+        self.client = httpx.AsyncClient(**_client_kwargs())
+        self.global_limit = asyncio.Semaphore(HTTP_MAX_CONCURRENCY)
+        self.route_limits: Dict[str, asyncio.Semaphore] = {}
+
+    def route_limit(self, route: str) -> asyncio.Semaphore:
+        sem = self.route_limits.get(route)
+        if sem is None:
+            sem = self.route_limits[route] = asyncio.Semaphore(
+                _ROUTE_LIMITS.get(route, HTTP_DEFAULT_ROUTE_CONCURRENCY)
+            )
+        return sem
+
+
+_loop_states: Dict[int, tuple] = {}
+_states_lock = threading.Lock()
+_sync_client: Optional[httpx.Client] = None
+
+
+def _state() -> _LoopState:
+    loop = asyncio.get_running_loop()
+    with _states_lock:
+        entry = _loop_states.get(id(loop))
+        if entry is None or entry[0] is not loop:
+            # 主应用只有一个事件循环；在其它循环中（如线程里的 asyncio.run）各自创建
+            for key in [k for k, (l, _) in _loop_states.items() if l.is_closed()]:
+                del _loop_states[key]
+            entry = _loop_states[id(loop)] = (loop, _LoopState())
+        return entry[1]
+
+
+def get_async_client() -> httpx.AsyncClient:
+    """当前事件循环共享的 AsyncClient（不要用 async with 关闭它）"""
+    return _state().client
+
+
+def get_sync_client() -> httpx.Client:
+    """进程内共享的同步客户端（线程安全，带连接池）"""
+    global _sync_client
+    if _sync_client is None:
+        with _states_lock:
+            if _sync_client is None:
+                _sync_client = httpx.Client(**_client_kwargs())
+    return _sync_client
+
+
+async def close_http_clients():
+    """应用关闭时调用：关闭当前循环的 AsyncClient 和同步客户端"""
+    global _sync_client
+    loop = asyncio.get_running_loop()
+    with _states_lock:
+        entry = _loop_states.pop(id(loop), None)
+    if entry is not None:
+        await entry[1].client.aclose()
+    if _sync_client is not None:
+        _sync_client.close()
+        _sync_client = None
+
+
+# ======================
+# 重试
+# ======================
+def _retry_delay(attempt: int, response: Optional[httpx.Response] = None) -> float:
+    if response is not None:
+        retry_after = response.headers.get("Retry-After")
+        if retry_after and retry_after.strip().isdigit():
+            return min(HTTP_RETRY_MAX_SECONDS, float(retry_after))
+    delay = HTTP_RETRY_BASE_SECONDS * (2 ** (attempt - 1))
+    return min(HTTP_RETRY_MAX_SECONDS, delay * (0.8 + 0.4 * random.random()))
+
+
+async def post_json(url: str, payload: Dict[str, Any], *, route: str = "default",
+                    headers: Optional[Dict[str, str]] = None, timeout: Optional[float] = None,
+                    retries: Optional[int] = None) -> httpx.Response:
+    """
+    通过共享客户端 POST JSON。超时/网络错误在重试用尽后抛出（httpx.TimeoutException 等
+    httpx.RequestError 子类）；429/5xx 在重试用尽后返回最后一次响应，由调用方处理状态码。
+    """
+    state = _state()
+    retries = HTTP_RETRIES if retries is None else retries
+    request_timeout = httpx.Timeout(timeout, connect=HTTP_CONNECT_TIMEOUT) if timeout else httpx.USE_CLIENT_DEFAULT
+    attempt = 0
+    while True:
+        attempt += 1
+        response = None
+        try:
+            async with state.route_limit(route), state.global_limit:
+                response = await state.client.post(url, json=payload, headers=headers, timeout=request_timeout)
+            if response.status_code not in RETRY_STATUS_CODES or attempt > retries:
+                return response
+            logger.warning(f"[{route}] HTTP {response.status_code}，第 {attempt}/{retries + 1} 次请求失败，准备重试")
+        except httpx.TransportError as e:
+            if attempt > retries:
+                raise
+            logger.warning(f"[{route}] 请求失败（{type(e).__name__}: {e}），第 {attempt}/{retries + 1} 次，准备重试")
+        await asyncio.sleep(_retry_delay(attempt, response))
+
+
+def post_json_sync(url: str, payload: Dict[str, Any], *, route: str = "default",
+                   headers: Optional[Dict[str, str]] = None, timeout: Optional[float] = None,
+                   retries: Optional[int] = None) -> httpx.Response:
+    """post_json 的同步版本（共享 httpx.Client，同样的重试策略，无并发限制）"""
+    client = get_sync_client()
+    retries = HTTP_RETRIES if retries is None else retries
+    request_timeout = httpx.Timeout(timeout, connect=HTTP_CONNECT_TIMEOUT) if timeout else httpx.USE_CLIENT_DEFAULT
+    attempt = 0
+    while True:
+        attempt += 1
+        response = None
+        try:
+            response = client.post(url, json=payload, headers=headers, timeout=request_timeout)
+            if response.status_code not in RETRY_STATUS_CODES or attempt > retries:
+                return response
+            logger.warning(f"[{route}] HTTP {response.status_code}，第 {attempt}/{retries + 1} 次请求失败，准备重试")
+        except httpx.TransportError as e:
+            if attempt > retries:
+                raise
+            logger.warning(f"[{route}] 请求失败（{type(e).__name__}: {e}），第 {attempt}/{retries + 1} 次，准备重试")
+        time.sleep(_retry_delay(attempt, response))
+
+
+# ======================
+# DashScope
+# ======================
+def dashscope_headers(api_key: Optional[str] = None) -> Dict[str, str]:
+    api_key = api_key or os.getenv("DASHSCOPE_API_KEY") or os.getenv("QWEN_API_KEY")
+    return {
+        "Authorization": f"Bearer {api_key}",
+        "Content-Type": "application/json"
+    }
+
+
+async def dashscope_generate(payload: Dict[str, Any], *, route: str, api_key: Optional[str] = None,
+                             timeout: Optional[float] = None, retries: Optional[int] = None) -> httpx.Response:
+    """调用 DashScope 文本生成接口（DASHSCOPE_BASE_URL 可指向代理或本地桩服务）"""
+    return await post_json(DASHSCOPE_BASE_URL + DASHSCOPE_GENERATION_PATH, payload, route=route,
+                           headers=dashscope_headers(api_key), timeout=timeout, retries=retries)
+
+
+async def dashscope_stream(payload: Dict[str, Any], *, route: str, api_key: Optional[str] = None,
+                           timeout: Optional[float] = None, retries: Optional[int] = None) -> AsyncIterator[str]:
+    """
+    以 SSE 方式调用 DashScope 文本生成（incremental_output），逐段产出新增文本。
+
+    只在收到第一段数据之前重试（连接失败、超时、429/5xx）；开始输出后出错直接抛出，
+    避免重复输出。非 2xx 响应在重试用尽后抛出 httpx.HTTPStatusError。
+    """
+    state = _state()
+    retries = HTTP_RETRIES if retries is None else retries
+    request_timeout = httpx.Timeout(timeout, connect=HTTP_CONNECT_TIMEOUT) if timeout else httpx.USE_CLIENT_DEFAULT
+    payload = {**payload, "parameters": {**payload.get("parameters", {}), "incremental_output": True}}
+    headers = {**dashscope_headers(api_key), "Accept": "text/event-stream", "X-DashScope-SSE": "enable"}
+    url = DASHSCOPE_BASE_URL + DASHSCOPE_GENERATION_PATH
+    attempt = 0
+    while True:
+        attempt += 1
+        response = None
+        started = False
+        try:
+            async with state.route_limit(route), state.global_limit:
+                async with state.client.stream("POST", url, json=payload, headers=headers,
+                                               timeout=request_timeout) as response:
+                    if response.status_code in RETRY_STATUS_CODES and attempt <= retries:
+                        logger.warning(f"[{route}] HTTP {response.status_code}，第 {attempt}/{retries + 1} 次请求失败，准备重试")
+                    else:
+                        if response.status_code >= 400:
+                            await response.aread()
+                        response.raise_for_status()
+                        async for line in response.aiter_lines():
+                            if not line.startswith("data:"):
+                                continue
+                            data = json.loads(line[5:])
+                            if data.get("code"):
+                                raise RuntimeError(f"DashScope error {data.get('code')}: {data.get('message')}")
+                            output = data.get("output", {})
+                            choices = output.get("choices")
+                            if choices:
+                                delta = choices[0].get("message", {}).get("content", "")
+                            else:
+                                delta = output.get("text", "")
+                            if delta:
+                                started = True
+                                yield delta
+                        return
+        except httpx.TransportError as e:
+            if started or attempt > retries:
+                raise
+            logger.warning(f"[{route}] 请求失败（{type(e).__name__}: {e}），第 {attempt}/{retries + 1} 次，准备重试")
+        await asyncio.sleep(_retry_delay(attempt, response))
+
+
+def dashscope_generate_sync(payload: Dict[str, Any], *, route: str, api_key: Optional[str] = None,
+                            timeout: Optional[float] = None, retries: Optional[int] = None) -> httpx.Response:
+    return post_json_sync(DASHSCOPE_BASE_URL + DASHSCOPE_GENERATION_PATH, payload, route=route,
+                          headers=dashscope_headers(api_key), timeout=timeout, retries=retries)
@@ -1,15 +1,15 @@
 import os
-import requests
 import httpx
 import json
 from dotenv import load_dotenv
 
+from utils.http_client import dashscope_generate, dashscope_generate_sync
+
 # 从项目根目录加载.env文件
 load_dotenv(dotenv_path=os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '.env'))
 
 # 优先使用DASHSCOPE_API_KEY，兼容旧的QWEN_API_KEY
 QWEN_API_KEY = os.getenv("DASHSCOPE_API_KEY") or os.getenv("QWEN_API_KEY")
-QWEN_URL = "https://dashscope.aliyuncs.com/api/v1/services/aigc/text-generation/generation"
 
 def call_qwen(prompt: str, timeout: int = 60, enable_search: bool = False) -> str:
     """
@@ -29,10 +29,6 @@ def call_qwen(prompt: str, timeout: int = 60, enable_search: bool = False) -> st
         print("❌ QWEN_API_KEY 未设置，请检查 .env 文件")
         return ""
 
-    headers = {
-        "Authorization": f"Bearer {QWEN_API_KEY}",
-        "Content-Type": "application/json"
-    }
     data = {
         "model": "qwen-max",
         "input": {"messages": [{"role": "user", "content": prompt}]},
@@ -44,7 +40,8 @@ def call_qwen(prompt: str, timeout: int = 60, enable_search: bool = False) -> st
     }
 
     try:
-        resp = requests.post(QWEN_URL, json=data, headers=headers, timeout=timeout)
+        # 共享连接池 + 统一重试（utils/http_client.py）
+        resp = dashscope_generate_sync(data, route="qwen", api_key=QWEN_API_KEY, timeout=timeout)
 
         if resp.status_code == 200:
             result = resp.json()
@@ -72,10 +69,10 @@ def call_qwen(prompt: str, timeout: int = 60, enable_search: bool = False) -> st
                 pass
             return ""
 
-    except requests.exceptions.Timeout:
+    except httpx.TimeoutException:
         print("❌ Qwen API request timeout")
         return ""
-    except requests.exceptions.RequestException as e:
+    except httpx.RequestError as e:
         print(f"❌ Network error when calling Qwen API: {e}")
         return ""
     except Exception as e:
@@ -98,10 +95,6 @@ async def async_call_qwen(prompt: str, timeout: int = 60, enable_search: bool =
         print("❌ QWEN_API_KEY 未设置，请检查 .env 文件")
         return ""
 
-    headers = {
-        "Authorization": f"Bearer {QWEN_API_KEY}",
-        "Content-Type": "application/json"
-    }
     data = {
         "model": "qwen-max",
         "input": {"messages": [{"role": "user", "content": prompt}]},
@@ -112,8 +105,7 @@ async def async_call_qwen(prompt: str, timeout: int = 60, enable_search: bool =
     }
 
     try:
-        async with httpx.AsyncClient() as client:
-            resp = await client.post(QWEN_URL, json=data, headers=headers, timeout=timeout)
+        resp = await dashscope_generate(data, route="qwen", api_key=QWEN_API_KEY, timeout=timeout)
 
         if resp.status_code == 200:
             result = resp.json()